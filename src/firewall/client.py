@@ -2939,6 +2939,8 @@ class FirewallClient:
             # ipset callbacks
             "ipset-entry-added": "EntryAdded",
             "ipset-entry-removed": "EntryRemoved",
+            "ipset-entries-added": "EntriesAdded",
+            "ipset-entries-removed": "EntriesRemoved",
             # direct callbacks
             "direct:chain-added": "ChainAdded",
             "direct:chain-removed": "ChainRemoved",
@@ -3219,6 +3221,14 @@ class FirewallClient:
     def setEntries(self, ipset, entries):
         return self.fw_ipset.setEntries(ipset, entries)
 
+    @handle_exceptions
+    def addEntries(self, ipset, entries):
+        return dbus_to_python(self.fw_ipset.addEntries(ipset, entries))
+
+    @handle_exceptions
+    def removeEntries(self, ipset, entries):
+        return dbus_to_python(self.fw_ipset.removeEntries(ipset, entries))
+
     @handle_exceptions
     def removeEntry(self, ipset, entry):
         self.fw_ipset.removeEntry(ipset, entry)
@@ -3284,6 +3294,50 @@ class FirewallClient:
     def setDefaultZone(self, zone):
         self.fw.setDefaultZone(zone)
 
+    # runtime snapshot
+
+    @handle_exceptions
+    def getRuntimeSnapshot(self, epoch=None, generation=None,
+                           ipset_entries=True):
+        # returns None if the runtime state is still at generation of epoch
+        options = { "ipset_entries": ipset_entries }
+        if epoch is not None:
+            options["epoch"] = epoch
+        if generation is not None:
+            options["generation"] = dbus.UInt64(generation)
+        snapshot = dbus_to_python(self.fw.getRuntimeSnapshot(options))
+        if "zones" not in snapshot:
+            return None
+        snapshot["zones"] = { zone: FirewallClientZoneSettings(settings)
+                              for (zone, settings)
+                              in snapshot["zones"].items() }
+        snapshot["policies"] = { policy: FirewallClientPolicySettings(settings)
+                                 for (policy, settings)
+                                 in snapshot["policies"].items() }
+        snapshot["ipsets"] = { ipset: FirewallClientIPSetSettings(list(settings))
+                               for (ipset, settings)
+                               in snapshot["ipsets"].items() }
+        return snapshot
+
+    @handle_exceptions
+    def getChangesSince(self, epoch, generation):
+        # returns (epoch, generation, complete, changes), see
+        # getRuntimeSnapshot if complete is False
+        return dbus_to_python(self.fw.getChangesSince(epoch,
+                                                      dbus.UInt64(generation)))
+
+    # timeouts
+
+    @handle_exceptions
+    def getTimeouts(self):
+        return dbus_to_python(self.fw.getTimeouts())
+
+    # sender cache
+
+    @handle_exceptions
+    def getSenderCacheStats(self):
+        return dbus_to_python(self.fw.getSenderCacheStats())
+
     # zone
 
     @handle_exceptions
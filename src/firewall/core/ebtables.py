@@ -19,9 +19,9 @@
 #
 
 import os.path
-from firewall.core.prog import runProg
+from firewall.core.prog import runProg, runProgStream
 from firewall.core.logger import log
-from firewall.functions import tempFile, readfile, splitArgs
+from firewall.functions import splitArgs
 from firewall.config import COMMANDS
 from firewall.core import ipXtables # some common stuff lives there
 from firewall.errors import FirewallError, INVALID_IPV
@@ -132,9 +132,10 @@ class ebtables:
     def reverse_passthrough(self, args):
         return ipXtables.common_reverse_passthrough(args)
 
-    def set_rules(self, rules, log_denied):
-        temp_file = tempFile()
+    def reverse_rule(self, rule):
+        return ipXtables.common_reverse_rule(rule)
 
+    def set_rules(self, rules, log_denied):
         table = "filter"
         table_rules = { }
         for _rule in rules:
@@ -164,33 +165,19 @@ class ebtables:
 
             table_rules.setdefault(table, []).append(rule)
 
-        for table in table_rules:
-            temp_file.write("*%s\n" % table)
-            for rule in table_rules[table]:
-                temp_file.write(" ".join(rule) + "\n")
+        def restore_input():
+            for table in table_rules:
+                yield "*%s\n" % table
+                for rule in table_rules[table]:
+                    yield " ".join(rule) + "\n"
 
-        temp_file.close()
-
-        stat = os.stat(temp_file.name)
-        log.debug2("%s: %s %s", self.__class__, self._restore_command,
-                   "%s: %d" % (temp_file.name, stat.st_size))
         args = [ ]
         args.append("--noflush")
+        log.debug2("%s: %s %s", self.__class__, self._restore_command,
+                   " ".join(args))
 
-        (status, ret) = runProg(self._restore_command, args,
-                                stdin=temp_file.name)
-
-        if log.getDebugLogLevel() > 2:
-            lines = readfile(temp_file.name)
-            if lines is not None:
-                i = 1
-                for line in lines:
-                    log.debug3("%8d: %s" % (i, line), nofmt=1, nl=0)
-                    if not line.endswith("\n"):
-                        log.debug3("", nofmt=1)
-                    i += 1
-
-        os.unlink(temp_file.name)
+        (status, ret) = runProgStream(self._restore_command, args,
+                                      restore_input())
 
         if status != 0:
             raise ValueError("'%s %s' failed: %s" % (self._restore_command,
@@ -0,0 +1,72 @@
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Queue of expiring runtime settings"""
+
+import heapq
+import itertools
+import math
+
+class ExpiryQueue:
+    """Deadlines of timed runtime settings, ordered in a heap.
+
+    Deadlines are rounded up to whole ticks, so that all items that expire
+    in the same tick are returned together by pop_expired() and can be
+    removed in a single transaction. The owner only needs one timer that is
+    armed for next_deadline().
+
+    Removing or replacing an item only drops it from the lookup dict; the
+    stale heap entry is skipped once it reaches the top.
+    """
+    def __init__(self, tick=1):
+        self.tick = tick
+        self._heap = [ ]
+        self._items = { }
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def clear(self):
+        self._heap.clear()
+        self._items.clear()
+
+    def add(self, key, timeout, now):
+        """Add key expiring timeout seconds after now, replacing an existing
+        entry for key. Returns the deadline."""
+        deadline = math.ceil((now + timeout) / self.tick) * self.tick
+        entry = (deadline, next(self._counter), key)
+        self._items[key] = entry
+        heapq.heappush(self._heap, entry)
+        return deadline
+
+    def remove(self, key):
+        """Remove key. Returns True if it was queued."""
+        return self._items.pop(key, None) is not None
+
+    def next_deadline(self):
+        """Returns the earliest deadline or None if the queue is empty."""
+        heap = self._heap
+        while heap and self._items.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_expired(self, now):
+        """Remove and return the keys with a deadline not after now, in the
+        order of their deadlines."""
+        expired = [ ]
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            if self._items.get(entry[2]) is entry:
+                del self._items[entry[2]]
+                expired.append(entry[2])
+        return expired
+
+    def pending(self, now):
+        """Returns a list of (key, remaining seconds) sorted by deadline."""
+        return [(key, max(0, deadline - now)) for (deadline, _, key)
+                in sorted(self._items.values())]
@@ -23,6 +23,9 @@ import sys
 import copy
 import time
 import traceback
+import itertools
+import multiprocessing
+import concurrent.futures
 from typing import Dict, List
 from firewall import config
 from firewall import functions
@@ -49,15 +52,28 @@ from firewall.core.io.direct import Direct
 from firewall.core.io.service import service_reader
 from firewall.core.io.icmptype import icmptype_reader
 from firewall.core.io.zone import zone_reader, Zone
-from firewall.core.io.ipset import ipset_reader
+from firewall.core.io.ipset import ipset_reader, ipset_entries_file_name
 from firewall.core.ipset import IPSET_TYPES
 from firewall.core.io.helper import helper_reader
 from firewall.core.io.policy import policy_reader
 from firewall.core.io.functions import check_on_disk_config
+from firewall.core.io.config_cache import ConfigCache
 from firewall.core.rich import Rich_Rule
 from firewall import errors
 from firewall.errors import FirewallError
 
+# Directories with at least this many config files are parsed in parallel
+LOADER_PARALLEL_MIN_FILES = 256
+LOADER_MAX_WORKERS = 8
+
+def _is_single_threaded():
+    """Return True if the process has only one thread, including threads
+    that have not been started by Python"""
+    try:
+        return len(os.listdir("/proc/self/task")) == 1
+    except OSError:
+        return False
+
 ############################################################################
 #
 # class Firewall
@@ -87,6 +103,11 @@ class Firewall:
         self.helper = FirewallHelper(self)
         self.policy = FirewallPolicy(self)
 
+        if not offline:
+            self._config_cache = ConfigCache(config.FIREWALLD_CONFIG_CACHE)
+        else:
+            self._config_cache = None
+
         self.__init_vars()
 
     def __repr__(self):
@@ -118,6 +139,11 @@ class Firewall:
         self._allow_zone_drifting = config.FALLBACK_ALLOW_ZONE_DRIFTING
         self._nftables_flowtable = config.FALLBACK_NFTABLES_FLOWTABLE
         self._nftables_counters = config.FALLBACK_NFTABLES_COUNTERS
+        self._incremental_reload = config.FALLBACK_INCREMENTAL_RELOAD
+        self._nftables_aggregate_ports = config.FALLBACK_NFTABLES_AGGREGATE_PORTS
+        self._nftables_dispatch_maps = config.FALLBACK_NFTABLES_DISPATCH_MAPS
+        self._ipset_entry_journal = config.FALLBACK_IPSET_ENTRY_JOURNAL
+        self._concurrent_backends = config.FALLBACK_CONCURRENT_BACKENDS
 
         if self._offline:
             self.ip4tables_enabled = False
@@ -386,6 +412,46 @@ class Firewall:
                     self._nftables_counters = True
                 log.debug1("NftablesCounters is set to '%s'", self._nftables_counters)
 
+            if self._firewalld_conf.get("IncrementalReload"):
+                value = self._firewalld_conf.get("IncrementalReload")
+                if value.lower() in [ "no", "false" ]:
+                    self._incremental_reload = False
+                else:
+                    self._incremental_reload = True
+                log.debug1("IncrementalReload is set to '%s'", self._incremental_reload)
+
+            if self._firewalld_conf.get("NftablesAggregatePorts"):
+                value = self._firewalld_conf.get("NftablesAggregatePorts")
+                if value.lower() in [ "no", "false" ]:
+                    self._nftables_aggregate_ports = False
+                else:
+                    self._nftables_aggregate_ports = True
+                log.debug1("NftablesAggregatePorts is set to '%s'", self._nftables_aggregate_ports)
+
+            if self._firewalld_conf.get("NftablesDispatchMaps"):
+                value = self._firewalld_conf.get("NftablesDispatchMaps")
+                if value.lower() in [ "no", "false" ]:
+                    self._nftables_dispatch_maps = False
+                else:
+                    self._nftables_dispatch_maps = True
+                log.debug1("NftablesDispatchMaps is set to '%s'", self._nftables_dispatch_maps)
+
+            if self._firewalld_conf.get("IPSetEntryJournal"):
+                value = self._firewalld_conf.get("IPSetEntryJournal")
+                if value.lower() in [ "no", "false" ]:
+                    self._ipset_entry_journal = False
+                else:
+                    self._ipset_entry_journal = True
+                log.debug1("IPSetEntryJournal is set to '%s'", self._ipset_entry_journal)
+
+            if self._firewalld_conf.get("ConcurrentBackends"):
+                value = self._firewalld_conf.get("ConcurrentBackends")
+                if value.lower() in [ "no", "false" ]:
+                    self._concurrent_backends = False
+                else:
+                    self._concurrent_backends = True
+                log.debug1("ConcurrentBackends is set to '%s'", self._concurrent_backends)
+
         self.config.set_firewalld_conf(copy.deepcopy(self._firewalld_conf))
 
     def _start_load_lockdown_whitelist(self):
@@ -404,21 +470,32 @@ class Firewall:
         # copy policies to config interface
         self.config.set_policies(copy.deepcopy(self.policies))
 
-    def _start_load_stock_config(self):
-        self._loader_ipsets(config.FIREWALLD_IPSETS)
-        self._loader_icmptypes(config.FIREWALLD_ICMPTYPES)
-        self._loader_helpers(config.FIREWALLD_HELPERS)
-        self._loader_services(config.FIREWALLD_SERVICES)
-        self._loader_zones(config.FIREWALLD_ZONES)
-        self._loader_policies(config.FIREWALLD_POLICIES)
-
-    def _start_load_user_config(self):
-        self._loader_ipsets(config.ETC_FIREWALLD_IPSETS)
-        self._loader_icmptypes(config.ETC_FIREWALLD_ICMPTYPES)
-        self._loader_helpers(config.ETC_FIREWALLD_HELPERS)
-        self._loader_services(config.ETC_FIREWALLD_SERVICES)
-        self._loader_zones(config.ETC_FIREWALLD_ZONES)
-        self._loader_policies(config.ETC_FIREWALLD_POLICIES)
+    def _start_load_config(self, fw_config):
+        tm = time.time()
+        if self._config_cache is not None:
+            self._config_cache.read()
+        self._start_load_stock_config(fw_config)
+        self._start_load_user_config(fw_config)
+        if self._config_cache is not None:
+            self._config_cache.write()
+        log.debug1("Loading the configuration took %f seconds",
+                   time.time() - tm)
+
+    def _start_load_stock_config(self, fw_config):
+        self._loader_ipsets(config.FIREWALLD_IPSETS, fw_config)
+        self._loader_icmptypes(config.FIREWALLD_ICMPTYPES, fw_config)
+        self._loader_helpers(config.FIREWALLD_HELPERS, fw_config)
+        self._loader_services(config.FIREWALLD_SERVICES, fw_config)
+        self._loader_zones(config.FIREWALLD_ZONES, fw_config)
+        self._loader_policies(config.FIREWALLD_POLICIES, fw_config)
+
+    def _start_load_user_config(self, fw_config):
+        self._loader_ipsets(config.ETC_FIREWALLD_IPSETS, fw_config)
+        self._loader_icmptypes(config.ETC_FIREWALLD_ICMPTYPES, fw_config)
+        self._loader_helpers(config.ETC_FIREWALLD_HELPERS, fw_config)
+        self._loader_services(config.ETC_FIREWALLD_SERVICES, fw_config)
+        self._loader_zones(config.ETC_FIREWALLD_ZONES, fw_config)
+        self._loader_policies(config.ETC_FIREWALLD_POLICIES, fw_config)
 
     def _start_copy_config_to_runtime(self):
         for _ipset in self.config.get_ipsets():
@@ -440,14 +517,18 @@ class Firewall:
         self.direct.set_permanent_config(
                 copy.deepcopy(self.config.get_direct()))
 
+        for z_obj in self._get_runtime_zone_objects(self.config):
+            self.zone.add_zone(z_obj)
+
+    def _get_runtime_zone_objects(self, fw_config):
         # copy combined permanent zones to runtime
         # zones with a '/' in the name will be combined into one runtime zone
+        zones = []
         combined_zones = {}
-        for zone in self.config.get_zones():
-            z_obj = self.config.get_zone(zone)
+        for zone in fw_config.get_zones():
+            z_obj = fw_config.get_zone(zone)
             if '/' not in z_obj.name:
-                self.zone.add_zone(
-                        copy.deepcopy(self.config.get_zone(zone)))
+                zones.append(copy.deepcopy(z_obj))
                 continue
 
             combined_name = os.path.basename(z_obj.path)
@@ -466,7 +547,9 @@ class Firewall:
             combined_zones[combined_name].combine(z_obj)
 
         for zone in combined_zones:
-            self.zone.add_zone(combined_zones[zone])
+            zones.append(combined_zones[zone])
+
+        return zones
 
     def _start_load_direct_rules(self):
         # load direct rules
@@ -549,7 +632,7 @@ class Firewall:
         transaction.execute(True)
         transaction.clear()
 
-    def _start_check(self):
+    def _start_check(self, check_config=True):
         # check minimum required zones
         for z in [ "block", "drop", "trusted" ]:
             if z not in self.zone.get_zones():
@@ -571,7 +654,8 @@ class Firewall:
             log.debug1("Using default zone '%s'", self._default_zone)
 
         if not self._offline:
-            self.full_check_config()
+            if check_config:
+                self.full_check_config()
             self._start_check_tables()
 
             # check our desired backend is actually available
@@ -584,7 +668,11 @@ class Firewall:
                         "Firewall backend '{}' is not available.".format(
                             self._firewall_backend))
 
-    def _start(self, reload=False, complete_reload=False):
+    def _start(self, reload=False, complete_reload=False, fw_config=None):
+        """Start with the permanent configuration loaded from disk. On
+        reload fw_config is the configuration that has already been loaded
+        and checked by check_on_disk_config(), it is used instead of
+        parsing and checking the configuration again."""
         self._start_load_firewalld_conf()
         self._start_load_lockdown_whitelist()
 
@@ -593,12 +681,14 @@ class Firewall:
         if not self._offline:
             self._start_probe_backends()
 
-        self._start_load_stock_config()
-        self._start_load_user_config()
-        self._start_load_direct_rules()
+        if fw_config is None:
+            self._start_load_config(self.config)
+            self._start_load_direct_rules()
+        else:
+            self.config.take_config(fw_config)
         self._start_copy_config_to_runtime()
 
-        self._start_check()
+        self._start_check(check_config=fw_config is None)
 
         if self._offline:
             return
@@ -632,7 +722,7 @@ class Firewall:
         if not self._offline:
             self._start_probe_backends()
 
-        self._start_load_stock_config()
+        self._start_load_stock_config(self.config)
         self._start_copy_config_to_runtime()
         self._start_check()
 
@@ -680,94 +770,143 @@ class Firewall:
                 continue
             yield filename
 
-    def _loader_services(self, path):
-        for filename in self._loader_config_file_generator(path):
-            log.debug1("Loading service file '%s%s%s'", path, os.sep, filename)
-
-            obj = service_reader(filename, path)
-            if obj.name in self.config.get_services():
-                orig_obj = self.config.get_service(obj.name)
+    def _loader_services(self, path, fw_config):
+        tm = time.time()
+        filenames = list(self._loader_config_file_generator(path))
+        objs = self._loader_read_files(service_reader, path, filenames)
+        names = set(fw_config.get_services())
+        for obj in objs:
+            log.debug1("Loading service file '%s%s%s'", path, os.sep,
+                       obj.filename)
+
+            if obj.name in names:
+                orig_obj = fw_config.get_service(obj.name)
                 log.debug1("Overrides '%s%s%s'",
                            orig_obj.path, os.sep, orig_obj.filename)
             elif obj.path.startswith(config.ETC_FIREWALLD):
                 obj.default = True
 
-            self.config.add_service(obj)
+            fw_config.add_service(obj)
+            names.add(obj.name)
+
+        log.debug1("Loaded %d service files from '%s' in %f seconds",
+                   len(objs), path, time.time() - tm)
 
-    def _loader_ipsets(self, path):
-        for filename in self._loader_config_file_generator(path):
-            log.debug1("Loading ipset file '%s%s%s'", path, os.sep, filename)
+    def _loader_ipsets(self, path, fw_config):
+        tm = time.time()
+        filenames = list(self._loader_config_file_generator(path))
+        objs = self._loader_read_files(ipset_reader, path, filenames)
+        names = set(fw_config.get_ipsets())
+        for obj in objs:
+            log.debug1("Loading ipset file '%s%s%s'", path, os.sep,
+                       obj.filename)
 
-            obj = ipset_reader(filename, path)
-            if obj.name in self.config.get_ipsets():
-                orig_obj = self.config.get_ipset(obj.name)
+            if obj.name in names:
+                orig_obj = fw_config.get_ipset(obj.name)
                 log.debug1("Overrides '%s%s%s'",
                            orig_obj.path, os.sep, orig_obj.filename)
             elif obj.path.startswith(config.ETC_FIREWALLD):
                 obj.default = True
 
-            self.config.add_ipset(obj)
+            fw_config.add_ipset(obj)
+            names.add(obj.name)
 
-    def _loader_helpers(self, path):
-        for filename in self._loader_config_file_generator(path):
-            log.debug1("Loading helper file '%s%s%s'", path, os.sep, filename)
+        log.debug1("Loaded %d ipset files from '%s' in %f seconds",
+                   len(objs), path, time.time() - tm)
 
-            obj = helper_reader(filename, path)
-            if obj.name in self.config.get_helpers():
-                orig_obj = self.config.get_helper(obj.name)
+    def _loader_helpers(self, path, fw_config):
+        tm = time.time()
+        filenames = list(self._loader_config_file_generator(path))
+        objs = self._loader_read_files(helper_reader, path, filenames)
+        names = set(fw_config.get_helpers())
+        for obj in objs:
+            log.debug1("Loading helper file '%s%s%s'", path, os.sep,
+                       obj.filename)
+
+            if obj.name in names:
+                orig_obj = fw_config.get_helper(obj.name)
                 log.debug1("Overrides '%s%s%s'",
                            orig_obj.path, os.sep, orig_obj.filename)
             elif obj.path.startswith(config.ETC_FIREWALLD):
                 obj.default = True
 
-            self.config.add_helper(obj)
+            fw_config.add_helper(obj)
+            names.add(obj.name)
+
+        log.debug1("Loaded %d helper files from '%s' in %f seconds",
+                   len(objs), path, time.time() - tm)
 
-    def _loader_policies(self, path):
-        for filename in self._loader_config_file_generator(path):
-            log.debug1("Loading policy file '%s%s%s'", path, os.sep, filename)
+    def _loader_policies(self, path, fw_config):
+        tm = time.time()
+        filenames = list(self._loader_config_file_generator(path))
+        objs = self._loader_read_files(policy_reader, path, filenames)
+        names = set(fw_config.get_policy_objects())
+        for obj in objs:
+            log.debug1("Loading policy file '%s%s%s'", path, os.sep,
+                       obj.filename)
 
-            obj = policy_reader(filename, path)
-            if obj.name in self.config.get_policy_objects():
-                orig_obj = self.config.get_policy_object(obj.name)
+            if obj.name in names:
+                orig_obj = fw_config.get_policy_object(obj.name)
                 log.debug1("Overrides '%s%s%s'",
                            orig_obj.path, os.sep, orig_obj.filename)
             elif obj.path.startswith(config.ETC_FIREWALLD):
                 obj.default = True
 
-            self.config.add_policy_object(obj)
+            fw_config.add_policy_object(obj)
+            names.add(obj.name)
 
-    def _loader_icmptypes(self, path):
-        for filename in self._loader_config_file_generator(path):
-            log.debug1("Loading icmptype file '%s%s%s'", path, os.sep, filename)
+        log.debug1("Loaded %d policy files from '%s' in %f seconds",
+                   len(objs), path, time.time() - tm)
 
-            obj = icmptype_reader(filename, path)
-            if obj.name in self.config.get_icmptypes():
-                orig_obj = self.config.get_icmptype(obj.name)
+    def _loader_icmptypes(self, path, fw_config):
+        tm = time.time()
+        filenames = list(self._loader_config_file_generator(path))
+        objs = self._loader_read_files(icmptype_reader, path, filenames)
+        names = set(fw_config.get_icmptypes())
+        for obj in objs:
+            log.debug1("Loading icmptype file '%s%s%s'", path, os.sep,
+                       obj.filename)
+
+            if obj.name in names:
+                orig_obj = fw_config.get_icmptype(obj.name)
                 log.debug1("Overrides '%s%s%s'",
                            orig_obj.path, os.sep, orig_obj.filename)
             elif obj.path.startswith(config.ETC_FIREWALLD):
                 obj.default = True
 
-            self.config.add_icmptype(obj)
+            fw_config.add_icmptype(obj)
+            names.add(obj.name)
+
+        log.debug1("Loaded %d icmptype files from '%s' in %f seconds",
+                   len(objs), path, time.time() - tm)
 
-    def _loader_zones(self, path, combine=False):
+    def _loader_zones(self, path, fw_config, combine=False):
         if not os.path.isdir(path):
             return
 
-        for filename in sorted(os.listdir(path)):
+        tm = time.time()
+        filenames = sorted(os.listdir(path))
+        objs = self._loader_read_files(zone_reader, path,
+                                       [filename for filename in filenames
+                                        if filename.endswith(".xml")],
+                                       combine)
+        objs_iter = iter(objs)
+        names = set(fw_config.get_zones())
+        for filename in filenames:
             if not filename.endswith(".xml"):
                 if path.startswith(config.ETC_FIREWALLD) and \
                         os.path.isdir("%s/%s" % (path, filename)):
                     # Combined zones are added to permanent config
                     # individually. They're coalesced into one object when
                     # added to the runtime
-                    self._loader_zones("%s/%s" % (path, filename), combine=True)
+                    self._loader_zones("%s/%s" % (path, filename), fw_config,
+                                      combine=True)
                 continue
 
             name = "%s/%s" % (path, filename)
             log.debug1("Loading zone file '%s'", name)
 
-            obj = zone_reader(filename, path, no_check_name=combine)
+            obj = next(objs_iter)
             if combine:
                 # Change name for permanent configuration
                 obj.name = "%s/%s" % (
@@ -775,14 +914,91 @@ class Firewall:
                     os.path.basename(filename)[0:-4])
                 obj.check_name(obj.name)
 
-            if obj.name in self.config.get_zones():
-                orig_obj = self.config.get_zone(obj.name)
+            if obj.name in names:
+                orig_obj = fw_config.get_zone(obj.name)
                 log.debug1("Overrides '%s%s%s'",
                            orig_obj.path, os.sep, orig_obj.filename)
             elif obj.path.startswith(config.ETC_FIREWALLD):
                 obj.default = True
 
-            self.config.add_zone(obj)
+            fw_config.add_zone(obj)
+            names.add(obj.name)
+
+        log.debug1("Loaded %d zone files from '%s' in %f seconds",
+                   len(objs), path, time.time() - tm)
+
+    def _loader_read_files(self, reader, path, filenames, *args):
+        """Parse the config files with reader and return the objects in the
+        order of filenames. Files that did not change since they have been
+        parsed the last time are taken from the config cache."""
+        objs = [None] * len(filenames)
+        file_ids = [None] * len(filenames)
+        if self._config_cache is not None:
+            for (i, filename) in enumerate(filenames):
+                key = (reader.__name__, path, filename) + args
+                file_ids[i] = self._config_cache.file_id(
+                        "%s/%s" % (path, filename))
+                if reader is ipset_reader and file_ids[i] is not None:
+                    # the entry journal is part of the ipset
+                    file_ids[i] += (self._config_cache.file_id(
+                        "%s/%s.journal" % (path, filename)), )
+                objs[i] = self._config_cache.get(key, file_ids[i])
+                if objs[i] is not None and reader is ipset_reader and \
+                   objs[i].entries_file and \
+                   objs[i].entries_file_id != self._config_cache.file_id(
+                           ipset_entries_file_name(objs[i])):
+                    # the external entries file changed
+                    objs[i] = None
+
+        missing = [i for i in range(len(filenames)) if objs[i] is None]
+        if len(missing) < len(filenames):
+            log.debug1("Using %d cached files from '%s'",
+                       len(filenames) - len(missing), path)
+        parsed = self._loader_parse_files(reader, path,
+                                          [filenames[i] for i in missing],
+                                          *args)
+        for (i, obj) in zip(missing, parsed):
+            if self._config_cache is not None:
+                key = (reader.__name__, path, filenames[i]) + args
+                self._config_cache.set(key, file_ids[i], obj)
+            objs[i] = obj
+
+        return objs
+
+    def _loader_parse_files(self, reader, path, filenames, *args):
+        """Parse the config files with reader and return the objects in the
+        order of filenames. Large directories are parsed in worker
+        processes, the objects are merged by the caller in the same order as
+        if they were read sequentially.
+
+        The workers are forked. Forking a process with more than one thread
+        can deadlock the child, e.g. on a lock held by another thread, so
+        this is only done as long as the process is single threaded, e.g. in
+        firewall-offline-cmd or before the daemon enters its main loop.
+        Otherwise the files are parsed sequentially. The forkserver and
+        spawn start methods can not be used instead, they run the main
+        script again in the workers."""
+        workers = min(os.cpu_count() or 1, LOADER_MAX_WORKERS)
+        if workers > 1 and len(filenames) >= LOADER_PARALLEL_MIN_FILES and \
+           _is_single_threaded():
+            chunksize = -(-len(filenames) // (workers * 4))
+            try:
+                with concurrent.futures.ProcessPoolExecutor(
+                        workers,
+                        mp_context=multiprocessing.get_context("fork")) \
+                        as executor:
+                    return list(executor.map(reader, filenames,
+                                             itertools.repeat(path),
+                                             *[itertools.repeat(arg)
+                                               for arg in args],
+                                             chunksize=chunksize))
+            except (OSError, ValueError,
+                    concurrent.futures.process.BrokenProcessPool) as msg:
+                # errors in the reader are raised again below
+                log.debug1("Failed to load '%s' in parallel, loading "
+                           "sequentially: %s", path, msg)
+
+        return [reader(filename, path, *args) for filename in filenames]
 
     def cleanup(self):
         self.icmptype.cleanup()
@@ -1064,7 +1280,7 @@ class Firewall:
 
     def check_policy(self, policy):
         _policy = policy
-        if _policy not in self.policy.get_policies():
+        if not self.policy.query_policy(_policy):
             raise FirewallError(errors.INVALID_POLICY, _policy)
         return _policy
 
@@ -1072,7 +1288,7 @@ class Firewall:
         _zone = zone
         if not _zone or _zone == "":
             _zone = self.get_default_zone()
-        if _zone not in self.zone.get_zones():
+        if not self.zone.query_zone(_zone):
             raise FirewallError(errors.INVALID_ZONE, _zone)
         return _zone
 
@@ -1123,8 +1339,22 @@ class Firewall:
     # RELOAD
 
     def reload(self, stop=False):
-        # we're about to load the on-disk config, so verify it's sane.
-        check_on_disk_config(self)
+        tm = time.time()
+        # we're about to load the on-disk config, so verify it's sane. The
+        # checked config is used as the new permanent config.
+        fw_config = check_on_disk_config(self)
+
+        if self._incremental_reload and not stop:
+            try:
+                if self._reload_incremental(fw_config):
+                    log.debug1("Reload took %f seconds", time.time() - tm)
+                    return
+            except Exception as msg:
+                log.warning("Incremental reload failed, doing a full "
+                            "reload: %s", msg)
+                # fw_config might have been taken over already, load it
+                # again in _start()
+                fw_config = None
 
         _panic = self._panic
         _omit_native_ipset = self.ipset.omit_native_ipset()
@@ -1149,12 +1379,15 @@ class Firewall:
         if not _panic:
             self.set_policy("DROP")
 
+        tm_flush = time.time()
         self.flush()
         self.cleanup()
+        log.debug1("Flushing took %f seconds", time.time() - tm_flush)
 
         start_exception = None
         try:
-            self._start(reload=True, complete_reload=stop)
+            self._start(reload=True, complete_reload=stop,
+                        fw_config=fw_config)
         except Exception as e:
             # save the exception for later, but continue restoring interfaces,
             # etc. We'll re-raise it at the end.
@@ -1221,12 +1454,7 @@ class Firewall:
             # restore direct config
             self.direct.set_config(_direct_config)
 
-        # Restore permanent interfaces from NetworkManager
-        nm_bus_name = nm_get_bus_name()
-        if nm_bus_name:
-            for zone in self.zone.get_zones() + [""]:
-                for interface in nm_get_interfaces_in_zone(zone):
-                    self.zone.change_zone_of_interface(zone, interface, sender=nm_bus_name)
+        self._restore_nm_interfaces()
 
         self._panic = _panic
         if not self._panic:
@@ -1245,12 +1473,234 @@ class Firewall:
                     for rule in self.ip6tables_backend.build_set_policy_rules("ACCEPT"):
                         self.ip6tables_backend.set_rule(rule, self._log_denied)
 
+        log.debug1("Reload took %f seconds", time.time() - tm)
+
         if start_exception:
             self._state = "FAILED"
             raise start_exception
         else:
             self._state = "RUNNING"
 
+    def _restore_nm_interfaces(self):
+        # Restore permanent interfaces from NetworkManager
+        nm_bus_name = nm_get_bus_name()
+        if nm_bus_name:
+            for zone in self.zone.get_zones() + [""]:
+                for interface in nm_get_interfaces_in_zone(zone):
+                    self.zone.change_zone_of_interface(zone, interface, sender=nm_bus_name)
+
+    def _reload_incremental(self, fw_config):
+        """Apply the on-disk configuration fw_config as a delta to the
+        runtime.
+
+        This only handles changes to the settings of existing zones,
+        policies and ipsets, zone bindings and ipset entries. If anything
+        else changed, e.g. firewalld.conf, the set of zones, policies and
+        ipsets, their targets or priorities, a service, icmptype or helper
+        definition or the permanent direct configuration, nothing is applied
+        and False is returned so that the caller falls back to a full reload.
+        """
+        if self._panic or self._state != "RUNNING":
+            return False
+
+        flush_all = self._flush_all_on_reload
+
+        if not os.path.exists(config.FIREWALLD_CONF) or \
+           fw_config.get_firewalld_conf() != self._firewalld_conf:
+            log.debug1("firewalld.conf changed, incremental reload not possible")
+            return False
+
+        # everything that is not applied as a delta below has to be unchanged
+        old_direct = self.direct.get_permanent_config()
+        if old_direct is None or \
+           old_direct.export_config() != fw_config.get_direct().export_config():
+            log.debug1("Direct configuration changed, incremental reload "
+                       "not possible")
+            return False
+        if flush_all and any(self.direct.get_runtime_config()):
+            return False
+
+        for (names, getter, runtime_names, runtime_getter) in [
+                (fw_config.get_services(), fw_config.get_service,
+                 self.service.get_services(), self.service.get_service),
+                (fw_config.get_icmptypes(), fw_config.get_icmptype,
+                 self.icmptype.get_icmptypes(), self.icmptype.get_icmptype),
+                (fw_config.get_helpers(), fw_config.get_helper,
+                 self.helper.get_helpers(), self.helper.get_helper)]:
+            if sorted(names) != sorted(runtime_names):
+                log.debug1("Set of services, icmptypes or helpers changed, "
+                           "incremental reload not possible")
+                return False
+            for name in names:
+                if getter(name).export_config() != \
+                   runtime_getter(name).export_config():
+                    log.debug1("'%s' changed, incremental reload not "
+                               "possible", name)
+                    return False
+
+        if sorted(fw_config.get_ipsets()) != sorted(self.ipset.get_ipsets()):
+            log.debug1("Set of ipsets changed, incremental reload not possible")
+            return False
+        for name in fw_config.get_ipsets():
+            obj = fw_config.get_ipset(name)
+            old_obj = self.ipset.get_ipset(name)
+            if obj.type != old_obj.type or obj.options != old_obj.options:
+                log.debug1("ipset '%s' changed, incremental reload not "
+                           "possible", name)
+                return False
+            if flush_all and "timeout" in obj.options and \
+               obj.options["timeout"] != "0":
+                # runtime entries of timeout ipsets are not known, they can
+                # only be dropped by recreating the set
+                return False
+
+        zone_objs = self._get_runtime_zone_objects(fw_config)
+        if sorted([z_obj.name for z_obj in zone_objs]) != self.zone.get_zones():
+            log.debug1("Set of zones changed, incremental reload not possible")
+            return False
+        for z_obj in zone_objs:
+            old_obj = self.zone.get_zone(z_obj.name)
+            if z_obj.target != old_obj.target or \
+               z_obj.ingress_priority != old_obj.ingress_priority or \
+               z_obj.egress_priority != old_obj.egress_priority:
+                log.debug1("Zone '%s' changed, incremental reload not "
+                           "possible", z_obj.name)
+                return False
+
+        policy_objs = [fw_config.get_policy_object(policy)
+                       for policy in fw_config.get_policy_objects()]
+        if sorted([p_obj.name for p_obj in policy_objs]) != \
+           sorted(self.policy.get_policies_not_derived_from_zone()):
+            log.debug1("Set of policies changed, incremental reload not "
+                       "possible")
+            return False
+        for p_obj in policy_objs:
+            old_obj = self.policy.get_policy(p_obj.name)
+            if p_obj.target != old_obj.target or \
+               p_obj.priority != old_obj.priority:
+                log.debug1("Policy '%s' changed, incremental reload not "
+                           "possible", p_obj.name)
+                return False
+
+        log.debug1("Applying configuration changes incrementally")
+        self.config.cleanup()
+        self.config.set_firewalld_conf(copy.deepcopy(self._firewalld_conf))
+        self._start_load_lockdown_whitelist()
+        self.config.take_config(fw_config)
+        metadata = ["version", "short", "description", "path", "filename",
+                    "default", "builtin"]
+
+        self.direct.set_permanent_config(
+                copy.deepcopy(self.config.get_direct()))
+
+        # The whole delta is applied in one transaction. The ipset entries
+        # are replaced first so that the rules never reference missing
+        # entries, and restored if the rules can not be applied.
+        transaction = FirewallTransaction(self)
+
+        # ipset entries, runtime entries are kept as in a full reload
+        for name in self.config.get_ipsets():
+            obj = self.config.get_ipset(name)
+            old_obj = self.ipset.get_ipset(name)
+            for attr in metadata:
+                setattr(old_obj, attr, getattr(obj, attr))
+            if "timeout" in obj.options and obj.options["timeout"] != "0":
+                continue
+            entries = list(obj.entries)
+            if not flush_all:
+                entries += [entry for entry in old_obj.entries
+                            if not obj.has_entry(entry)]
+            if entries == list(old_obj.entries):
+                continue
+            if old_obj.applied:
+                transaction.add_pre(self.ipset.set_entries, name, entries)
+                transaction.add_fail(self.ipset.set_entries, name,
+                                     list(old_obj.entries))
+            else:
+                old_obj.entries = entries
+
+        # zone and policy settings. These replace the runtime settings as
+        # a full reload would do. fw_config has been checked already by
+        # check_on_disk_config.
+        zone_settings = ["services", "ports", "icmp_blocks", "masquerade",
+                         "forward_ports", "rules_str", "protocols",
+                         "source_ports", "icmp_block_inversion", "forward"]
+        for z_obj in zone_objs:
+            settings = { }
+            for key in zone_settings:
+                settings[key] = copy.deepcopy(getattr(z_obj, key))
+            self.zone.set_config_with_settings_dict(z_obj.name, settings, None,
+                                                    use_transaction=transaction,
+                                                    check=False)
+            old_obj = self.zone.get_zone(z_obj.name)
+            for attr in metadata:
+                setattr(old_obj, attr, getattr(z_obj, attr))
+
+        policy_settings = ["services", "ports", "icmp_blocks", "masquerade",
+                           "forward_ports", "rich_rules", "protocols",
+                           "source_ports", "ingress_zones", "egress_zones"]
+        for p_obj in policy_objs:
+            settings = { }
+            for key in policy_settings:
+                settings[key] = copy.deepcopy(getattr(p_obj, key))
+            self.policy.set_config_with_settings_dict(p_obj.name, settings,
+                                                      None,
+                                                      use_transaction=transaction,
+                                                      check=False)
+            old_obj = self.policy.get_policy(p_obj.name)
+            for attr in metadata:
+                setattr(old_obj, attr, getattr(p_obj, attr))
+
+        # zone bindings. Runtime interfaces are kept unless flush_all is
+        # set, then only interfaces from NetworkManager are kept. Sources
+        # are reset to the permanent configuration.
+        nm_interfaces = { }
+        if flush_all:
+            nm_bus_name = nm_get_bus_name()
+            if nm_bus_name:
+                for zone in self.zone.get_zones() + [""]:
+                    for interface in nm_get_interfaces_in_zone(zone):
+                        nm_interfaces[interface] = \
+                            zone if zone else self._default_zone
+
+        interfaces = { }
+        sources = { }
+        for z_obj in zone_objs:
+            for interface in z_obj.interfaces:
+                interfaces[interface] = z_obj.name
+            for source in z_obj.sources:
+                if functions.check_mac(source):
+                    source = source.upper()
+                sources[source] = z_obj.name
+        if not flush_all:
+            for zone in self.zone.get_zones():
+                for interface in self.zone.list_interfaces(zone):
+                    interfaces[interface] = zone
+        interfaces.update(nm_interfaces)
+
+        for zone in self.zone.get_zones():
+            for interface in list(self.zone.list_interfaces(zone)):
+                if interfaces.get(interface) != zone:
+                    self.zone.remove_interface(zone, interface,
+                                               use_transaction=transaction)
+            for source in list(self.zone.list_sources(zone)):
+                if sources.get(source) != zone:
+                    self.zone.remove_source(zone, source,
+                                            use_transaction=transaction)
+        for interface in interfaces:
+            self.zone.change_zone_of_interface(interfaces[interface],
+                                               interface,
+                                               use_transaction=transaction)
+        for source in sources:
+            self.zone.change_zone_of_source(sources[source], source,
+                                            use_transaction=transaction)
+
+        transaction.execute(True)
+
+        self._restore_nm_interfaces()
+
+        return True
+
     # STATE
 
     def get_state(self):
@@ -22,14 +22,16 @@ import copy
 import os
 import os.path
 import shutil
-from typing import Dict, List
+from typing import Dict, List, Optional
 from firewall import config
 from firewall.core.logger import log
 from firewall.core.io.io_object import IO_Object
 from firewall.core.io.icmptype import IcmpType, icmptype_reader, icmptype_writer
 from firewall.core.io.service import Service, service_reader, service_writer
 from firewall.core.io.zone import Zone, zone_reader, zone_writer
-from firewall.core.io.ipset import IPSet, ipset_reader, ipset_writer
+from firewall.core.io.ipset import IPSet, ipset_reader, ipset_writer, \
+    ipset_journal_append, ipset_journal_needs_compaction, \
+    ipset_entries_file_name
 from firewall.core.io.helper import Helper, helper_reader, helper_writer
 from firewall.core.io.policy import Policy, policy_reader, policy_writer
 from firewall import errors
@@ -120,6 +122,22 @@ class FirewallConfig:
 
         self.__init_vars()
 
+    def take_config(self, fw_config):
+        """
+        Takes over the config objects and the direct configuration of
+        fw_config, fw_config is empty afterwards. firewalld.conf and the
+        lockdown whitelist are not taken over.
+        """
+        for attr in ["_ipsets", "_icmptypes", "_services", "_zones",
+                     "_helpers", "_policy_objects", "_builtin_ipsets",
+                     "_builtin_icmptypes", "_builtin_services",
+                     "_builtin_zones", "_builtin_helpers",
+                     "_builtin_policy_objects"]:
+            setattr(self, attr, getattr(fw_config, attr))
+            setattr(fw_config, attr, { })
+        self._direct = fw_config._direct
+        fw_config._direct = None
+
     def get_all_io_objects_dict(self):
         """
         Returns a dict of dicts of all permanent config objects.
@@ -137,8 +155,16 @@ class FirewallConfig:
 
         return conf_dict
 
-    def full_check_config(self, extra_io_objects: Dict[str, List[IO_Object]] = {}):
+    def full_check_config(self, extra_io_objects: Dict[str, List[IO_Object]] = {},
+                          zones: Optional[List[IO_Object]] = None):
+        """
+        Checks all permanent config objects. If zones is given, these zones
+        are checked instead of the permanent zones, e.g. the runtime zones
+        with the combined zones coalesced into one zone.
+        """
         all_io_objects = self.get_all_io_objects_dict()
+        if zones is not None:
+            all_io_objects["zones"] = {obj.name: obj for obj in zones}
         # mix in the extra objects
         for type_key in extra_io_objects:
             for obj in extra_io_objects[type_key]:
@@ -269,7 +295,41 @@ class FirewallConfig:
         ipset_writer(x)
         return x
 
-    def new_ipset(self, name, conf):
+    def _use_ipset_journal(self, obj):
+        return self._fw._ipset_entry_journal and not obj.builtin and \
+            obj.path == config.ETC_FIREWALLD_IPSETS
+
+    def add_ipset_entry(self, obj, entry):
+        """Add entry to the permanent ipset obj. With IPSetEntryJournal only
+        the entry is checked and appended to the entry journal. Returns the
+        ipset object, which is a new object if the ipset file has been
+        written."""
+        if not self._use_ipset_journal(obj):
+            settings = list(obj.export_config())
+            settings[5].append(entry)
+            return self.set_ipset_config(obj, settings)
+
+        IPSet.check_entry(entry, obj.options, obj.type)
+        ipset_journal_append(obj, entry, True)
+        obj.add_entry(entry)
+        if ipset_journal_needs_compaction(obj):
+            ipset_writer(obj)
+        return obj
+
+    def remove_ipset_entry(self, obj, entry):
+        """Remove entry from the permanent ipset obj, see add_ipset_entry."""
+        if not self._use_ipset_journal(obj):
+            settings = list(obj.export_config())
+            settings[5].remove(entry)
+            return self.set_ipset_config(obj, settings)
+
+        ipset_journal_append(obj, entry, False)
+        obj.remove_entry(entry)
+        if ipset_journal_needs_compaction(obj):
+            ipset_writer(obj)
+        return obj
+
+    def new_ipset(self, name, conf, entries_file=""):
         if name in self._ipsets or name in self._builtin_ipsets:
             raise FirewallError(errors.NAME_CONFLICT,
                                 "new_ipset(): '%s'" % name)
@@ -282,6 +342,7 @@ class FirewallConfig:
         # It is not possible to add a new one with a name of a buitin
         x.builtin = False
         x.default = True
+        x.entries_file = entries_file
 
         x.import_config(conf, self.get_all_io_objects_dict())
         self.full_check_config({"ipsets": [x]})
@@ -372,6 +433,21 @@ class FirewallConfig:
         except Exception as msg:
             log.error("Backup of file '%s' failed: %s", name, msg)
             os.remove(name)
+        if os.path.exists("%s.journal" % name):
+            os.remove("%s.journal" % name)
+
+        # The external entries file is removed with the ipset, unless another
+        # ipset uses it, e.g. the new one on rename.
+        entries_name = ipset_entries_file_name(obj)
+        if entries_name and os.path.exists(entries_name) and \
+           not any(x is not obj and x.path == obj.path and
+                   x.entries_file == obj.entries_file
+                   for x in self._ipsets.values()):
+            try:
+                shutil.move(entries_name, "%s.old" % entries_name)
+            except Exception as msg:
+                log.error("Backup of file '%s' failed: %s", entries_name, msg)
+                os.remove(entries_name)
 
         del self._ipsets[obj.name]
 
@@ -391,7 +467,9 @@ class FirewallConfig:
         return new_ipset
 
     def _copy_ipset(self, obj, name):
-        return self.new_ipset(name, obj.export_config())
+        # the entries file is not part of the config, the copy keeps using it
+        return self.new_ipset(name, obj.export_config(),
+                              entries_file=obj.entries_file)
 
     # icmptypes
 
@@ -61,6 +61,9 @@ class FirewallDirect:
     def set_permanent_config(self, obj):
         self._obj = obj
 
+    def get_permanent_config(self):
+        return self._obj
+
     def has_runtime_configuration(self):
         if len(self._chains) + len(self._rules) + len(self._passthroughs) > 0:
             return True
@@ -22,8 +22,8 @@
 
 from firewall.core.logger import log
 from firewall.core.ipset import remove_default_create_options as rm_def_cr_opts, \
-                                normalize_ipset_entry, check_entry_overlaps_existing, \
-                                check_for_overlapping_entries
+                                normalize_ipset_entry, check_for_overlapping_entries, \
+                                IPSetEntries
 from firewall.core.io.ipset import IPSet
 from firewall import errors
 from firewall.errors import FirewallError
@@ -42,7 +42,7 @@ class FirewallIPSet:
         self._ipsets.clear()
 
     def check_ipset(self, name):
-        if name not in self.get_ipsets():
+        if name not in self._ipsets:
             raise FirewallError(errors.INVALID_IPSET, name)
 
     def query_ipset(self, name):
@@ -199,10 +199,10 @@ class FirewallIPSet:
         entry = normalize_ipset_entry(entry)
 
         IPSet.check_entry(entry, obj.options, obj.type)
-        if entry in obj.entries:
+        if obj.has_entry(entry):
             raise FirewallError(errors.ALREADY_ENABLED,
                                 "'%s' already is in '%s'" % (entry, name))
-        check_entry_overlaps_existing(entry, obj.entries)
+        obj.check_entry_overlaps(entry)
 
         try:
             for backend in self.backends():
@@ -212,14 +212,14 @@ class FirewallIPSet:
         else:
             if "timeout" not in obj.options or obj.options["timeout"] == "0":
                 # no entries visible for ipsets with timeout
-                obj.entries.append(entry)
+                obj.add_entry(entry)
 
     def remove_entry(self, name, entry):
         obj = self.get_ipset(name, applied=True)
         entry = normalize_ipset_entry(entry)
 
         # no entry check for removal
-        if entry not in obj.entries:
+        if not obj.has_entry(entry):
             raise FirewallError(errors.NOT_ENABLED,
                                 "'%s' not in '%s'" % (entry, name))
         try:
@@ -230,7 +230,7 @@ class FirewallIPSet:
         else:
             if "timeout" not in obj.options or obj.options["timeout"] == "0":
                 # no entries visible for ipsets with timeout
-                obj.entries.remove(entry)
+                obj.remove_entry(entry)
 
     def query_entry(self, name, entry):
         obj = self.get_ipset(name, applied=True)
@@ -239,11 +239,75 @@ class FirewallIPSet:
             # no entries visible for ipsets with timeout
             raise FirewallError(errors.IPSET_WITH_TIMEOUT, name)
 
-        return entry in obj.entries
+        return obj.has_entry(entry)
+
+    def add_entries(self, name, entries):
+        """Add entries in one go, already present ones are skipped. Returns
+        the list of added entries."""
+        obj = self.get_ipset(name, applied=True)
+        timeout = "timeout" in obj.options and obj.options["timeout"] != "0"
+
+        added = IPSetEntries()
+        for entry in entries:
+            entry = normalize_ipset_entry(entry)
+            IPSet.check_entry(entry, obj.options, obj.type)
+            if entry in added or obj.has_entry(entry):
+                continue
+            obj.check_entry_overlaps(entry)
+            added.check_overlaps(entry)
+            added.add(entry)
+        added = added.to_list()
+        if not added:
+            return added
+
+        try:
+            for backend in self.backends():
+                if self._fw._individual_calls:
+                    for entry in added:
+                        backend.set_add(obj.name, entry)
+                else:
+                    backend.set_add_entries(obj.name, added)
+        except Exception as msg:
+            raise FirewallError(errors.COMMAND_FAILED, msg)
+        else:
+            if not timeout:
+                # no entries visible for ipsets with timeout
+                for entry in added:
+                    obj.add_entry(entry)
+        return added
+
+    def remove_entries(self, name, entries):
+        """Remove entries in one go, entries that are not present are
+        skipped. Returns the list of removed entries."""
+        obj = self.get_ipset(name, applied=True)
+
+        # no entry check for removal
+        removed = IPSetEntries()
+        for entry in entries:
+            entry = normalize_ipset_entry(entry)
+            if obj.has_entry(entry):
+                removed.add(entry)
+        removed = removed.to_list()
+        if not removed:
+            return removed
+
+        try:
+            for backend in self.backends():
+                if self._fw._individual_calls:
+                    for entry in removed:
+                        backend.set_delete(obj.name, entry)
+                else:
+                    backend.set_delete_entries(obj.name, removed)
+        except Exception as msg:
+            raise FirewallError(errors.COMMAND_FAILED, msg)
+        else:
+            for entry in removed:
+                obj.remove_entry(entry)
+        return removed
 
     def get_entries(self, name):
         obj = self.get_ipset(name, applied=True)
-        return obj.entries
+        return list(obj.entries)
 
     def set_entries(self, name, entries):
         obj = self.get_ipset(name, applied=True)
@@ -254,24 +318,21 @@ class FirewallIPSet:
             IPSet.check_entry(entry, obj.options, obj.type)
         if "timeout" not in obj.options or obj.options["timeout"] == "0":
             # no entries visible for ipsets with timeout
+            old_entries = obj.entries
             obj.entries = entries
-
-        try:
-            for backend in self.backends():
-                backend.set_flush(obj.name)
-        except Exception as msg:
-            raise FirewallError(errors.COMMAND_FAILED, msg)
         else:
-            obj.applied = True
+            old_entries = None
 
         try:
             for backend in self.backends():
                 if self._fw._individual_calls:
+                    backend.set_flush(obj.name)
                     for entry in obj.entries:
                         backend.set_add(obj.name, entry)
                 else:
-                    backend.set_restore(obj.name, obj.type, obj.entries,
-                                                   obj.options, None)
+                    backend.set_replace_entries(obj.name, obj.type,
+                                                obj.entries, obj.options,
+                                                old_entries)
         except Exception as msg:
             raise FirewallError(errors.COMMAND_FAILED, msg)
         else:
@@ -17,11 +17,47 @@ from firewall import errors
 from firewall.errors import FirewallError
 from firewall.core.base import SOURCE_IPSET_TYPES
 
+class PolicyRulesStr:
+    """ Read-only list of the rule strings of a runtime policy.
+
+    The rules are stored in FirewallPolicy._policy_rules only, which keeps
+    the order and removes rules without a list scan. Copies are lists.
+    """
+    def __init__(self, rules):
+        self._rules = rules
+
+    def __repr__(self):
+        return repr(list(self._rules))
+
+    def __iter__(self):
+        # rules might be added or removed while iterating
+        return iter(list(self._rules))
+
+    def __len__(self):
+        return len(self._rules)
+
+    def __contains__(self, rule_str):
+        return rule_str in self._rules
+
+    def __getitem__(self, index):
+        return list(self._rules)[index]
+
+    def __eq__(self, other):
+        return list(self._rules) == list(other)
+
+    def __copy__(self):
+        return list(self._rules)
+
+    def __deepcopy__(self, memo):
+        return list(self._rules)
+
 class FirewallPolicy:
     def __init__(self, fw):
         self._fw = fw
         self._chains = { }
         self._policies = { }
+        # parsed rich rules of the policies by rule string
+        self._policy_rules = { }
 
     def __repr__(self):
         return '%s(%r, %r)' % (self.__class__, self._chains, self._policies)
@@ -29,6 +65,7 @@ class FirewallPolicy:
     def cleanup(self):
         self._chains.clear()
         self._policies.clear()
+        self._policy_rules.clear()
 
     # transaction
 
@@ -37,11 +74,28 @@ class FirewallPolicy:
         t.add_pre(self._fw.full_check_config)
         return t
 
+    def __unregister_with_transaction(self, transaction, use_transaction,
+                                      unregister, unregister_args,
+                                      register, register_args):
+        # A removed setting is unregistered once the transaction succeeded.
+        # If the transaction is shared, further changes in it must not see
+        # the setting anymore, e.g. if the policy gets applied again. Then
+        # it is unregistered now and registered again if the transaction
+        # fails.
+        if use_transaction is None:
+            transaction.add_post(unregister, *unregister_args)
+        else:
+            unregister(*unregister_args)
+            transaction.add_fail(register, *register_args)
+
     # policies
 
     def get_policies(self):
         return sorted(self._policies.keys())
 
+    def query_policy(self, policy):
+        return policy in self._policies
+
     def get_policies_not_derived_from_zone(self):
         policies = []
         for p in self.get_policies():
@@ -66,12 +120,19 @@ class FirewallPolicy:
 
     def add_policy(self, obj):
         self._policies[obj.name] = obj
+        if len(obj.rules) == len(obj.rules_str):
+            rules = obj.rules
+        else:
+            rules = [Rich_Rule(rule_str=rule_str) for rule_str in obj.rules_str]
+        self._policy_rules[obj.name] = dict(zip(obj.rules_str, rules))
+        obj.rules_str = PolicyRulesStr(self._policy_rules[obj.name])
 
     def remove_policy(self, policy):
         obj = self._policies[policy]
         if obj.applied:
             self.unapply_policy_settings(policy)
         del self._policies[policy]
+        del self._policy_rules[policy]
 
     def apply_policies(self, use_transaction=None):
         for policy in self.get_policies():
@@ -135,7 +196,8 @@ class FirewallPolicy:
                 elif key == "masquerade":
                     self._masquerade(enable, _policy, transaction)
                 elif key == "rules_str":
-                    self.__rule(enable, _policy, Rich_Rule(rule_str=args),
+                    self.__rule(enable, _policy,
+                                self._policy_rules[_policy][args],
                                 transaction)
                 elif key == "ingress_zones":
                     if not obj.derived_from_zone:
@@ -173,13 +235,17 @@ class FirewallPolicy:
     def get_config_with_settings_dict(self, policy):
         return self.get_policy(policy).export_config_dict()
 
-    def set_config_with_settings_dict(self, policy, settings, sender):
+    def set_config_with_settings_dict(self, policy, settings, sender,
+                                      use_transaction=None, check=True):
         # stupid wrappers to convert rich rule string to rich rule object
         from firewall.core.rich import Rich_Rule
-        def add_rule_wrapper(policy, rule_str, timeout=0, sender=None):
-            self.add_rule(policy, Rich_Rule(rule_str=rule_str), timeout=0, sender=sender)
-        def remove_rule_wrapper(policy, rule_str):
-            self.remove_rule(policy, Rich_Rule(rule_str=rule_str))
+        def add_rule_wrapper(policy, rule_str, timeout=0, sender=None,
+                             use_transaction=None):
+            self.add_rule(policy, Rich_Rule(rule_str=rule_str), timeout=0, sender=sender,
+                          use_transaction=use_transaction)
+        def remove_rule_wrapper(policy, rule_str, use_transaction=None):
+            self.remove_rule(policy, Rich_Rule(rule_str=rule_str),
+                             use_transaction=use_transaction)
 
         setting_to_fn = {
             "services": (self.add_service, self.remove_service),
@@ -195,11 +261,13 @@ class FirewallPolicy:
         }
 
         # do a full config check on a temporary object before trying to make
-        # the runtime changes
-        old_obj = self.get_policy(policy)
-        check_obj = copy.copy(old_obj)
-        check_obj.import_config_dict(settings, self._fw.get_all_io_objects_dict())
-        self._fw.full_check_config({"policies": [check_obj]})
+        # the runtime changes. This can be skipped with check=False if the
+        # settings have been checked already, e.g. on reload.
+        if check:
+            old_obj = self.get_policy(policy)
+            check_obj = copy.copy(old_obj)
+            check_obj.import_config_dict(settings, self._fw.get_all_io_objects_dict())
+            self._fw.full_check_config({"policies": [check_obj]})
 
         old_settings = self.get_config_with_settings_dict(policy)
         (add_settings, remove_settings) = self._fw.get_added_and_removed_settings(old_settings, settings)
@@ -208,21 +276,26 @@ class FirewallPolicy:
             if isinstance(remove_settings[key], list):
                 for args in remove_settings[key]:
                     if isinstance(args, tuple):
-                        setting_to_fn[key][1](policy, *args)
+                        setting_to_fn[key][1](policy, *args,
+                                              use_transaction=use_transaction)
                     else:
-                        setting_to_fn[key][1](policy, args)
+                        setting_to_fn[key][1](policy, args,
+                                              use_transaction=use_transaction)
             else: # bool
-                setting_to_fn[key][1](policy)
+                setting_to_fn[key][1](policy, use_transaction=use_transaction)
 
         for key in add_settings:
             if isinstance(add_settings[key], list):
                 for args in add_settings[key]:
                     if isinstance(args, tuple):
-                        setting_to_fn[key][0](policy, *args, timeout=0, sender=sender)
+                        setting_to_fn[key][0](policy, *args, timeout=0, sender=sender,
+                                              use_transaction=use_transaction)
                     else:
-                        setting_to_fn[key][0](policy, args, timeout=0, sender=sender)
+                        setting_to_fn[key][0](policy, args, timeout=0, sender=sender,
+                                              use_transaction=use_transaction)
             else: # bool
-                setting_to_fn[key][0](policy, timeout=0, sender=sender)
+                setting_to_fn[key][0](policy, timeout=0, sender=sender,
+                                      use_transaction=use_transaction)
 
     # ingress zones
 
@@ -289,7 +362,10 @@ class FirewallPolicy:
             else:
                 self._ingress_zone(False, _policy, zone, transaction)
 
-        transaction.add_post(self.__unregister_ingress_zone, _obj, zone_id)
+        self.__unregister_with_transaction(
+                transaction, use_transaction,
+                self.__unregister_ingress_zone, (_obj, zone_id),
+                self.__register_ingress_zone, (_obj, zone_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -371,7 +447,10 @@ class FirewallPolicy:
             else:
                 self._egress_zone(False, _policy, zone, transaction)
 
-        transaction.add_post(self.__unregister_egress_zone, _obj, zone_id)
+        self.__unregister_with_transaction(
+                transaction, use_transaction,
+                self.__unregister_egress_zone, (_obj, zone_id),
+                self.__register_egress_zone, (_obj, zone_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -426,7 +505,7 @@ class FirewallPolicy:
         _obj = self._policies[_policy]
 
         rule_id = self.__rule_id(rule)
-        if rule_id in _obj.rules_str:
+        if rule_id in self._policy_rules[_policy]:
             _name = _obj.derived_from_zone if _obj.derived_from_zone else _policy
             raise FirewallError(errors.ALREADY_ENABLED,
                                 "'%s' already in '%s'" % (rule, _name))
@@ -439,7 +518,7 @@ class FirewallPolicy:
         if _obj.applied:
             self.__rule(True, _policy, rule, transaction)
 
-        self.__register_rule(_obj, rule_id, timeout, sender)
+        self.__register_rule(_obj, rule_id, rule, timeout, sender)
         transaction.add_fail(self.__unregister_rule, _obj, rule_id)
 
         if use_transaction is None:
@@ -447,8 +526,8 @@ class FirewallPolicy:
 
         return _policy
 
-    def __register_rule(self, _obj, rule_id, timeout, sender):
-        _obj.rules_str.append(rule_id)
+    def __register_rule(self, _obj, rule_id, rule, timeout, sender):
+        self._policy_rules[_obj.name][rule_id] = rule
 
     def remove_rule(self, policy, rule,
                     use_transaction=None):
@@ -457,7 +536,7 @@ class FirewallPolicy:
         _obj = self._policies[_policy]
 
         rule_id = self.__rule_id(rule)
-        if rule_id not in _obj.rules_str:
+        if rule_id not in self._policy_rules[_policy]:
             _name = _obj.derived_from_zone if _obj.derived_from_zone else _policy
             raise FirewallError(errors.NOT_ENABLED,
                                 "'%s' not in '%s'" % (rule, _name))
@@ -470,7 +549,11 @@ class FirewallPolicy:
         if _obj.applied:
             self.__rule(False, _policy, rule, transaction)
 
-        transaction.add_post(self.__unregister_rule, _obj, rule_id)
+        self.__unregister_with_transaction(
+                transaction, use_transaction,
+                self.__unregister_rule, (_obj, rule_id),
+                self.__register_rule,
+                (_obj, rule_id, self._policy_rules[_policy][rule_id], 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -478,14 +561,15 @@ class FirewallPolicy:
         return _policy
 
     def __unregister_rule(self, _obj, rule_id):
-        if rule_id in _obj.rules_str:
-            _obj.rules_str.remove(rule_id)
+        if rule_id in self._policy_rules[_obj.name]:
+            del self._policy_rules[_obj.name][rule_id]
 
     def query_rule(self, policy, rule):
-        return self.__rule_id(rule) in self.get_policy(policy).rules_str
+        _policy = self._fw.check_policy(policy)
+        return self.__rule_id(rule) in self._policy_rules[_policy]
 
     def list_rules(self, policy):
-        return self.get_policy(policy).rules_str
+        return list(self.get_policy(policy).rules_str)
 
     # SERVICES
 
@@ -548,7 +632,10 @@ class FirewallPolicy:
         if _obj.applied:
             self._service(False, _policy, service, transaction)
 
-        transaction.add_post(self.__unregister_service, _obj, service_id)
+        self.__unregister_with_transaction(
+                transaction, use_transaction,
+                self.__unregister_service, (_obj, service_id),
+                self.__register_service, (_obj, service_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -641,7 +728,10 @@ class FirewallPolicy:
             transaction.add_fail(self.__unregister_port, _obj, port_id)
         for range in removed_ranges:
             port_id = self.__port_id(range, protocol)
-            transaction.add_post(self.__unregister_port, _obj, port_id)
+            self.__unregister_with_transaction(
+                    transaction, use_transaction,
+                    self.__unregister_port, (_obj, port_id),
+                    self.__register_port, (_obj, port_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -685,7 +775,10 @@ class FirewallPolicy:
             transaction.add_fail(self.__unregister_port, _obj, port_id)
         for range in removed_ranges:
             port_id = self.__port_id(range, protocol)
-            transaction.add_post(self.__unregister_port, _obj, port_id)
+            self.__unregister_with_transaction(
+                    transaction, use_transaction,
+                    self.__unregister_port, (_obj, port_id),
+                    self.__register_port, (_obj, port_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -772,8 +865,10 @@ class FirewallPolicy:
         if _obj.applied:
             self._protocol(False, _policy, protocol, transaction)
 
-        transaction.add_post(self.__unregister_protocol, _obj,
-                                  protocol_id)
+        self.__unregister_with_transaction(
+                transaction, use_transaction,
+                self.__unregister_protocol, (_obj, protocol_id),
+                self.__register_protocol, (_obj, protocol_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -829,7 +924,10 @@ class FirewallPolicy:
             transaction.add_fail(self.__unregister_source_port, _obj, port_id)
         for range in removed_ranges:
             port_id = self.__source_port_id(range, protocol)
-            transaction.add_post(self.__unregister_source_port, _obj, port_id)
+            self.__unregister_with_transaction(
+                    transaction, use_transaction,
+                    self.__unregister_source_port, (_obj, port_id),
+                    self.__register_source_port, (_obj, port_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -873,7 +971,10 @@ class FirewallPolicy:
             transaction.add_fail(self.__unregister_source_port, _obj, port_id)
         for range in removed_ranges:
             port_id = self.__source_port_id(range, protocol)
-            transaction.add_post(self.__unregister_source_port, _obj, port_id)
+            self.__unregister_with_transaction(
+                    transaction, use_transaction,
+                    self.__unregister_source_port, (_obj, port_id),
+                    self.__register_source_port, (_obj, port_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -945,7 +1046,10 @@ class FirewallPolicy:
         if _obj.applied:
             self._masquerade(False, _policy, transaction)
 
-        transaction.add_post(self.__unregister_masquerade, _obj)
+        self.__unregister_with_transaction(
+                transaction, use_transaction,
+                self.__unregister_masquerade, (_obj, ),
+                self.__register_masquerade, (_obj, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -1038,7 +1142,10 @@ class FirewallPolicy:
             self._forward_port(False, _policy, transaction, port, protocol,
                                toport, toaddr)
 
-        transaction.add_post(self.__unregister_forward_port, _obj, forward_id)
+        self.__unregister_with_transaction(
+                transaction, use_transaction,
+                self.__unregister_forward_port, (_obj, forward_id),
+                self.__register_forward_port, (_obj, forward_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
@@ -1117,7 +1224,10 @@ class FirewallPolicy:
         if _obj.applied:
             self._icmp_block(False, _policy, icmp, transaction)
 
-        transaction.add_post(self.__unregister_icmp_block, _obj, icmp_id)
+        self.__unregister_with_transaction(
+                transaction, use_transaction,
+                self.__unregister_icmp_block, (_obj, icmp_id),
+                self.__register_icmp_block, (_obj, icmp_id, 0, None))
 
         if use_transaction is None:
             transaction.execute(True)
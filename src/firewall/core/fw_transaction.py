@@ -21,6 +21,7 @@
 """Transaction classes for firewalld"""
 
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from firewall.core.logger import log
 from firewall import errors
@@ -92,17 +93,21 @@ class FirewallTransaction:
         # stage 1: apply rules
         error = False
         errorMsg = ""
-        done = [ ]
-        for backend_name in rules:
-            try:
-                self.fw.rules(backend_name, rules[backend_name])
-            except Exception as msg:
-                error = True
-                errorMsg = msg
-                log.debug1(traceback.format_exc())
-                log.error(msg)
-            else:
-                done.append(backend_name)
+        reverse_rules = None
+        if self.fw._concurrent_backends and len(rules) > 1:
+            reverse_rules = self.reverse_rules(rules)
+        if reverse_rules is not None:
+            errorMsg = self.execute_concurrent(rules, reverse_rules)
+            error = errorMsg is not None
+        else:
+            for backend_name in rules:
+                try:
+                    self.fw.rules(backend_name, rules[backend_name])
+                except Exception as msg:
+                    error = True
+                    errorMsg = msg
+                    log.debug1(traceback.format_exc())
+                    log.error(msg)
 
         # stage 2: load modules
         if not error:
@@ -132,6 +137,66 @@ class FirewallTransaction:
         # post
         self.post()
 
+    def reverse_rules(self, rules):
+        """Return the rules that undo rules for every backend or None if
+        one of the rules can not be reversed, e.g. because it removes or
+        flushes something."""
+        reverse_rules = { }
+        for backend_name in rules:
+            backend = self.fw.get_backend_by_name(backend_name)
+            try:
+                reverse_rules[backend_name] = [ backend.reverse_rule(rule)
+                                                for rule
+                                                in reversed(rules[backend_name])
+                                                if rule ]
+            except FirewallError as msg:
+                log.debug1("Can not roll back %s, applying backends one by "
+                           "one: %s" % (backend_name, msg))
+                return None
+        return reverse_rules
+
+    def execute_concurrent(self, rules, reverse_rules):
+        """Apply the rules of all backends at the same time. The backends
+        keep separate state and run separate restore commands, so they do
+        not depend on each other. If a backend fails, reverse_rules are
+        applied on the backends that succeeded, see reverse_rules(). Returns
+        the first error or None."""
+        log.debug4("%s.execute_concurrent()" % type(self))
+
+        with ThreadPoolExecutor(max_workers=len(rules)) as executor:
+            futures = { backend_name: executor.submit(self.fw.rules,
+                                                      backend_name,
+                                                      rules[backend_name])
+                        for backend_name in rules }
+
+        errorMsg = None
+        done = [ ]
+        for (backend_name, future) in futures.items():
+            try:
+                future.result()
+            except Exception as msg:
+                if errorMsg is None:
+                    errorMsg = msg
+                log.debug1(traceback.format_exc())
+                log.error(msg)
+            else:
+                done.append(backend_name)
+
+        if errorMsg is not None:
+            for backend_name in done:
+                self.reverse(backend_name, reverse_rules[backend_name])
+
+        return errorMsg
+
+    def reverse(self, backend_name, reverse_rules):
+        log.debug4("%s.reverse(%s)" % (type(self), backend_name))
+
+        try:
+            self.fw.rules(backend_name, reverse_rules)
+        except Exception as msg:
+            log.debug1(traceback.format_exc())
+            log.error("Rolling back %s failed: %s" % (backend_name, msg))
+
     def pre(self):
         log.debug4("%s.pre()" % type(self))
 
@@ -143,3 +208,36 @@ class FirewallTransaction:
 
         for (func, args) in self.post_funcs:
             func(*args)
+
+class FirewallUndoLog:
+    """Journal of in-place changes to backend state.
+
+    Backends modify their bookkeeping (rule ref counts, priority counts, etc)
+    in place while processing rules and record the inverse of every change
+    here. If applying the rules fails, rollback() replays the inverse changes
+    in reverse order. This keeps the cost proportional to the number of
+    changed entries instead of copying all state up front.
+    """
+    def __init__(self):
+        self.undo_funcs = [ ] # [ (func, args),.. ]
+
+    def add(self, func, *args):
+        self.undo_funcs.append((func, args))
+
+    def set_item(self, _dict, key, value):
+        if key in _dict:
+            self.add(_dict.__setitem__, key, _dict[key])
+        else:
+            self.add(_dict.__delitem__, key)
+        _dict[key] = value
+
+    def del_item(self, _dict, key):
+        self.add(_dict.__setitem__, key, _dict[key])
+        del _dict[key]
+
+    def rollback(self):
+        log.debug4("%s.rollback()" % type(self))
+
+        for (func, args) in reversed(self.undo_funcs):
+            func(*args)
+        del self.undo_funcs[:]
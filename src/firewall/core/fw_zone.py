@@ -48,6 +48,9 @@ class FirewallZone:
         self._fw = fw
         self._zones = { }
         self._zone_policies = { }
+        # reverse maps of the zone bindings: interface_id/source_id -> zone
+        self._interface_zone = { }
+        self._source_zone = { }
 
     def __repr__(self):
         return '%s(%r)' % (self.__class__, self._zones)
@@ -55,6 +58,8 @@ class FirewallZone:
     def cleanup(self):
         self._zones.clear()
         self._zone_policies.clear()
+        self._interface_zone.clear()
+        self._source_zone.clear()
 
     def new_transaction(self):
         t = FirewallTransaction(self._fw)
@@ -69,6 +74,9 @@ class FirewallZone:
     def get_zones(self):
         return sorted(self._zones.keys())
 
+    def query_zone(self, zone):
+        return zone in self._zones
+
     def get_active_zones(self, append_default=True):
         active_zones = []
         for zone in self.get_zones():
@@ -80,19 +88,13 @@ class FirewallZone:
 
     def get_zone_of_interface(self, interface):
         interface_id = self.__interface_id(interface)
-        for zone in self._zones:
-            if interface_id in self._zones[zone].interfaces:
-                # an interface can only be part of one zone
-                return zone
-        return None
+        # an interface can only be part of one zone
+        return self._interface_zone.get(interface_id)
 
     def get_zone_of_source(self, source):
         source_id = self.__source_id(source)
-        for zone in self._zones:
-            if source_id in self._zones[zone].sources:
-                # a source_id can only be part of one zone
-                return zone
-        return None
+        # a source_id can only be part of one zone
+        return self._source_zone.get(source_id)
 
     def get_zone(self, zone):
         z = self._fw.check_zone(zone)
@@ -143,6 +145,10 @@ class FirewallZone:
     def add_zone(self, obj):
         self._zones[obj.name] = obj
         self._zone_policies[obj.name] = []
+        for interface_id in obj.interfaces:
+            self._interface_zone.setdefault(interface_id, obj.name)
+        for source_id in obj.sources:
+            self._source_zone.setdefault(source_id, obj.name)
 
         # Create policy objects, will need many:
         #   - (zone --> HOST) - ports, service, etc
@@ -164,6 +170,12 @@ class FirewallZone:
         obj = self._zones[zone]
         if obj.applied:
             self.unapply_zone_settings(zone)
+        for interface_id in obj.interfaces:
+            if self._interface_zone.get(interface_id) == zone:
+                del self._interface_zone[interface_id]
+        for source_id in obj.sources:
+            if self._source_zone.get(source_id) == zone:
+                del self._source_zone[source_id]
         del self._zones[zone]
         del self._zone_policies[zone]
 
@@ -342,12 +354,16 @@ class FirewallZone:
                     }
         return self._fw.combine_runtime_with_permanent_settings(permanent, runtime)
 
-    def set_config_with_settings_dict(self, zone, settings, sender):
+    def set_config_with_settings_dict(self, zone, settings, sender,
+                                      use_transaction=None, check=True):
         # stupid wrappers to convert rich rule string to rich rule object
-        def add_rule_wrapper(zone, rule_str, timeout=0, sender=None):
-            self.add_rule(zone, Rich_Rule(rule_str=rule_str), timeout=0, sender=sender)
-        def remove_rule_wrapper(zone, rule_str):
-            self.remove_rule(zone, Rich_Rule(rule_str=rule_str))
+        def add_rule_wrapper(zone, rule_str, timeout=0, sender=None,
+                             use_transaction=None):
+            self.add_rule(zone, Rich_Rule(rule_str=rule_str), timeout=0, sender=sender,
+                          use_transaction=use_transaction)
+        def remove_rule_wrapper(zone, rule_str, use_transaction=None):
+            self.remove_rule(zone, Rich_Rule(rule_str=rule_str),
+                             use_transaction=use_transaction)
 
         setting_to_fn = {
             "services": (self.add_service, self.remove_service),
@@ -365,11 +381,13 @@ class FirewallZone:
         }
 
         # do a full config check on a temporary object before trying to make
-        # the runtime changes
-        old_obj = self.get_zone(zone)
-        check_obj = copy.copy(old_obj)
-        check_obj.import_config_dict(settings, self._fw.get_all_io_objects_dict())
-        self._fw.full_check_config({"zones": [check_obj]})
+        # the runtime changes. This can be skipped with check=False if the
+        # settings have been checked already, e.g. on reload.
+        if check:
+            old_obj = self.get_zone(zone)
+            check_obj = copy.copy(old_obj)
+            check_obj.import_config_dict(settings, self._fw.get_all_io_objects_dict())
+            self._fw.full_check_config({"zones": [check_obj]})
 
         old_settings = self.get_config_with_settings_dict(zone)
         (add_settings, remove_settings) = self._fw.get_added_and_removed_settings(old_settings, settings)
@@ -378,29 +396,36 @@ class FirewallZone:
             if isinstance(remove_settings[key], list):
                 for args in remove_settings[key]:
                     if isinstance(args, tuple):
-                        setting_to_fn[key][1](zone, *args)
+                        setting_to_fn[key][1](zone, *args,
+                                              use_transaction=use_transaction)
                     else:
-                        setting_to_fn[key][1](zone, args)
+                        setting_to_fn[key][1](zone, args,
+                                              use_transaction=use_transaction)
             else: # bool
-                setting_to_fn[key][1](zone)
+                setting_to_fn[key][1](zone, use_transaction=use_transaction)
 
         for key in add_settings:
             if isinstance(add_settings[key], list):
                 for args in add_settings[key]:
                     if key in ["interfaces", "sources"]:
                         # no timeout arg
-                        setting_to_fn[key][0](zone, args, sender=sender)
+                        setting_to_fn[key][0](zone, args, sender=sender,
+                                              use_transaction=use_transaction)
                     else:
                         if isinstance(args, tuple):
-                            setting_to_fn[key][0](zone, *args, timeout=0, sender=sender)
+                            setting_to_fn[key][0](zone, *args, timeout=0, sender=sender,
+                                                  use_transaction=use_transaction)
                         else:
-                            setting_to_fn[key][0](zone, args, timeout=0, sender=sender)
+                            setting_to_fn[key][0](zone, args, timeout=0, sender=sender,
+                                                  use_transaction=use_transaction)
             else: # bool
                 if key in ["icmp_block_inversion"]:
                     # no timeout arg
-                    setting_to_fn[key][0](zone, sender=sender)
+                    setting_to_fn[key][0](zone, sender=sender,
+                                          use_transaction=use_transaction)
                 else:
-                    setting_to_fn[key][0](zone, timeout=0, sender=sender)
+                    setting_to_fn[key][0](zone, timeout=0, sender=sender,
+                                          use_transaction=use_transaction)
 
     # INTERFACES
 
@@ -419,7 +444,7 @@ class FirewallZone:
 
         interface_id = self.__interface_id(interface)
 
-        if interface_id in _obj.interfaces:
+        if self._interface_zone.get(interface_id) == _zone:
             raise FirewallError(errors.ZONE_ALREADY_SET,
                                 "'%s' already bound to '%s'" % (interface,
                                                                 zone))
@@ -456,12 +481,14 @@ class FirewallZone:
 
     def __register_interface(self, _obj, interface_id, zone, sender):
         _obj.interfaces.append(interface_id)
+        self._interface_zone[interface_id] = _obj.name
         if not zone or zone == "":
             self._fw._default_zone_interfaces.append(interface_id)
         if sender == nm_get_bus_name():
             self._fw._nm_assigned_interfaces.append(interface_id)
 
-    def change_zone_of_interface(self, zone, interface, sender=None):
+    def change_zone_of_interface(self, zone, interface, sender=None,
+                                 use_transaction=None):
         self._fw.check_panic()
         _old_zone = self.get_zone_of_interface(interface)
         _new_zone = self._fw.check_zone(zone)
@@ -470,9 +497,11 @@ class FirewallZone:
             return _old_zone
 
         if _old_zone is not None:
-            self.remove_interface(_old_zone, interface)
+            self.remove_interface(_old_zone, interface,
+                                  use_transaction=use_transaction)
 
-        _zone = self.add_interface(zone, interface, sender)
+        _zone = self.add_interface(zone, interface, sender,
+                                   use_transaction=use_transaction)
 
         return _zone
 
@@ -496,15 +525,29 @@ class FirewallZone:
 
         _obj = self._zones[_zone]
         interface_id = self.__interface_id(interface)
-        transaction.add_post(self.__unregister_interface, _obj, interface_id)
         self._interface(False, _zone, interface, transaction)
 
         if use_transaction is None:
+            transaction.add_post(self.__unregister_interface, _obj,
+                                 interface_id)
             transaction.execute(True)
+        else:
+            # Further changes in the transaction must not see the
+            # interface anymore, unregister it now and register it again
+            # if the transaction fails.
+            if interface_id in self._fw._default_zone_interfaces:
+                zone = ""
+            sender = nm_get_bus_name() \
+                if interface_id in self._fw._nm_assigned_interfaces else None
+            self.__unregister_interface(_obj, interface_id)
+            transaction.add_fail(self.__register_interface, _obj,
+                                 interface_id, zone, sender)
 
         return _zone
 
     def __unregister_interface(self, _obj, interface_id):
+        if self._interface_zone.get(interface_id) == _obj.name:
+            del self._interface_zone[interface_id]
         if interface_id in _obj.interfaces:
             _obj.interfaces.remove(interface_id)
         if interface_id in self._fw._default_zone_interfaces:
@@ -513,7 +556,8 @@ class FirewallZone:
             self._fw._nm_assigned_interfaces.remove(interface_id)
 
     def query_interface(self, zone, interface):
-        return self.__interface_id(interface) in self.get_zone(zone).interfaces
+        _zone = self._fw.check_zone(zone)
+        return self._interface_zone.get(self.__interface_id(interface)) == _zone
 
     def list_interfaces(self, zone):
         return self.get_zone(zone).interfaces
@@ -551,7 +595,7 @@ class FirewallZone:
         ipv = self.check_source(source, applied=allow_apply)
         source_id = self.__source_id(source, applied=allow_apply)
 
-        if source_id in _obj.sources:
+        if self._source_zone.get(source_id) == _zone:
             raise FirewallError(errors.ZONE_ALREADY_SET,
                             "'%s' already bound to '%s'" % (source, _zone))
         if self.get_zone_of_source(source) is not None:
@@ -581,8 +625,10 @@ class FirewallZone:
 
     def __register_source(self, _obj, source_id, zone, sender):
         _obj.sources.append(source_id)
+        self._source_zone[source_id] = _obj.name
 
-    def change_zone_of_source(self, zone, source, sender=None):
+    def change_zone_of_source(self, zone, source, sender=None,
+                              use_transaction=None):
         self._fw.check_panic()
         _old_zone = self.get_zone_of_source(source)
         _new_zone = self._fw.check_zone(zone)
@@ -594,9 +640,11 @@ class FirewallZone:
             source = source.upper()
 
         if _old_zone is not None:
-            self.remove_source(_old_zone, source)
+            self.remove_source(_old_zone, source,
+                               use_transaction=use_transaction)
 
-        _zone = self.add_source(zone, source, sender)
+        _zone = self.add_source(zone, source, sender,
+                                use_transaction=use_transaction)
 
         return _zone
 
@@ -623,22 +671,30 @@ class FirewallZone:
         _obj = self._zones[_zone]
         ipv = self.check_source(source)
         source_id = self.__source_id(source)
-        transaction.add_post(self.__unregister_source, _obj, source_id)
         self._source(False, _zone, ipv, source_id, transaction)
 
         if use_transaction is None:
+            transaction.add_post(self.__unregister_source, _obj, source_id)
             transaction.execute(True)
+        else:
+            # see remove_interface
+            self.__unregister_source(_obj, source_id)
+            transaction.add_fail(self.__register_source, _obj, source_id,
+                                 zone, None)
 
         return _zone
 
     def __unregister_source(self, _obj, source_id):
+        if self._source_zone.get(source_id) == _obj.name:
+            del self._source_zone[source_id]
         if source_id in _obj.sources:
             _obj.sources.remove(source_id)
 
     def query_source(self, zone, source):
         if check_mac(source):
             source = source.upper()
-        return self.__source_id(source) in self.get_zone(zone).sources
+        _zone = self._fw.check_zone(zone)
+        return self._source_zone.get(self.__source_id(source)) == _zone
 
     def list_sources(self, zone):
         return self.get_zone(zone).sources
@@ -826,16 +882,19 @@ class FirewallZone:
         self._interface_or_source_update_policies_derived_from_zone(enable, zone, "", source, transaction)
         self._interface_or_source_update_policies(enable, zone, "", source, transaction)
 
-    def add_service(self, zone, service, timeout=0, sender=None):
+    def add_service(self, zone, service, timeout=0, sender=None,
+                    use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.add_service(p_name, service, timeout, sender)
+        self._fw.policy.add_service(p_name, service, timeout, sender,
+                                    use_transaction=use_transaction)
         return zone
 
-    def remove_service(self, zone, service):
+    def remove_service(self, zone, service, use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.remove_service(p_name, service)
+        self._fw.policy.remove_service(p_name, service,
+                                       use_transaction=use_transaction)
         return zone
 
     def query_service(self, zone, service):
@@ -848,16 +907,19 @@ class FirewallZone:
         p_name = self.policy_name_from_zones(zone, "HOST")
         return self._fw.policy.list_services(p_name)
 
-    def add_port(self, zone, port, protocol, timeout=0, sender=None):
+    def add_port(self, zone, port, protocol, timeout=0, sender=None,
+                 use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.add_port(p_name, port, protocol, timeout, sender)
+        self._fw.policy.add_port(p_name, port, protocol, timeout, sender,
+                                 use_transaction=use_transaction)
         return zone
 
-    def remove_port(self, zone, port, protocol):
+    def remove_port(self, zone, port, protocol, use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.remove_port(p_name, port, protocol)
+        self._fw.policy.remove_port(p_name, port, protocol,
+                                    use_transaction=use_transaction)
         return zone
 
     def query_port(self, zone, port, protocol):
@@ -870,16 +932,20 @@ class FirewallZone:
         p_name = self.policy_name_from_zones(zone, "HOST")
         return self._fw.policy.list_ports(p_name)
 
-    def add_source_port(self, zone, source_port, protocol, timeout=0, sender=None):
+    def add_source_port(self, zone, source_port, protocol, timeout=0, sender=None,
+                        use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.add_source_port(p_name, source_port, protocol, timeout, sender)
+        self._fw.policy.add_source_port(p_name, source_port, protocol, timeout, sender,
+                                        use_transaction=use_transaction)
         return zone
 
-    def remove_source_port(self, zone, source_port, protocol):
+    def remove_source_port(self, zone, source_port, protocol,
+                           use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.remove_source_port(p_name, source_port, protocol)
+        self._fw.policy.remove_source_port(p_name, source_port, protocol,
+                                           use_transaction=use_transaction)
         return zone
 
     def query_source_port(self, zone, source_port, protocol):
@@ -910,14 +976,17 @@ class FirewallZone:
         else:
             raise FirewallError(errors.INVALID_RULE, "Rich rule type (%s) not handled." % (type(rule.element)))
 
-    def add_rule(self, zone, rule, timeout=0, sender=None):
+    def add_rule(self, zone, rule, timeout=0, sender=None,
+                 use_transaction=None):
         for p_name in self._rich_rule_to_policies(zone, rule):
-            self._fw.policy.add_rule(p_name, rule, timeout, sender)
+            self._fw.policy.add_rule(p_name, rule, timeout, sender,
+                                     use_transaction=use_transaction)
         return zone
 
-    def remove_rule(self, zone, rule):
+    def remove_rule(self, zone, rule, use_transaction=None):
         for p_name in self._rich_rule_to_policies(zone, rule):
-            self._fw.policy.remove_rule(p_name, rule)
+            self._fw.policy.remove_rule(p_name, rule,
+                                        use_transaction=use_transaction)
         return zone
 
     def query_rule(self, zone, rule):
@@ -935,16 +1004,19 @@ class FirewallZone:
             ret.update(set(self._fw.policy.list_rules(p_name)))
         return list(ret)
 
-    def add_protocol(self, zone, protocol, timeout=0, sender=None):
+    def add_protocol(self, zone, protocol, timeout=0, sender=None,
+                     use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.add_protocol(p_name, protocol, timeout, sender)
+        self._fw.policy.add_protocol(p_name, protocol, timeout, sender,
+                                     use_transaction=use_transaction)
         return zone
 
-    def remove_protocol(self, zone, protocol):
+    def remove_protocol(self, zone, protocol, use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.remove_protocol(p_name, protocol)
+        self._fw.policy.remove_protocol(p_name, protocol,
+                                        use_transaction=use_transaction)
         return zone
 
     def query_protocol(self, zone, protocol):
@@ -957,16 +1029,19 @@ class FirewallZone:
         p_name = self.policy_name_from_zones(zone, "HOST")
         return self._fw.policy.list_protocols(p_name)
 
-    def add_masquerade(self, zone, timeout=0, sender=None):
+    def add_masquerade(self, zone, timeout=0, sender=None,
+                       use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones("ANY", zone)
-        self._fw.policy.add_masquerade(p_name, timeout, sender)
+        self._fw.policy.add_masquerade(p_name, timeout, sender,
+                                       use_transaction=use_transaction)
         return zone
 
-    def remove_masquerade(self, zone):
+    def remove_masquerade(self, zone, use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones("ANY", zone)
-        self._fw.policy.remove_masquerade(p_name)
+        self._fw.policy.remove_masquerade(p_name,
+                                          use_transaction=use_transaction)
         return zone
 
     def query_masquerade(self, zone):
@@ -975,18 +1050,21 @@ class FirewallZone:
         return self._fw.policy.query_masquerade(p_name)
 
     def add_forward_port(self, zone, port, protocol, toport=None,
-                         toaddr=None, timeout=0, sender=None):
+                         toaddr=None, timeout=0, sender=None,
+                         use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "ANY")
         self._fw.policy.add_forward_port(p_name, port, protocol, toport, toaddr,
-                                         timeout, sender)
+                                         timeout, sender,
+                                         use_transaction=use_transaction)
         return zone
 
     def remove_forward_port(self, zone, port, protocol, toport=None,
-                            toaddr=None):
+                            toaddr=None, use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "ANY")
-        self._fw.policy.remove_forward_port(p_name, port, protocol, toport, toaddr)
+        self._fw.policy.remove_forward_port(p_name, port, protocol, toport, toaddr,
+                                            use_transaction=use_transaction)
         return zone
 
     def query_forward_port(self, zone, port, protocol, toport=None,
@@ -1001,17 +1079,20 @@ class FirewallZone:
         p_name = self.policy_name_from_zones(zone, "ANY")
         return self._fw.policy.list_forward_ports(p_name)
 
-    def add_icmp_block(self, zone, icmp, timeout=0, sender=None):
+    def add_icmp_block(self, zone, icmp, timeout=0, sender=None,
+                       use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.add_icmp_block(p_name, icmp, timeout, sender)
+        self._fw.policy.add_icmp_block(p_name, icmp, timeout, sender,
+                                       use_transaction=use_transaction)
 
         return zone
 
-    def remove_icmp_block(self, zone, icmp):
+    def remove_icmp_block(self, zone, icmp, use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.remove_icmp_block(p_name, icmp)
+        self._fw.policy.remove_icmp_block(p_name, icmp,
+                                          use_transaction=use_transaction)
 
         return zone
 
@@ -1025,10 +1106,12 @@ class FirewallZone:
         p_name_host = self.policy_name_from_zones(zone, "HOST")
         return sorted(set(self._fw.policy.list_icmp_blocks(p_name_host)))
 
-    def add_icmp_block_inversion(self, zone, sender=None):
+    def add_icmp_block_inversion(self, zone, sender=None,
+                                 use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.add_icmp_block_inversion(p_name, sender)
+        self._fw.policy.add_icmp_block_inversion(
+            p_name, sender, use_transaction=use_transaction)
 
         return zone
 
@@ -1037,10 +1120,11 @@ class FirewallZone:
         p_name = self.policy_name_from_zones(zone, "HOST")
         self._fw.policy._icmp_block_inversion(enable, p_name, transaction)
 
-    def remove_icmp_block_inversion(self, zone):
+    def remove_icmp_block_inversion(self, zone, use_transaction=None):
         zone = self._fw.check_zone(zone)
         p_name = self.policy_name_from_zones(zone, "HOST")
-        self._fw.policy.remove_icmp_block_inversion(p_name)
+        self._fw.policy.remove_icmp_block_inversion(
+            p_name, use_transaction=use_transaction)
 
         return zone
 
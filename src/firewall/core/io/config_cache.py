@@ -0,0 +1,122 @@
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Cache of parsed configuration files"""
+
+import os
+import pickle
+import tempfile
+
+from firewall import config
+from firewall.core.logger import log
+
+class ConfigCache:
+    """Cache of parsed configuration objects, stored in a single file.
+
+    An entry is only used if the inode, size, mtime and ctime of the
+    configuration file and the firewalld version are the same as when the
+    file was parsed. Objects are stored pickled, so every lookup returns a
+    new object that can be modified freely.
+
+    Entries that are not used between read() and write() are dropped from
+    the cache.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = { }
+        self._used = set()
+        self._dirty = False
+
+    def cleanup(self):
+        self._entries.clear()
+        self._used.clear()
+        self._dirty = False
+
+    @staticmethod
+    def file_id(name):
+        """Returns the id of file name that is used to detect changes or
+        None if the file can not be accessed."""
+        try:
+            st = os.stat(name)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+    def get(self, key, file_id):
+        """Returns the object stored for key if it has been parsed from the
+        file with id file_id, None otherwise."""
+        if file_id is None or key not in self._entries:
+            return None
+        (_file_id, data) = self._entries[key]
+        if _file_id != file_id:
+            return None
+        try:
+            obj = pickle.loads(data)
+        except Exception:
+            return None
+        self._used.add(key)
+        return obj
+
+    def set(self, key, file_id, obj):
+        """Store obj parsed from the file with id file_id. The id has to be
+        taken before parsing the file."""
+        if file_id is None:
+            return
+        try:
+            self._entries[key] = (file_id, pickle.dumps(obj))
+        except Exception as msg:
+            log.debug1("Failed to cache '%s': %s", key, msg)
+            return
+        self._used.add(key)
+        self._dirty = True
+
+    def read(self):
+        self.cleanup()
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return
+        # Only trust a cache that could not have been written by others.
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            log.warning("Ignoring config cache '%s', wrong owner or "
+                        "permissions", self.filename)
+            return
+        try:
+            with open(self.filename, "rb") as f:
+                (version, entries) = pickle.load(f)
+        except Exception as msg:
+            log.debug1("Failed to read config cache '%s': %s",
+                       self.filename, msg)
+            return
+        if version != config.VERSION or not isinstance(entries, dict):
+            log.debug1("Dropping config cache '%s' of version '%s'",
+                       self.filename, version)
+            return
+        self._entries = entries
+
+    def write(self):
+        for key in list(self._entries.keys()):
+            if key not in self._used:
+                del self._entries[key]
+                self._dirty = True
+        if not self._dirty:
+            return
+
+        dirname = os.path.dirname(self.filename)
+        try:
+            os.makedirs(dirname, mode=0o750, exist_ok=True)
+            (fd, name) = tempfile.mkstemp(prefix="%s." % \
+                                          os.path.basename(self.filename),
+                                          dir=dirname)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump((config.VERSION, self._entries), f)
+                os.rename(name, self.filename)
+            except Exception:
+                os.unlink(name)
+                raise
+        except Exception as msg:
+            log.debug1("Failed to write config cache '%s': %s",
+                       self.filename, msg)
+            return
+        self._dirty = False
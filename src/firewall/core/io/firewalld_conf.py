@@ -30,7 +30,12 @@ valid_keys = [ "DefaultZone", "MinimalMark", "CleanupOnExit",
                "CleanupModulesOnExit", "Lockdown", "IPv6_rpfilter",
                "IndividualCalls", "LogDenied", "AutomaticHelpers",
                "FirewallBackend", "FlushAllOnReload", "RFC3964_IPv4",
-               "AllowZoneDrifting", "NftablesFlowtable", "NftablesCounters"]
+               "AllowZoneDrifting", "NftablesFlowtable", "NftablesCounters",
+               "IncrementalReload",
+               "NftablesAggregatePorts",
+               "NftablesDispatchMaps",
+               "IPSetEntryJournal",
+               "ConcurrentBackends"]
 
 class firewalld_conf:
     def __init__(self, filename):
@@ -47,6 +52,11 @@ class firewalld_conf:
         self._config.clear()
         self._deleted = [ ]
 
+    def __eq__(self, other):
+        if isinstance(other, firewalld_conf):
+            return self._config == other._config
+        return NotImplemented
+
     def get(self, key):
         return self._config.get(key.strip())
 
@@ -80,6 +90,11 @@ class firewalld_conf:
         self.set("AllowZoneDrifting", "yes" if config.FALLBACK_ALLOW_ZONE_DRIFTING else "no")
         self.set("NftablesFlowtable", config.FALLBACK_NFTABLES_FLOWTABLE)
         self.set("NftablesCounters", "yes" if config.FALLBACK_NFTABLES_COUNTERS else "no")
+        self.set("IncrementalReload", "yes" if config.FALLBACK_INCREMENTAL_RELOAD else "no")
+        self.set("NftablesAggregatePorts", "yes" if config.FALLBACK_NFTABLES_AGGREGATE_PORTS else "no")
+        self.set("NftablesDispatchMaps", "yes" if config.FALLBACK_NFTABLES_DISPATCH_MAPS else "no")
+        self.set("IPSetEntryJournal", "yes" if config.FALLBACK_IPSET_ENTRY_JOURNAL else "no")
+        self.set("ConcurrentBackends", "yes" if config.FALLBACK_CONCURRENT_BACKENDS else "no")
 
     # load self.filename
     def read(self):
@@ -19,22 +19,20 @@
 #
 
 import os
+import time
 
 from firewall import config
 from firewall.errors import FirewallError
 
 from firewall.core.fw_config import FirewallConfig
-from firewall.core.io.zone import zone_reader
-from firewall.core.io.service import service_reader
-from firewall.core.io.ipset import ipset_reader
-from firewall.core.io.icmptype import icmptype_reader
-from firewall.core.io.helper import helper_reader
-from firewall.core.io.policy import policy_reader
+from firewall.core.logger import log
 from firewall.core.io.direct import Direct
 from firewall.core.io.lockdown_whitelist import LockdownWhitelist
 from firewall.core.io.firewalld_conf import firewalld_conf
 
 def check_on_disk_config(fw):
+    """Load and check the on-disk configuration. Returns the checked
+    FirewallConfig, reload uses it as the new permanent configuration."""
     fw_config = FirewallConfig(fw)
 
     try:
@@ -49,57 +47,23 @@ def check_on_disk_config(fw):
         raise Exception("'%s': %s" % (config.FIREWALLD_CONF, msg))
     fw_config.set_firewalld_conf(_firewalld_conf)
 
-    readers = {
-        "ipset": {
-            "reader": ipset_reader,
-            "add": fw_config.add_ipset,
-            "dirs": [config.FIREWALLD_IPSETS, config.ETC_FIREWALLD_IPSETS],
-        },
-        "helper": {
-            "reader": helper_reader,
-            "add": fw_config.add_helper,
-            "dirs": [config.FIREWALLD_HELPERS, config.ETC_FIREWALLD_HELPERS],
-        },
-        "icmptype": {
-            "reader": icmptype_reader,
-            "add": fw_config.add_icmptype,
-            "dirs": [config.FIREWALLD_ICMPTYPES, config.ETC_FIREWALLD_ICMPTYPES],
-        },
-        "service": {
-            "reader": service_reader,
-            "add": fw_config.add_service,
-            "dirs": [config.FIREWALLD_SERVICES, config.ETC_FIREWALLD_SERVICES],
-        },
-        "zone": {
-            "reader": zone_reader,
-            "add": fw_config.add_zone,
-            "dirs": [config.FIREWALLD_ZONES, config.ETC_FIREWALLD_ZONES],
-        },
-        "policy": {
-            "reader": policy_reader,
-            "add": fw_config.add_policy_object,
-            "dirs": [config.FIREWALLD_POLICIES, config.ETC_FIREWALLD_POLICIES],
-        },
-    }
-    for reader in readers.keys():
-        for _dir in readers[reader]["dirs"]:
-            if not os.path.isdir(_dir):
-                continue
-            for file in sorted(os.listdir(_dir)):
-                if file.endswith(".xml"):
-                    obj = readers[reader]["reader"](file, _dir)
-                    readers[reader]["add"](obj)
-    fw_config.full_check_config()
+    fw._start_load_config(fw_config)
 
+    # check the zones as they will be used in the runtime, with the combined
+    # zones coalesced into one zone
+    tm = time.time()
+    fw_config.full_check_config(zones=fw._get_runtime_zone_objects(fw_config))
+
+    obj = Direct(config.FIREWALLD_DIRECT)
     if os.path.isfile(config.FIREWALLD_DIRECT):
         try:
-            obj = Direct(config.FIREWALLD_DIRECT)
             obj.read()
             obj.check_config(obj.export_config())
         except FirewallError as error:
             raise FirewallError(error.code, "'%s': %s" % (config.FIREWALLD_DIRECT, error.msg))
         except Exception as msg:
             raise Exception("'%s': %s" % (config.FIREWALLD_DIRECT, msg))
+    fw_config.set_direct(obj)
     if os.path.isfile(config.LOCKDOWN_WHITELIST):
         try:
             obj = LockdownWhitelist(config.LOCKDOWN_WHITELIST)
@@ -109,3 +73,6 @@ def check_on_disk_config(fw):
             raise FirewallError(error.code, "'%s': %s" % (config.LOCKDOWN_WHITELIST, error.msg))
         except Exception as msg:
             raise Exception("'%s': %s" % (config.LOCKDOWN_WHITELIST, msg))
+    log.debug1("Checking the configuration took %f seconds", time.time() - tm)
+
+    return fw_config
@@ -21,8 +21,10 @@
 """ipset io XML handler, reader, writer"""
 
 import xml.sax as sax
+import copy
 import os
 import io
+import re
 import shutil
 
 from firewall import config
@@ -31,13 +33,31 @@ from firewall.functions import checkIP, checkIP6, checkIPnMask, \
     checkProtocol
 from firewall.core.io.io_object import IO_Object, \
     IO_Object_ContentHandler, IO_Object_XMLGenerator
-from firewall.core.ipset import IPSET_TYPES, IPSET_CREATE_OPTIONS
+from firewall.core.io.config_cache import ConfigCache
+from firewall.core.ipset import IPSET_TYPES, IPSET_CREATE_OPTIONS, \
+    IPSetEntries
 from firewall.core.icmp import check_icmp_name, check_icmp_type, \
     check_icmpv6_name, check_icmpv6_type
 from firewall.core.logger import log
 from firewall import errors
 from firewall.errors import FirewallError
 
+IPSET_JOURNAL_MIN_RECORDS = 1024
+""" Minimum number of records in an entry journal before it is compacted """
+
+_IPV4_RE = r"(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])" \
+           r"(?:\.(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])){3}"
+_IPSET_FAST_ENTRY_RE = {
+    "hash:ip": r"(?!0\.0\.0\.0$)%s(?:/(?:3[0-2]|[12]?[0-9]))?" % _IPV4_RE,
+    "hash:net": r"%s(?:/(?:3[0-2]|[12][0-9]|[1-9]))?" % _IPV4_RE,
+}
+_IPSET_SUSPECT_ENTRY_RE = {
+    ipset_type: re.compile(r"^(?!%s$).*$" % pattern, re.M)
+    for (ipset_type, pattern) in _IPSET_FAST_ENTRY_RE.items()
+}
+""" Match the lines that are not plain IPv4 entries accepted by
+IPSet.check_entry(), only these have to be checked individually """
+
 class IPSet(IO_Object):
     IMPORT_EXPORT_STRUCTURE = (
         ( "version",  "" ),              # s
@@ -55,6 +75,7 @@ class IPSet(IO_Object):
         "ipset": [ "type" ],
         "option": [ "name" ],
         "entry": None,
+        "entries": [ "file" ],
     }
     PARSER_OPTIONAL_ELEMENT_ATTRS = {
         "ipset": [ "version" ],
@@ -67,18 +88,51 @@ class IPSet(IO_Object):
         self.short = ""
         self.description = ""
         self.type = ""
-        self.entries = [ ]
+        self._entries = IPSetEntries()
         self.options = { }
         self.applied = False
+        self.journal_records = 0
+        self.entries_file = ""
+        self.entries_file_id = None
+        self.journal_base = None
 
     def cleanup(self):
         self.version = ""
         self.short = ""
         self.description = ""
         self.type = ""
-        del self.entries[:]
+        self._entries.clear()
         self.options.clear()
         self.applied = False
+        self.journal_records = 0
+        self.entries_file = ""
+        self.entries_file_id = None
+        self.journal_base = None
+
+    @property
+    def entries(self):
+        """Read-only view of the entries, see IPSetEntries.view(). Use
+        list(entries) for a copy."""
+        return self._entries.view()
+
+    @entries.setter
+    def entries(self, entries):
+        self._entries = IPSetEntries(entries)
+
+    def has_entry(self, entry):
+        return entry in self._entries
+
+    def add_entry(self, entry):
+        self._entries.add(entry)
+
+    def remove_entry(self, entry):
+        self._entries.remove(entry)
+
+    def check_entry_overlaps(self, entry):
+        self._entries.check_overlaps(entry)
+
+    def num_entries(self):
+        return len(self._entries)
 
     @staticmethod
     def check_entry(entry, options, ipset_type):
@@ -261,6 +315,35 @@ class IPSet(IO_Object):
                 raise FirewallError(errors.INVALID_IPSET,
                                     "ipset type '%s' not usable" % ipset_type)
 
+    @staticmethod
+    def check_entries(entries, options, ipset_type):
+        """Returns the valid entries in the order of entries without
+        duplicates. Invalid and duplicate entries are logged and ignored.
+
+        Plain IPv4 entries of hash:ip and hash:net ipsets are checked with a
+        single regular expression match over all entries, all other entries
+        are checked with check_entry()."""
+        valid = dict.fromkeys(entries)
+        if len(valid) != len(entries):
+            seen = set()
+            for entry in entries:
+                if entry in seen:
+                    log.warning("Entry %s already set, ignoring.", entry)
+                seen.add(entry)
+
+        suspects = list(valid)
+        if suspects and options.get("family", "inet") == "inet" and \
+           ipset_type in _IPSET_SUSPECT_ENTRY_RE:
+            suspects = _IPSET_SUSPECT_ENTRY_RE[ipset_type].findall(
+                "\n".join(valid))
+        for entry in suspects:
+            try:
+                IPSet.check_entry(entry, options, ipset_type)
+            except FirewallError as e:
+                log.warning("%s, ignoring.", e)
+                del valid[entry]
+        return list(valid)
+
     def _check_config(self, config, item, all_config, all_io_objects):
         if item == "type":
             if config not in IPSET_TYPES:
@@ -288,6 +371,24 @@ class IPSet(IO_Object):
                      config[key] not in [ "inet", "inet6" ]:
                     raise FirewallError(errors.INVALID_FAMILY, config[key])
 
+    def _export_value(self, key):
+        # the entries view can not be copied, export a list of them
+        if key == "entries":
+            return self._entries.to_list()
+        return copy.deepcopy(getattr(self, key))
+
+    def export_config(self):
+        return tuple(self._export_value(x[0])
+                     for x in self.IMPORT_EXPORT_STRUCTURE)
+
+    def export_config_dict(self):
+        conf = { }
+        for (key, dummy) in self.IMPORT_EXPORT_STRUCTURE:
+            value = getattr(self, key)
+            if value or isinstance(value, (bool, int)):
+                conf[key] = self._export_value(key)
+        return conf
+
     def import_config(self, config, all_io_objects):
         if "timeout" in config[4] and config[4]["timeout"] != "0":
             if len(config[5]) != 0:
@@ -299,6 +400,10 @@ class IPSet(IO_Object):
 # PARSER
 
 class ipset_ContentHandler(IO_Object_ContentHandler):
+    def __init__(self, item):
+        super(ipset_ContentHandler, self).__init__(item)
+        self.entries = [ ]
+
     def startElement(self, name, attrs):
         IO_Object_ContentHandler.startElement(self, name, attrs)
         self.item.parser_check_element_attrs(name, attrs)
@@ -352,12 +457,18 @@ class ipset_ContentHandler(IO_Object_ContentHandler):
                 self.item.options[attrs["name"]] = value
             else:
                 log.warning("Option %s already set, ignoring.", attrs["name"])
-        # nothing to do for entry and entries here
+        elif name == "entries":
+            if self.item.entries_file:
+                raise FirewallError(errors.PARSE_ERROR,
+                                    "More than one entries file")
+            check_ipset_entries_file(attrs["file"])
+            self.item.entries_file = attrs["file"]
+        # nothing to do for entry here
 
     def endElement(self, name):
         IO_Object_ContentHandler.endElement(self, name)
         if name == "entry":
-            self.item.entries.append(self._element)
+            self.entries.append(self._element)
 
 def ipset_reader(filename, path):
     ipset = IPSet()
@@ -383,40 +494,141 @@ def ipset_reader(filename, path):
             raise FirewallError(errors.INVALID_IPSET,
                                 "not a valid ipset file: %s" % \
                                 msg.getException())
+    entries = handler.entries
     del handler
     del parser
+    if ipset.entries_file:
+        entries_name = "%s/%s" % (path, ipset.entries_file)
+        ipset.entries_file_id = ConfigCache.file_id(entries_name)
+        try:
+            with open(entries_name, "rb") as f:
+                data = f.read().decode("UTF-8")
+        except (OSError, UnicodeDecodeError) as msg:
+            raise FirewallError(errors.INVALID_IPSET,
+                                "failed to read entries file '%s': %s" % \
+                                (entries_name, msg))
+        if "#" in data:
+            # drop comment lines
+            data = "\n".join(line for line in data.splitlines()
+                             if not line.lstrip().startswith("#"))
+        entries += data.split()
+        del data
+    ipset.journal_base = _ipset_journal_base(
+            name, ipset_entries_file_name(ipset, path))
+    journal = "%s.journal" % name
+    if os.path.exists(journal):
+        (entries, ipset.journal_records) = _ipset_journal_read(
+                journal, entries, ipset.journal_base)
     if "timeout" in ipset.options and ipset.options["timeout"] != "0" and \
-       len(ipset.entries) > 0:
+       len(entries) > 0:
         # no entries visible for ipsets with timeout
         log.warning("ipset '%s': timeout option is set, entries are ignored",
                     ipset.name)
-        del ipset.entries[:]
-    i = 0
-    entries_set = set()
-    while i < len(ipset.entries):
-        if ipset.entries[i] in entries_set:
-            log.warning("Entry %s already set, ignoring.", ipset.entries[i])
-            ipset.entries.pop(i)
-        else:
-            try:
-                ipset.check_entry(ipset.entries[i], ipset.options, ipset.type)
-            except FirewallError as e:
-                log.warning("%s, ignoring.", e)
-                ipset.entries.pop(i)
-            else:
-                entries_set.add(ipset.entries[i])
-                i += 1
-    del entries_set
+        entries = [ ]
+    ipset.entries = IPSet.check_entries(entries, ipset.options, ipset.type)
 
     return ipset
 
-def ipset_writer(ipset, path=None):
+def check_ipset_entries_file(filename):
+    """The entries file has to be a plain file name, it is in the directory
+    of the ipset file."""
+    if not filename or "/" in filename or filename in [ ".", ".." ] or \
+       filename.endswith(".xml"):
+        raise FirewallError(errors.INVALID_IPSET,
+                            "invalid entries file '%s'" % filename)
+
+def ipset_entries_file_name(ipset, path=None):
+    """Returns the name of the external entries file of ipset or None."""
+    if not ipset.entries_file:
+        return None
+    return "%s/%s" % (path if path else ipset.path, ipset.entries_file)
+
+def _ipset_journal_base(name, entries_name):
+    """Returns the id of the ipset file and the external entries file that
+    the records of an entry journal apply to. The id is written to the
+    first line of the journal."""
+    base = [ ]
+    for _name in [ name, entries_name ]:
+        if not _name:
+            continue
+        try:
+            st = os.stat(_name)
+        except OSError:
+            return None
+        base.append("%d:%d:%d" % (st.st_ino, st.st_size, st.st_mtime_ns))
+    return " ".join(base)
+
+def _ipset_journal_header(base):
+    return "#base %s\n" % base
+
+def _ipset_journal_read(journal, entries, base):
+    """Apply the records of the entry journal to entries. Returns the
+    resulting entries and the number of records. A journal that has not
+    been written for the files with id base is ignored."""
+    with open(journal, "r", encoding="UTF-8") as f:
+        if f.readline() != _ipset_journal_header(base):
+            log.warning("Entry journal '%s' does not match the ipset file, "
+                        "ignoring.", journal)
+            return (entries, 0)
+        entries = dict.fromkeys(entries)
+        records = 0
+        for line in f:
+            # an incomplete last record has not been written completely
+            if not line.endswith("\n"):
+                log.warning("Incomplete record in '%s', ignoring.", journal)
+                break
+            records += 1
+            if line[0] == "+":
+                entries[line[1:-1]] = None
+            elif line[0] == "-":
+                entries.pop(line[1:-1], None)
+            else:
+                log.warning("Invalid record in '%s', ignoring.", journal)
+    return (list(entries), records)
+
+def _ipset_file_name(ipset, path=None):
     _path = path if path else ipset.path
 
     if ipset.filename:
-        name = "%s/%s" % (_path, ipset.filename)
-    else:
-        name = "%s/%s.xml" % (_path, ipset.name)
+        return "%s/%s" % (_path, ipset.filename)
+    return "%s/%s.xml" % (_path, ipset.name)
+
+def ipset_journal_append(ipset, entry, add):
+    """Append a record for the added (add is True) or removed entry to the
+    entry journal of ipset. The journal is a file next to the ipset file
+    with a ".journal" suffix and one line per record, "+" or "-" followed by
+    the entry. The first line is the id of the ipset file the records apply
+    to. ipset_reader() applies it to the entries of the ipset file,
+    ipset_writer() removes it."""
+    journal = "%s.journal" % _ipset_file_name(ipset)
+    header = _ipset_journal_header(ipset.journal_base).encode("UTF-8")
+    with open(journal, "a+b") as f:
+        f.seek(0)
+        if f.read(len(header)) != header:
+            if f.tell() > 0:
+                log.warning("Entry journal '%s' does not match the ipset "
+                            "file, discarding.", journal)
+            f.truncate(0)
+            f.write(header)
+            ipset.journal_records = 0
+        elif f.seek(0, os.SEEK_END) > len(header):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # drop an incomplete last record, it is ignored by the reader
+                f.seek(0)
+                f.truncate(f.read().rfind(b"\n") + 1)
+        f.write(("%s%s\n" % ("+" if add else "-", entry)).encode("UTF-8"))
+    ipset.journal_records += 1
+
+def ipset_journal_needs_compaction(ipset):
+    """The journal is merged into the ipset file once it has more records
+    than a quarter of the entries, so that the cost of rewriting the file is
+    amortized over the changes."""
+    return ipset.journal_records > max(IPSET_JOURNAL_MIN_RECORDS,
+                                       ipset.num_entries() // 4)
+
+def ipset_writer(ipset, path=None):
+    name = _ipset_file_name(ipset, path)
 
     if os.path.exists(name):
         try:
@@ -467,12 +679,17 @@ def ipset_writer(ipset, path=None):
         handler.ignorableWhitespace("\n")
 
     # entries
-    for entry in ipset.entries:
+    if ipset.entries_file:
         handler.ignorableWhitespace("  ")
-        handler.startElement("entry", { })
-        handler.characters(entry)
-        handler.endElement("entry")
+        handler.simpleElement("entries", { "file": ipset.entries_file })
         handler.ignorableWhitespace("\n")
+    else:
+        for entry in ipset.entries:
+            handler.ignorableWhitespace("  ")
+            handler.startElement("entry", { })
+            handler.characters(entry)
+            handler.endElement("entry")
+            handler.ignorableWhitespace("\n")
 
     # end ipset element
     handler.endElement('ipset')
@@ -480,3 +697,21 @@ def ipset_writer(ipset, path=None):
     handler.endDocument()
     f.close()
     del handler
+
+    entries_name = ipset_entries_file_name(ipset, path)
+    if entries_name:
+        if os.path.exists(entries_name):
+            try:
+                shutil.copy2(entries_name, "%s.old" % entries_name)
+            except Exception as msg:
+                log.error("Backup of file '%s' failed: %s", entries_name, msg)
+        with io.open(entries_name, mode='wt', encoding='UTF-8') as f:
+            f.writelines("%s\n" % entry for entry in ipset.entries)
+        ipset.entries_file_id = ConfigCache.file_id(entries_name)
+
+    # the journal has been merged into the file
+    ipset.journal_base = _ipset_journal_base(name, entries_name)
+    journal = "%s.journal" % name
+    if os.path.exists(journal):
+        os.remove(journal)
+    ipset.journal_records = 0
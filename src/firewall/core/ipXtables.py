@@ -19,17 +19,18 @@
 #
 
 import os.path
-import copy
 
-from firewall.core.prog import runProg
+from firewall.core.prog import runProg, runProgStream
 from firewall.core.logger import log
-from firewall.functions import tempFile, readfile, splitArgs, check_mac, portStr, \
+from firewall.functions import splitArgs, check_mac, portStr, \
                                check_single_address, check_address, normalizeIP6
 from firewall import config
 from firewall.errors import FirewallError, INVALID_PASSTHROUGH, INVALID_RULE, UNKNOWN_ERROR, INVALID_ADDR
 from firewall.core.rich import Rich_Accept, Rich_Reject, Rich_Drop, Rich_Mark, Rich_NFLog, \
                                Rich_Masquerade, Rich_ForwardPort, Rich_IcmpBlock, Rich_Tcp_Mss_Clamp
 from firewall.core.base import DEFAULT_ZONE_TARGET
+from firewall.core.fw_transaction import FirewallUndoLog
+from firewall.core.sorted_list import SortedList
 import string
 
 POLICY_CHAIN_PREFIX = ""
@@ -92,6 +93,17 @@ def common_reverse_passthrough(args):
     raise FirewallError(INVALID_PASSTHROUGH,
                         "no '-A', '-I' or '-N' arg")
 
+# ipv ebtables also uses this
+#
+def common_reverse_rule(args):
+    """ Reverse rule that adds a rule or creates a chain """
+
+    try:
+        return common_reverse_passthrough(args)
+    except FirewallError:
+        raise FirewallError(INVALID_RULE,
+                            "can not reverse rule '%s'" % " ".join(args))
+
 # ipv ebtables also uses this
 #
 def common_check_passthrough(args):
@@ -139,7 +151,7 @@ class ip4tables:
         self.restore_wait_option = self._detect_restore_wait_option()
         self.fill_exists()
         self.available_tables = []
-        self.rich_rule_priority_counts = {}
+        self.rich_rule_priorities = {}
         self.policy_dispatch_index_cache = {}
         self.policy_dispatch_index_cache_ref_count = {}
         self.our_chains = {} # chains created by firewalld
@@ -198,6 +210,9 @@ class ip4tables:
     def reverse_passthrough(self, args):
         return common_reverse_passthrough(args)
 
+    def reverse_rule(self, rule):
+        return common_reverse_rule(rule)
+
     def passthrough_parse_table_chain(self, args):
         table = "filter"
         try:
@@ -220,7 +235,7 @@ class ip4tables:
                     chain = args[i+1]
         return (table, chain)
 
-    def _set_rule_replace_priority(self, rule, priority_counts, token):
+    def _set_rule_replace_priority(self, rule, token, undo):
         """
         Change something like
           -t filter -I public_IN %%RICH_RULE_PRIORITY%% 123
@@ -270,37 +285,36 @@ class ip4tables:
                         rule_add = False
 
             chain = (table, chain)
+            rich_rule_priorities = self.rich_rule_priorities
 
-            # Add the rule to the priority counts. We don't need to store the
-            # rule, just bump the ref count for the priority value.
+            # Add the rule to the chain's sorted priorities. We don't need to
+            # store the rule, just the priority value.
             if not rule_add:
-                if chain not in priority_counts or \
-                   priority not in priority_counts[chain] or \
-                   priority_counts[chain][priority] <= 0:
+                if chain not in rich_rule_priorities or \
+                   priority not in rich_rule_priorities[chain]:
                     raise FirewallError(UNKNOWN_ERROR, "nonexistent or underflow of priority count")
 
-                priority_counts[chain][priority] -= 1
+                rich_rule_priorities[chain].remove(priority)
+                undo.add(rich_rule_priorities[chain].add, priority)
             else:
-                if chain not in priority_counts:
-                    priority_counts[chain] = {}
-                if priority not in priority_counts[chain]:
-                    priority_counts[chain][priority] = 0
-
-                # calculate index of new rule
-                index = 1
-                for p in sorted(priority_counts[chain].keys()):
-                    if p == priority and insert:
-                        break
-                    index += priority_counts[chain][p]
-                    if p == priority:
-                        break
-
-                priority_counts[chain][priority] += 1
+                if chain not in rich_rule_priorities:
+                    undo.set_item(rich_rule_priorities, chain, SortedList())
+
+                # calculate index of new rule, i.e. one past the number of
+                # rules with a lower priority (insert) or lower or equal
+                # priority (append).
+                if insert:
+                    index = 1 + rich_rule_priorities[chain].count_lower(priority)
+                else:
+                    index = 1 + rich_rule_priorities[chain].count_lower_or_equal(priority)
+
+                rich_rule_priorities[chain].add(priority)
+                undo.add(rich_rule_priorities[chain].remove, priority)
 
                 rule[insert_add_index] = "-I"
                 rule.insert(insert_add_index+2, "%d" % index)
 
-    def _set_rule_sort_policy_dispatch(self, rule, policy_dispatch_index_cache, policy_dispatch_index_cache_ref_count):
+    def _set_rule_sort_policy_dispatch(self, rule, undo):
         try:
             i = rule.index("%%POLICY_SORT_KEY%%")
         except ValueError:
@@ -336,42 +350,46 @@ class ip4tables:
                 delete = True
 
         chain = (table, chain)
+        policy_dispatch_index_cache = self.policy_dispatch_index_cache
+        policy_dispatch_index_cache_ref_count = self.policy_dispatch_index_cache_ref_count
 
         if delete:
             if chain in policy_dispatch_index_cache and sort_tuple in policy_dispatch_index_cache[chain]:
                 if chain in policy_dispatch_index_cache_ref_count and sort_tuple in policy_dispatch_index_cache_ref_count[chain]:
                     if policy_dispatch_index_cache_ref_count[chain][sort_tuple] == 1:
-                        del policy_dispatch_index_cache_ref_count[chain][sort_tuple]
+                        undo.del_item(policy_dispatch_index_cache_ref_count[chain], sort_tuple)
                         policy_dispatch_index_cache[chain].remove(sort_tuple)
+                        undo.add(policy_dispatch_index_cache[chain].add, sort_tuple)
                         return False
                     else:
-                        policy_dispatch_index_cache_ref_count[chain][sort_tuple] -= 1
+                        undo.set_item(policy_dispatch_index_cache_ref_count[chain], sort_tuple,
+                                      policy_dispatch_index_cache_ref_count[chain][sort_tuple] - 1)
                         return True
                 else: # only ever one, so no ref count created
                     policy_dispatch_index_cache[chain].remove(sort_tuple)
+                    undo.add(policy_dispatch_index_cache[chain].add, sort_tuple)
                     return False
             return True
         else:
             if chain not in policy_dispatch_index_cache:
-                policy_dispatch_index_cache[chain] = []
+                undo.set_item(policy_dispatch_index_cache, chain, SortedList())
 
             # rule de-duplication
             if sort_tuple in policy_dispatch_index_cache[chain]:
                 if chain not in policy_dispatch_index_cache_ref_count:
-                    policy_dispatch_index_cache_ref_count[chain] = {}
+                    undo.set_item(policy_dispatch_index_cache_ref_count, chain, {})
                 if sort_tuple not in policy_dispatch_index_cache_ref_count[chain]:
-                    policy_dispatch_index_cache_ref_count[chain][sort_tuple] = 1
+                    undo.set_item(policy_dispatch_index_cache_ref_count[chain], sort_tuple, 1)
 
                 if sort_tuple in policy_dispatch_index_cache_ref_count[chain]:
-                    policy_dispatch_index_cache_ref_count[chain][sort_tuple] += 1
+                    undo.set_item(policy_dispatch_index_cache_ref_count[chain], sort_tuple,
+                                  policy_dispatch_index_cache_ref_count[chain][sort_tuple] + 1)
 
                 # Tell caller to skip this rule as we already have one
                 return True
 
-            policy_dispatch_index_cache[chain].append(sort_tuple)
-            policy_dispatch_index_cache[chain].sort()
-
-            index = policy_dispatch_index_cache[chain].index(sort_tuple)
+            index = policy_dispatch_index_cache[chain].add(sort_tuple)
+            undo.add(policy_dispatch_index_cache[chain].remove, sort_tuple)
 
             rule[verb_index] = "-I"
             rule.insert(verb_index + 2, f"{index + 1}")
@@ -379,12 +397,17 @@ class ip4tables:
             return False
 
     def set_rules(self, rules, log_denied):
-        temp_file = tempFile()
+        # Bookkeeping is updated in place. On failure the undo log reverts
+        # the entries this call touched.
+        undo = FirewallUndoLog()
+        try:
+            self._set_rules(rules, log_denied, undo)
+        except Exception:
+            undo.rollback()
+            raise
 
+    def _set_rules(self, rules, log_denied, undo):
         table_rules = { }
-        rich_rule_priority_counts = copy.deepcopy(self.rich_rule_priority_counts)
-        policy_dispatch_index_cache = copy.deepcopy(self.policy_dispatch_index_cache)
-        policy_dispatch_index_cache_ref_count = copy.deepcopy(self.policy_dispatch_index_cache_ref_count)
         for _rule in rules:
             rule = _rule[:]
 
@@ -408,8 +431,8 @@ class ip4tables:
                 else:
                     rule.pop(i)
 
-            self._set_rule_replace_priority(rule, rich_rule_priority_counts, "%%RICH_RULE_PRIORITY%%")
-            skip = self._set_rule_sort_policy_dispatch(rule, policy_dispatch_index_cache, policy_dispatch_index_cache_ref_count)
+            self._set_rule_replace_priority(rule, "%%RICH_RULE_PRIORITY%%", undo)
+            skip = self._set_rule_sort_policy_dispatch(rule, undo)
 
             if skip:
                 continue
@@ -437,45 +460,26 @@ class ip4tables:
 
             table_rules.setdefault(table, []).append(rule)
 
-        for table in table_rules:
-            rules = table_rules[table]
+        def restore_input():
+            for table in table_rules:
+                yield "*%s\n" % table
+                for rule in table_rules[table]:
+                    yield " ".join(rule) + "\n"
+                yield "COMMIT\n"
 
-            temp_file.write("*%s\n" % table)
-            for rule in rules:
-                temp_file.write(" ".join(rule) + "\n")
-            temp_file.write("COMMIT\n")
-
-        temp_file.close()
-
-        stat = os.stat(temp_file.name)
-        log.debug2("%s: %s %s", self.__class__, self._restore_command,
-                   "%s: %d" % (temp_file.name, stat.st_size))
         args = [ ]
         if self.restore_wait_option:
             args.append(self.restore_wait_option)
         args.append("-n")
+        log.debug2("%s: %s %s", self.__class__, self._restore_command,
+                   " ".join(args))
 
-        (status, ret) = runProg(self._restore_command, args,
-                                stdin=temp_file.name)
-
-        if log.getDebugLogLevel() > 2:
-            lines = readfile(temp_file.name)
-            if lines is not None:
-                i = 1
-                for line in lines:
-                    log.debug3("%8d: %s" % (i, line), nofmt=1, nl=0)
-                    if not line.endswith("\n"):
-                        log.debug3("", nofmt=1)
-                    i += 1
-
-        os.unlink(temp_file.name)
+        (status, ret) = runProgStream(self._restore_command, args,
+                                      restore_input())
 
         if status != 0:
             raise ValueError("'%s %s' failed: %s" % (self._restore_command,
                                                      " ".join(args), ret))
-        self.rich_rule_priority_counts = rich_rule_priority_counts
-        self.policy_dispatch_index_cache = policy_dispatch_index_cache
-        self.policy_dispatch_index_cache_ref_count = policy_dispatch_index_cache_ref_count
 
     def set_rule(self, rule, log_denied):
         # replace %%REJECT%%
@@ -498,19 +502,18 @@ class ip4tables:
             else:
                 rule.pop(i)
 
-        rich_rule_priority_counts = copy.deepcopy(self.rich_rule_priority_counts)
-        policy_dispatch_index_cache = copy.deepcopy(self.policy_dispatch_index_cache)
-        policy_dispatch_index_cache_ref_count = copy.deepcopy(self.policy_dispatch_index_cache_ref_count)
-        self._set_rule_replace_priority(rule, rich_rule_priority_counts, "%%RICH_RULE_PRIORITY%%")
-        skip = self._set_rule_sort_policy_dispatch(rule, policy_dispatch_index_cache, policy_dispatch_index_cache_ref_count)
+        undo = FirewallUndoLog()
+        try:
+            self._set_rule_replace_priority(rule, "%%RICH_RULE_PRIORITY%%", undo)
+            skip = self._set_rule_sort_policy_dispatch(rule, undo)
 
-        output = ""
-        if not skip:
-            output = self.__run(rule)
+            output = ""
+            if not skip:
+                output = self.__run(rule)
+        except Exception:
+            undo.rollback()
+            raise
 
-        self.rich_rule_priority_counts = rich_rule_priority_counts
-        self.policy_dispatch_index_cache = policy_dispatch_index_cache
-        self.policy_dispatch_index_cache_ref_count = policy_dispatch_index_cache_ref_count
         return output
 
     def get_available_tables(self, table=None):
@@ -544,13 +547,10 @@ class ip4tables:
         return wait_option
 
     def _detect_restore_wait_option(self):
-        temp_file = tempFile()
-        temp_file.write("#foo")
-        temp_file.close()
-
         wait_option = ""
         for test_option in ["-w", "--wait=2"]:
-            ret = runProg(self._restore_command, [test_option], stdin=temp_file.name)
+            ret = runProgStream(self._restore_command, [test_option],
+                                ["#foo"])
             log.debug3("%s: %s: probe for wait option (%s): ret=%u, output=\"%s\"", self.__class__, self._command, test_option, ret[0], ret[1])
             if ret[0] == 0 and "invalid option" not in ret[1] \
                            and "unrecognized option" not in ret[1]:
@@ -559,12 +559,10 @@ class ip4tables:
 
         log.debug2("%s: %s will be using %s option.", self.__class__, self._restore_command, wait_option)
 
-        os.unlink(temp_file.name)
-
         return wait_option
 
     def build_flush_rules(self):
-        self.rich_rule_priority_counts = {}
+        self.rich_rule_priorities = {}
         self.policy_dispatch_index_cache = {}
         self.policy_dispatch_index_cache_ref_count = {}
         rules = []
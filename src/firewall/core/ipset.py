@@ -20,14 +20,15 @@
 
 """The ipset command wrapper"""
 
-import os.path
 import ipaddress
+import secrets
+from types import MappingProxyType
 
 from firewall import errors
 from firewall.errors import FirewallError
-from firewall.core.prog import runProg
+from firewall.core.prog import runProg, runProgStream
 from firewall.core.logger import log
-from firewall.functions import tempFile, readfile
+from firewall.core.sorted_list import SortedList
 from firewall.config import COMMANDS
 
 IPSET_MAXNAMELEN = 32
@@ -201,13 +202,24 @@ class ipset:
             args.append(set_name)
         return self.__run(args)
 
+    def __restore(self, lines, args=None):
+        """Run ipset restore with the generated lines as input"""
+        args = [ "restore" ] + (args if args else [ ])
+        log.debug2("%s: %s %s", self.__class__, self._command,
+                   " ".join(args))
+
+        (status, ret) = runProgStream(self._command, args, lines)
+
+        if status != 0:
+            raise ValueError("'%s %s' failed: %s" % (self._command,
+                                                     " ".join(args), ret))
+        return ret
+
     def set_restore(self, set_name, type_name, entries,
                 create_options=None, entry_options=None):
         self.check_name(set_name)
         self.check_type(type_name)
 
-        temp_file = tempFile()
-
         if ' ' in set_name:
             set_name = "'%s'" % set_name
         args = [ "create", set_name, type_name, "-exist" ]
@@ -216,46 +228,101 @@ class ipset:
                 args.append(key)
                 if val != "":
                     args.append(val)
-        temp_file.write("%s\n" % " ".join(args))
-        temp_file.write("flush %s\n" % set_name)
-
-        for entry in entries:
-            if ' ' in entry:
-                entry = "'%s'" % entry
-            if entry_options:
-                temp_file.write("add %s %s %s\n" % \
-                                (set_name, entry, " ".join(entry_options)))
-            else:
-                temp_file.write("add %s %s\n" % (set_name, entry))
-        temp_file.close()
-
-        stat = os.stat(temp_file.name)
-        log.debug2("%s: %s restore %s", self.__class__, self._command,
-                   "%s: %d" % (temp_file.name, stat.st_size))
-
-        args = [ "restore" ]
-        (status, ret) = runProg(self._command, args,
-                                stdin=temp_file.name)
-
-        if log.getDebugLogLevel() > 2:
+
+        def restore_input():
+            yield "%s\n" % " ".join(args)
+            yield "flush %s\n" % set_name
+            for entry in entries:
+                if ' ' in entry:
+                    entry = "'%s'" % entry
+                if entry_options:
+                    yield "add %s %s %s\n" % (set_name, entry,
+                                               " ".join(entry_options))
+                else:
+                    yield "add %s %s\n" % (set_name, entry)
+
+        return self.__restore(restore_input())
+
+    def __shadow_name(self):
+        """Return a random name for a temporary set that is not in use"""
+        active = set(self.set_list(options=["-name"]))
+        for _ in range(3):
+            name = "fwshadow-%s" % secrets.token_hex(8)
+            if name not in active:
+                return name
+        raise FirewallError(errors.NAME_CONFLICT,
+                            "no unused name for a temporary ipset")
+
+    def set_replace_entries(self, set_name, type_name, entries,
+                            create_options=None, old_entries=None): # pylint: disable=W0613
+        """Replace the entries of set atomically
+
+        The new entries are loaded into a shadow set, which is then swapped
+        with set and destroyed, all within one restore call. Rules using set
+        never see an empty or partially filled set.
+        """
+        self.check_name(set_name)
+        self.check_type(type_name)
+
+        shadow_name = self.__shadow_name()
+
+        if ' ' in set_name:
+            set_name = "'%s'" % set_name
+        args = [ type_name ]
+        if create_options:
+            for key, val in create_options.items():
+                args.append(key)
+                if val != "":
+                    args.append(val)
+        def restore_input():
+            # swap needs both sets to exist. The shadow set is created
+            # without -exist, the restore fails before the swap if the name
+            # has been taken in the meantime.
+            yield "create %s %s -exist\n" % (set_name, " ".join(args))
+            yield "create %s %s\n" % (shadow_name, " ".join(args))
+            for entry in entries:
+                if ' ' in entry:
+                    entry = "'%s'" % entry
+                yield "add %s %s\n" % (shadow_name, entry)
+            yield "swap %s %s\n" % (set_name, shadow_name)
+            yield "destroy %s\n" % shadow_name
+
+        try:
+            return self.__restore(restore_input())
+        except Exception:
+            # the commands before the failing one have been applied, do not
+            # leave the shadow set behind
             try:
-                readfile(temp_file.name)
-            except Exception:
-                pass
-            else:
-                i = 1
-                for line in readfile(temp_file.name):
-                    log.debug3("%8d: %s" % (i, line), nofmt=1, nl=0)
-                    if not line.endswith("\n"):
-                        log.debug3("", nofmt=1)
-                    i += 1
+                if shadow_name in self.set_list(options=["-name"]):
+                    self.set_destroy(shadow_name)
+            except Exception as msg:
+                log.warning("Failed to destroy temporary ipset '%s': %s",
+                            shadow_name, msg)
+            raise
+
+    def __set_update_entries(self, command, set_name, entries):
+        self.check_name(set_name)
 
-        os.unlink(temp_file.name)
+        if ' ' in set_name:
+            set_name = "'%s'" % set_name
 
-        if status != 0:
-            raise ValueError("'%s %s' failed: %s" % (self._command,
-                                                     " ".join(args), ret))
-        return ret
+        def restore_input():
+            for entry in entries:
+                if ' ' in entry:
+                    entry = "'%s'" % entry
+                yield "%s %s %s\n" % (command, set_name, entry)
+
+        # -exist: the delta has been computed from the entries known to
+        # firewalld, do not fail the whole batch on a diverged kernel set.
+        return self.__restore(restore_input(), [ "-exist" ])
+
+    def set_add_entries(self, set_name, entries):
+        """Add entries to set with a single restore call"""
+        return self.__set_update_entries("add", set_name, entries)
+
+    def set_delete_entries(self, set_name, entries):
+        """Delete entries from set with a single restore call"""
+        return self.__set_update_entries("del", set_name, entries)
 
     def set_flush(self, set_name):
         args = [ "flush" ]
@@ -300,16 +367,26 @@ def normalize_ipset_entry(entry):
 
     return ",".join(_entry)
 
+def _parse_entry_network(entry):
+    """ Return the network of a simple entry or None """
+    # Only simple types
+    if "," in entry:
+        return None
+
+    try:
+        return ipaddress.ip_network(entry, strict=False)
+    except ValueError:
+        # could not parse the IP address, maybe a MAC or range
+        return None
+
 def check_entry_overlaps_existing(entry, entries):
     """ Check if entry overlaps any entry in the list of entries """
-    # Only check simple types
-    if len(entry.split(",")) > 1:
+    if isinstance(entries, IPSetEntries):
+        entries.check_overlaps(entry)
         return
 
-    try:
-        entry_network = ipaddress.ip_network(entry, strict=False)
-    except ValueError:
-        # could not parse the new IP address, maybe a MAC
+    entry_network = _parse_entry_network(entry)
+    if entry_network is None:
         return
 
     for itr in entries:
@@ -381,3 +458,137 @@ def check_for_overlapping_entries(entries):
         if prev_network.overlaps(current_network):
             raise FirewallError(errors.INVALID_ENTRY, "Entry '{}' overlaps entry '{}'".format(prev_network, current_network))
         prev_network = current_network
+
+class _IPSetNetworkIndex:
+    """Index of the networks of simple entries for overlap checks.
+
+    Two CIDR networks overlap only if one of them contains the other. The
+    networks containing a new entry are found with one hash lookup per prefix
+    length in use, the networks contained in it with a bisect on the sorted
+    network addresses.
+    """
+    def __init__(self, entries=None):
+        # (version, prefixlen) -> { network address: [ entry,.. ] }
+        self._prefixes = { }
+        # version -> SortedList of (network address, prefixlen)
+        self._networks = { 4: SortedList(), 6: SortedList() }
+        if entries:
+            for entry in entries:
+                self.add(entry)
+
+    def add(self, entry):
+        network = _parse_entry_network(entry)
+        if network is None:
+            return
+        addr = int(network.network_address)
+        self._prefixes.setdefault((network.version, network.prefixlen), { }) \
+                      .setdefault(addr, [ ]).append(entry)
+        self._networks[network.version].add((addr, network.prefixlen))
+
+    def remove(self, entry):
+        network = _parse_entry_network(entry)
+        if network is None:
+            return
+        addr = int(network.network_address)
+        key = (network.version, network.prefixlen)
+        _entries = self._prefixes[key][addr]
+        _entries.remove(entry)
+        if not _entries:
+            del self._prefixes[key][addr]
+            if not self._prefixes[key]:
+                del self._prefixes[key]
+        self._networks[network.version].remove((addr, network.prefixlen))
+
+    def get_overlapping(self, network):
+        """ Return an entry overlapping network or None """
+        addr = int(network.network_address)
+        max_prefixlen = network.max_prefixlen
+
+        # entries containing network, including an equal one
+        for (version, prefixlen), addrs in self._prefixes.items():
+            if version != network.version or prefixlen > network.prefixlen:
+                continue
+            host_bits = max_prefixlen - prefixlen
+            _addr = (addr >> host_bits) << host_bits
+            if _addr in addrs:
+                return addrs[_addr][0]
+
+        # entries contained in network
+        networks = self._networks[network.version]
+        i = networks.count_lower((addr, 0))
+        if i < len(networks):
+            (_addr, prefixlen) = networks[i]
+            if _addr <= int(network.broadcast_address):
+                return self._prefixes[(network.version, prefixlen)][_addr][0]
+
+        return None
+
+class IPSetEntries:
+    """Ordered container of ipset entries.
+
+    The entries are kept in insertion order as they are exposed as a list,
+    but membership tests, additions and removals do not need to scan them.
+    The network index used for overlap checks is only built on the first
+    check and is maintained afterwards.
+    """
+    def __init__(self, entries=None):
+        self._entries = dict.fromkeys(entries) if entries else { }
+        self._index = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __contains__(self, entry):
+        return entry in self._entries
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self._entries))
+
+    def __deepcopy__(self, memo):
+        # strings are immutable, the index is rebuilt on demand
+        return IPSetEntries(self._entries)
+
+    def add(self, entry):
+        """ Add entry, entries that are already present are ignored """
+        if entry in self._entries:
+            return
+        self._entries[entry] = None
+        if self._index is not None:
+            self._index.add(entry)
+
+    def remove(self, entry):
+        """ Remove entry. Raises KeyError if entry is not present """
+        del self._entries[entry]
+        if self._index is not None:
+            self._index.remove(entry)
+
+    def clear(self):
+        self._entries.clear()
+        self._index = None
+
+    def to_list(self):
+        return list(self._entries)
+
+    def view(self):
+        """ Read-only view of the entries in insertion order. It supports
+        iteration, len() and membership tests without copying the entries
+        and follows later changes. """
+        return MappingProxyType(self._entries)
+
+    def get_overlapping(self, entry):
+        """ Return an existing entry overlapping entry or None """
+        network = _parse_entry_network(entry)
+        if network is None:
+            return None
+        if self._index is None:
+            self._index = _IPSetNetworkIndex(self._entries)
+        return self._index.get_overlapping(network)
+
+    def check_overlaps(self, entry):
+        """ Check if entry overlaps any of the entries """
+        itr = self.get_overlapping(entry)
+        if itr is not None:
+            raise FirewallError(errors.INVALID_ENTRY, "Entry '{}' overlaps with existing entry '{}'".format(entry, itr))
@@ -17,8 +17,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
-import copy
 import json
+import sys
 import ipaddress
 
 from firewall.core.logger import log
@@ -31,10 +31,14 @@ from firewall.core.rich import Rich_Accept, Rich_Reject, Rich_Drop, Rich_Mark, \
                                Rich_Masquerade, Rich_ForwardPort, Rich_IcmpBlock, \
                                Rich_Tcp_Mss_Clamp, Rich_NFLog
 from firewall.core.base import DEFAULT_ZONE_TARGET
+from firewall.core.fw_transaction import FirewallUndoLog
+from firewall.core.sorted_list import SortedList
 from nftables.nftables import Nftables
 
 TABLE_NAME = "firewalld"
 TABLE_NAME_POLICY = TABLE_NAME + "_" + "policy_drop"
+# elements per transaction in set_restore()
+SET_RESTORE_BATCH_SIZE = 100000
 POLICY_CHAIN_PREFIX = "policy_"
 
 # Map iptables (table, chain) to hooks and priorities.
@@ -79,6 +83,10 @@ IPTABLES_TO_NFT_HOOK = {
     },
 }
 
+# Rule attributes that are assigned by the kernel or by set_rules() itself.
+# They're not part of the rule key.
+RULE_KEY_IGNORED_ATTRS = frozenset(["index", "handle", "position"])
+
 def _icmp_types_fragments(protocol, type, code=None):
     fragments = [{"match": {"left": {"payload": {"protocol": protocol, "field": "type"}},
                             "op": "==",
@@ -167,14 +175,18 @@ class nftables:
         self.available_tables = []
         self.rule_to_handle = {}
         self.rule_ref_count = {}
-        self.rich_rule_priority_counts = {}
+        self.rich_rule_priorities = {}
         self.policy_dispatch_index_cache = {}
+        self.aggregated_ports = {}
+        self.dispatch_ref_count = {}
+        self.dispatch_sources = {} # name: SortedList of source keys
+        self.dispatch_source_elements = {} # name: collapsed source keys
 
         self.nftables = Nftables()
         self.nftables.set_echo_output(True)
         self.nftables.set_handle_output(True)
 
-    def _set_rule_sort_policy_dispatch(self, rule, policy_dispatch_index_cache):
+    def _set_rule_sort_policy_dispatch(self, rule, undo):
         for verb in ["add", "insert", "delete"]:
             if verb in rule:
                 break
@@ -185,24 +197,26 @@ class nftables:
             return
 
         chain = (rule[verb]["rule"]["family"], rule[verb]["rule"]["chain"])
+        policy_dispatch_index_cache = self.policy_dispatch_index_cache
 
         if verb == "delete":
             if chain in policy_dispatch_index_cache and sort_tuple in policy_dispatch_index_cache[chain]:
                 policy_dispatch_index_cache[chain].remove(sort_tuple)
+                undo.add(policy_dispatch_index_cache[chain].add, sort_tuple)
         else:
             if chain not in policy_dispatch_index_cache:
-                policy_dispatch_index_cache[chain] = []
+                undo.set_item(policy_dispatch_index_cache, chain, SortedList())
 
             # We only have to track the sort key as it's unique. The actual
             # rule/json is not necessary.
             #
             # We only insert the tuple if it's not present. This is because we
             # do rule de-duplication in set_rules().
-            if sort_tuple not in policy_dispatch_index_cache[chain]:
-                policy_dispatch_index_cache[chain].append(sort_tuple)
-                policy_dispatch_index_cache[chain].sort()
-
-            index = policy_dispatch_index_cache[chain].index(sort_tuple)
+            if sort_tuple in policy_dispatch_index_cache[chain]:
+                index = policy_dispatch_index_cache[chain].index(sort_tuple)
+            else:
+                index = policy_dispatch_index_cache[chain].add(sort_tuple)
+                undo.add(policy_dispatch_index_cache[chain].remove, sort_tuple)
 
             _verb_snippet = rule[verb]
             del rule[verb]
@@ -213,7 +227,7 @@ class nftables:
                 rule["add"] = _verb_snippet
                 rule["add"]["rule"]["index"] = index
 
-    def _set_rule_replace_priority(self, rule, priority_counts, token):
+    def _set_rule_replace_priority(self, rule, token, undo):
         for verb in ["add", "insert", "delete"]:
             if verb in rule:
                 break
@@ -224,31 +238,29 @@ class nftables:
             if not isinstance(priority, int):
                 raise FirewallError(INVALID_RULE, "priority must be followed by a number")
             chain = (rule[verb]["rule"]["family"], rule[verb]["rule"]["chain"]) # family, chain
-            # Add the rule to the priority counts. We don't need to store the
-            # rule, just bump the ref count for the priority value.
+            rich_rule_priorities = self.rich_rule_priorities
+            # Add the rule to the chain's sorted priorities. We don't need to
+            # store the rule, just the priority value.
             if verb == "delete":
-                if chain not in priority_counts or \
-                   priority not in priority_counts[chain] or \
-                   priority_counts[chain][priority] <= 0:
+                if chain not in rich_rule_priorities or \
+                   priority not in rich_rule_priorities[chain]:
                     raise FirewallError(UNKNOWN_ERROR, "nonexistent or underflow of priority count")
 
-                priority_counts[chain][priority] -= 1
+                rich_rule_priorities[chain].remove(priority)
+                undo.add(rich_rule_priorities[chain].add, priority)
             else:
-                if chain not in priority_counts:
-                    priority_counts[chain] = {}
-                if priority not in priority_counts[chain]:
-                    priority_counts[chain][priority] = 0
-
-                # calculate index of new rule
-                index = 0
-                for p in sorted(priority_counts[chain].keys()):
-                    if p == priority and verb == "insert":
-                        break
-                    index += priority_counts[chain][p]
-                    if p == priority and verb == "add":
-                        break
-
-                priority_counts[chain][priority] += 1
+                if chain not in rich_rule_priorities:
+                    undo.set_item(rich_rule_priorities, chain, SortedList())
+
+                # calculate index of new rule, i.e. the number of rules with a
+                # lower priority (insert) or lower or equal priority (add).
+                if verb == "insert":
+                    index = rich_rule_priorities[chain].count_lower(priority)
+                else:
+                    index = rich_rule_priorities[chain].count_lower_or_equal(priority)
+
+                rich_rule_priorities[chain].add(priority)
+                undo.add(rich_rule_priorities[chain].remove, priority)
 
                 _verb_snippet = rule[verb]
                 del rule[verb]
@@ -259,28 +271,357 @@ class nftables:
                     rule["add"] = _verb_snippet
                     rule["add"]["rule"]["index"] = index
 
+    def _aggregated_rule(self, family, table, chain, match, elements):
+        (protocol, field) = match
+        if protocol == "meta":
+            left = {"meta": {"key": field}}
+            right = sorted(elements)
+        else:
+            left = {"payload": {"protocol": protocol, "field": field}}
+            # merge overlapping and adjacent port ranges, nftables does not
+            # accept them in an interval set.
+            ranges = []
+            for (low, high) in sorted(self._port_range(port) for port in elements):
+                if ranges and low <= ranges[-1][1] + 1:
+                    ranges[-1][1] = max(ranges[-1][1], high)
+                else:
+                    ranges.append([low, high])
+            right = [low if low == high else {"range": [low, high]}
+                     for (low, high) in ranges]
+        return {"rule": {"family": family,
+                         "table": table,
+                         "chain": chain,
+                         "expr": [{"match": {"left": left,
+                                             "op": "==",
+                                             "right": {"set": right}}},
+                                  {"accept": None}]}}
+
+    def _set_rules_aggregate(self, rules, undo):
+        # Plain port, protocol and source port accepts carry the
+        # %%AGGREGATE%% token if NftablesAggregatePorts is enabled. They are
+        # counted per chain and match, and replaced by a single rule matching
+        # an anonymous set with all elements. If the elements change, the
+        # aggregated rule is deleted and added again at the position of the
+        # last token rule of that chain and match.
+        changes = {} # (family, table, chain, match): [index, old elements]
+        _rules = []
+        for rule in rules:
+            for verb in ["add", "insert", "delete"]:
+                if verb in rule and "rule" in rule[verb] and \
+                   "%%AGGREGATE%%" in rule[verb]["rule"]:
+                    break
+            else:
+                _rules.append(rule)
+                continue
+
+            _rule = rule[verb]["rule"]
+            (protocol, field, element) = _rule["%%AGGREGATE%%"]
+            key = (_rule["family"], _rule["table"], _rule["chain"],
+                   (protocol, field))
+            if key not in changes:
+                elements = self.aggregated_ports.get(key, {})
+                changes[key] = [None, set(elements)]
+            changes[key][0] = len(_rules)
+
+            if key not in self.aggregated_ports:
+                undo.set_item(self.aggregated_ports, key, {})
+            elements = self.aggregated_ports[key]
+            if verb == "delete":
+                if element not in elements:
+                    raise FirewallError(UNKNOWN_ERROR, "aggregated element ref count bug: %s %s"
+                                                       % (key, element))
+                if elements[element] > 1:
+                    undo.set_item(elements, element, elements[element] - 1)
+                else:
+                    undo.del_item(elements, element)
+            else:
+                undo.set_item(elements, element, elements.get(element, 0) + 1)
+
+        offset = 0
+        for key in sorted(changes, key=lambda x: changes[x][0]):
+            (index, old_elements) = changes[key]
+            new_elements = set(self.aggregated_ports[key])
+            if new_elements == old_elements:
+                continue
+            (family, table, chain, match) = key
+            replacement = []
+            if old_elements:
+                replacement.append({"delete": self._aggregated_rule(
+                    family, table, chain, match, old_elements)})
+            if new_elements:
+                replacement.append({"add": self._aggregated_rule(
+                    family, table, chain, match, new_elements)})
+            _rules[index + offset:index + offset] = replacement
+            offset += len(replacement)
+
+        return _rules
+
+    def _dispatch_ref(self, key, undo):
+        """Increase the dispatch ref count of key. Returns True for the first
+        reference."""
+        count = self.dispatch_ref_count.get(key, 0)
+        undo.set_item(self.dispatch_ref_count, key, count + 1)
+        return count == 0
+
+    def _dispatch_unref(self, key, undo):
+        """Decrease the dispatch ref count of key. Returns True if the last
+        reference is gone."""
+        if key not in self.dispatch_ref_count:
+            raise FirewallError(UNKNOWN_ERROR, "dispatch ref count bug: %s" % (key,))
+        if self.dispatch_ref_count[key] > 1:
+            undo.set_item(self.dispatch_ref_count, key, self.dispatch_ref_count[key] - 1)
+            return False
+        undo.del_item(self.dispatch_ref_count, key)
+        return True
+
+    def _dispatch_source_key(self, source):
+        network = ipaddress.ip_network(source, strict=False)
+        return (int(network.network_address), network.prefixlen, network)
+
+    def _dispatch_source_range(self, items, network):
+        """Returns the items of a SortedList of source keys that are within
+        network."""
+        start = items.count_lower((int(network.network_address), -1))
+        end = items.count_lower_or_equal((int(network.broadcast_address),
+                                          network.max_prefixlen + 1))
+        return [items[i] for i in range(start, end)]
+
+    def _dispatch_source_parent(self, elements, network):
+        """Returns the key of the element that contains network or None. The
+        elements are disjoint, so only the one with the highest address not
+        above network's address can contain it."""
+        i = elements.count_lower_or_equal((int(network.network_address),
+                                           network.max_prefixlen + 1))
+        if i > 0 and elements[i - 1][2].supernet_of(network):
+            return elements[i - 1]
+        return None
+
+    def _dispatch_source_add(self, name, source, undo):
+        """Adds source to the sources of the set name and updates the
+        collapsed elements of the set. Returns the removed and added
+        elements. Only the elements around source are looked at."""
+        key = self._dispatch_source_key(source)
+        sources = self.dispatch_sources[name]
+        elements = self.dispatch_source_elements[name]
+        undo.add(sources.remove, key)
+        sources.add(key)
+
+        network = key[2]
+        if self._dispatch_source_parent(elements, network):
+            return ([], [])
+        # Elements within source are replaced by it. Then it is merged with
+        # its sibling as long as the sibling is an element. There is no other
+        # way to cover the sibling, because the elements are collapsed.
+        removed = self._dispatch_source_range(elements, network)
+        while network.prefixlen > 0:
+            supernet = network.supernet()
+            sibling = [subnet for subnet in supernet.subnets()
+                       if subnet != network][0]
+            sibling_key = (int(sibling.network_address), sibling.prefixlen,
+                           sibling)
+            if sibling_key not in elements:
+                break
+            removed.append(sibling_key)
+            network = supernet
+        added = [(int(network.network_address), network.prefixlen, network)]
+        for _key in removed:
+            undo.add(elements.add, _key)
+            elements.remove(_key)
+        undo.add(elements.remove, added[0])
+        elements.add(added[0])
+        return (removed, added)
+
+    def _dispatch_source_remove(self, name, source, undo):
+        """Removes source from the sources of the set name and updates the
+        collapsed elements of the set. Returns the removed and added
+        elements. Only the sources within the element that contains source
+        are collapsed again."""
+        key = self._dispatch_source_key(source)
+        sources = self.dispatch_sources[name]
+        elements = self.dispatch_source_elements[name]
+        undo.add(sources.add, key)
+        sources.remove(key)
+
+        parent = self._dispatch_source_parent(elements, key[2])
+        networks = [_key[2] for _key in
+                    self._dispatch_source_range(sources, parent[2])]
+        collapsed = [(int(network.network_address), network.prefixlen, network)
+                     for network in ipaddress.collapse_addresses(networks)]
+        if collapsed == [parent]:
+            return ([], [])
+        undo.add(elements.add, parent)
+        elements.remove(parent)
+        for _key in collapsed:
+            undo.add(elements.remove, _key)
+            elements.add(_key)
+        return ([parent], collapsed)
+
+    def _dispatch_lookup_rule(self, policies_chain, kind, name, zone_chain,
+                              priority, zone):
+        (table, chain) = policies_chain.split("_")[:2]
+        if isinstance(kind, tuple):
+            (family, field) = kind
+            expr = [{"match": {"left": {"payload": {"protocol": family,
+                                                    "field": field}},
+                               "op": "==",
+                               "right": "@%s" % name}},
+                    {"goto": {"target": zone_chain}}]
+            binding = (priority, 1, zone, family, "")
+        else:
+            expr = [{"vmap": {"key": {"meta": {"key": kind}},
+                              "data": "@%s" % name}}]
+            # The map holds the interfaces of all zones with this priority,
+            # so it sorts before their wildcard interface rules. Without the
+            # map the rules of the same priority are ordered by zone name,
+            # and a wildcard interface could take precedence over an exact
+            # one of another zone.
+            binding = (priority, 2, "", "", "")
+        host = (0, 0, "HOST", "", "")
+        if chain == "INPUT":
+            sort_key = binding + host + (0, 0)
+        else:
+            sort_key = host + binding + (0, 0)
+        return {"rule": {"family": "inet",
+                         "table": TABLE_NAME,
+                         "chain": policies_chain,
+                         "expr": expr,
+                         "%%POLICY_SORT_KEY%%": sort_key}}
+
+    def _set_rules_dispatch(self, rules, undo):
+        # Zone dispatch rules of a single interface or address binding carry
+        # the %%DISPATCH%% token if NftablesDispatchMaps is enabled. They are
+        # built for the zone's dispatch chain without the binding match. The
+        # binding becomes an element of a verdict map (interfaces) or an
+        # address set of the zone (sources) that is matched in the POLICIES
+        # chain. Dispatch chains, maps, sets and elements are ref counted and
+        # created with the first rule and deleted with the last one.
+        _rules = []
+        for rule in rules:
+            for verb in ["add", "insert", "delete"]:
+                if verb in rule and "rule" in rule[verb] and \
+                   "%%DISPATCH%%" in rule[verb]["rule"]:
+                    break
+            else:
+                _rules.append(rule)
+                continue
+
+            (policies_chain, kind, binding, zone_chain, priority, zone) = \
+                rule[verb]["rule"]["%%DISPATCH%%"]
+            _rule = {verb: dict(rule[verb])}
+            _rule[verb]["rule"] = {k: v for k, v in rule[verb]["rule"].items()
+                                   if k != "%%DISPATCH%%"}
+
+            if isinstance(kind, tuple):
+                (family, field) = kind
+                name = "%s_%s%s" % (zone_chain, field,
+                                    "4" if family == "ip" else "6")
+                set_def = {"family": "inet",
+                           "table": TABLE_NAME,
+                           "name": name,
+                           "type": "ipv4_addr" if family == "ip" else "ipv6_addr",
+                           "flags": ["interval"]}
+                set_type = "set"
+            else:
+                name = "%s_%s_%s" % (policies_chain.rsplit("_", 1)[0], kind,
+                                     priority if priority >= 0 else "n%d" % -priority)
+                set_def = {"family": "inet",
+                           "table": TABLE_NAME,
+                           "name": name,
+                           "type": "ifname",
+                           "map": "verdict"}
+                set_type = "map"
+            chain_def = {"family": "inet",
+                         "table": TABLE_NAME,
+                         "name": zone_chain}
+
+            if verb == "delete":
+                _rules.append(_rule)
+                if self._dispatch_unref(("binding", name, binding), undo):
+                    if set_type == "map":
+                        _rules.append({"delete": {"element": {
+                            "family": "inet", "table": TABLE_NAME, "name": name,
+                            "elem": [[binding, {"goto": {"target": zone_chain}}]]}}})
+                    else:
+                        _rules.extend(self._dispatch_source_element_rules(
+                            name, *self._dispatch_source_remove(name, binding, undo)))
+                    if self._dispatch_unref(("set", name), undo):
+                        _rules.append({"delete": self._dispatch_lookup_rule(
+                            policies_chain, kind, name, zone_chain, priority, zone)})
+                        _rules.append({"delete": {set_type: {
+                            "family": "inet", "table": TABLE_NAME, "name": name}}})
+                if self._dispatch_unref(("chain", zone_chain), undo):
+                    _rules.append({"delete": {"chain": chain_def}})
+            else:
+                if self._dispatch_ref(("chain", zone_chain), undo):
+                    _rules.append({"add": {"chain": chain_def}})
+                if self._dispatch_ref(("binding", name, binding), undo):
+                    if self._dispatch_ref(("set", name), undo):
+                        _rules.append({"add": {set_type: set_def}})
+                        _rules.append({"add": self._dispatch_lookup_rule(
+                            policies_chain, kind, name, zone_chain, priority, zone)})
+                    if set_type == "map":
+                        _rules.append({"add": {"element": {
+                            "family": "inet", "table": TABLE_NAME, "name": name,
+                            "elem": [[binding, {"goto": {"target": zone_chain}}]]}}})
+                    else:
+                        if name not in self.dispatch_sources:
+                            undo.set_item(self.dispatch_sources, name, SortedList())
+                            undo.set_item(self.dispatch_source_elements, name,
+                                          SortedList())
+                        _rules.extend(self._dispatch_source_element_rules(
+                            name, *self._dispatch_source_add(name, binding, undo)))
+                _rules.append(_rule)
+
+        return _rules
+
+    def _dispatch_source_element_json(self, key):
+        network = key[2]
+        if network.prefixlen == network.max_prefixlen:
+            return network.network_address.compressed
+        return {"prefix": {"addr": network.network_address.compressed,
+                           "len": network.prefixlen}}
+
+    def _dispatch_source_element_rules(self, name, removed, added):
+        rules = []
+        removed = [self._dispatch_source_element_json(key) for key in removed]
+        added = [self._dispatch_source_element_json(key) for key in added]
+        if removed:
+            rules.append({"delete": {"element": {"family": "inet",
+                                                 "table": TABLE_NAME,
+                                                 "name": name,
+                                                 "elem": removed}}})
+        if added:
+            rules.append({"add": {"element": {"family": "inet",
+                                              "table": TABLE_NAME,
+                                              "name": name,
+                                              "elem": added}}})
+        return rules
+
     def _get_rule_key(self, rule):
         for verb in ["add", "insert", "delete"]:
             if verb in rule and "rule" in rule[verb]:
-                rule_key = copy.deepcopy(rule[verb]["rule"])
-                for non_key in ["index", "handle", "position"]:
-                    if non_key in rule_key:
-                        del rule_key[non_key]
                 # str(rule_key) is insufficient because dictionary order is
-                # not stable.. so abuse the JSON library
-                rule_key = json.dumps(rule_key, sort_keys=True)
-                return rule_key
+                # not stable.. so abuse the JSON library. The rule is never
+                # modified, so a shallow filtered copy is enough. The key is
+                # interned as it's used many times as a dictionary key, e.g.
+                # rule_ref_count and rule_to_handle.
+                rule_key = {k: v for k, v in rule[verb]["rule"].items()
+                            if k not in RULE_KEY_IGNORED_ATTRS}
+                return sys.intern(json.dumps(rule_key, sort_keys=True,
+                                             check_circular=False,
+                                             separators=(",", ":")))
         # Not a rule (it's a table, chain, etc)
         return None
 
-    def set_rules(self, rules, log_denied):
+    def _set_rules_prepare(self, rules, undo):
         _valid_verbs = ["add", "insert", "delete", "flush", "replace"]
-        _valid_add_verbs = ["add", "insert", "replace"]
-        _deduplicated_rules = []
+        _deduplicated_rules = [] # [ (rule, rule_key),.. ]
         _executed_rules = []
-        rich_rule_priority_counts = copy.deepcopy(self.rich_rule_priority_counts)
-        policy_dispatch_index_cache = copy.deepcopy(self.policy_dispatch_index_cache)
-        rule_ref_count = self.rule_ref_count.copy()
+        rule_ref_count = self.rule_ref_count
+        if self._fw._nftables_aggregate_ports:
+            rules = self._set_rules_aggregate(rules, undo)
+        if self._fw._nftables_dispatch_maps:
+            rules = self._set_rules_dispatch(rules, undo)
         for rule in rules:
             if not isinstance(rule, dict):
                 raise FirewallError(UNKNOWN_ERROR, "rule must be a dictionary, rule: %s" % (rule))
@@ -298,27 +639,33 @@ class nftables:
                 log.debug2("%s: prev rule ref cnt %d, verb %s %s", self.__class__,
                            rule_ref_count[rule_key], verb, rule_key)
                 if verb != "delete":
-                    rule_ref_count[rule_key] += 1
+                    undo.set_item(rule_ref_count, rule_key, rule_ref_count[rule_key] + 1)
                     continue
                 elif rule_ref_count[rule_key] > 1:
-                    rule_ref_count[rule_key] -= 1
+                    undo.set_item(rule_ref_count, rule_key, rule_ref_count[rule_key] - 1)
                     continue
                 elif rule_ref_count[rule_key] == 1:
-                    rule_ref_count[rule_key] -= 1
+                    undo.set_item(rule_ref_count, rule_key, rule_ref_count[rule_key] - 1)
                 else:
                     raise FirewallError(UNKNOWN_ERROR, "rule ref count bug: rule_key '%s', cnt %d"
                                                        % (rule_key, rule_ref_count[rule_key]))
             elif rule_key and verb != "delete":
-                rule_ref_count[rule_key] = 1
+                undo.set_item(rule_ref_count, rule_key, 1)
                 log.debug2("%s: new rule ref cnt %d, verb %s %s", self.__class__,
                            rule_ref_count[rule_key], verb, rule_key)
             elif rule_key:
                 raise FirewallError(UNKNOWN_ERROR, f"rule ref count bug, missing ref count: rule_key '{rule_key}'")
 
-            _deduplicated_rules.append(rule)
+            _deduplicated_rules.append((rule, rule_key))
 
-            _rule = copy.deepcopy(rule)
+            _rule = rule
             if rule_key:
+                # Only the verb and rule dictionaries are modified below, so
+                # copy just those. The expressions are never modified in
+                # place.
+                _rule = {verb: dict(rule[verb])}
+                _rule[verb]["rule"] = dict(rule[verb]["rule"])
+
                 # filter empty rule expressions. Rich rules add quite a bit of
                 # them, but it makes the rest of the code simpler. libnftables
                 # does not tolerate them.
@@ -328,8 +675,8 @@ class nftables:
                     # -1 inserts just before the verdict
                     _rule[verb]["rule"]["expr"].insert(-1, {"counter": None})
 
-                self._set_rule_replace_priority(_rule, rich_rule_priority_counts, "%%RICH_RULE_PRIORITY%%")
-                self._set_rule_sort_policy_dispatch(_rule, policy_dispatch_index_cache)
+                self._set_rule_replace_priority(_rule, "%%RICH_RULE_PRIORITY%%", undo)
+                self._set_rule_sort_policy_dispatch(_rule, undo)
 
                 # delete using rule handle
                 if verb == "delete":
@@ -340,23 +687,32 @@ class nftables:
 
             _executed_rules.append(_rule)
 
-        json_blob = {"nftables": [{"metainfo": {"json_schema_version": 1}}] + _executed_rules}
-        if log.getDebugLogLevel() >= 3:
-            # guarded with if statement because json.dumps() is expensive.
-            log.debug3("%s: calling python-nftables with JSON blob: %s", self.__class__,
-                       json.dumps(json_blob))
-        rc, output, error = self.nftables.json_cmd(json_blob)
-        if rc != 0:
-            raise ValueError("'%s' failed: %s\nJSON blob:\n%s" % ("python-nftables", error, json.dumps(json_blob)))
+        return (_deduplicated_rules, _executed_rules)
 
-        self.rich_rule_priority_counts = rich_rule_priority_counts
-        self.policy_dispatch_index_cache = policy_dispatch_index_cache
-        self.rule_ref_count = rule_ref_count
+    def set_rules(self, rules, log_denied):
+        _valid_add_verbs = ["add", "insert", "replace"]
+
+        # Bookkeeping is updated in place. On failure the undo log reverts
+        # the entries this call touched.
+        undo = FirewallUndoLog()
+        try:
+            (_deduplicated_rules, _executed_rules) = self._set_rules_prepare(rules, undo)
+
+            json_blob = {"nftables": [{"metainfo": {"json_schema_version": 1}}] + _executed_rules}
+            if log.getDebugLogLevel() >= 3:
+                # guarded with if statement because json.dumps() is expensive.
+                log.debug3("%s: calling python-nftables with JSON blob: %s", self.__class__,
+                           json.dumps(json_blob))
+            rc, output, error = self.nftables.json_cmd(json_blob)
+            if rc != 0:
+                raise ValueError("'%s' failed: %s\nJSON blob:\n%s" % ("python-nftables", error, json.dumps(json_blob)))
+        except Exception:
+            undo.rollback()
+            raise
 
         index = 0
-        for rule in _deduplicated_rules:
+        for rule, rule_key in _deduplicated_rules:
             index += 1 # +1 due to metainfo
-            rule_key = self._get_rule_key(rule)
 
             if not rule_key:
                 continue
@@ -378,6 +734,14 @@ class nftables:
         self.set_rules([rule], log_denied)
         return ""
 
+    def reverse_rule(self, rule):
+        # Only rules can be reversed. Tables and chains are added even if
+        # they exist already, so deleting them is not the inverse.
+        for verb in ["add", "insert"]:
+            if verb in rule and "rule" in rule[verb]:
+                return {"delete": rule[verb]}
+        raise FirewallError(INVALID_RULE, "can not reverse rule: %s" % (rule))
+
     def get_available_tables(self, table=None):
         # Tables always exist in nftables
         return [table] if table else IPTABLES_TO_NFT_HOOK.keys()
@@ -406,8 +770,12 @@ class nftables:
 
         self.rule_to_handle = saved_rule_to_handle
         self.rule_ref_count = saved_rule_ref_count
-        self.rich_rule_priority_counts = {}
+        self.rich_rule_priorities = {}
         self.policy_dispatch_index_cache = {}
+        self.aggregated_ports = {}
+        self.dispatch_ref_count = {}
+        self.dispatch_sources = {}
+        self.dispatch_source_elements = {}
 
         return self._build_delete_table_rules(TABLE_NAME)
 
@@ -752,6 +1120,19 @@ class nftables:
         if egress_interface and egress_interface[len(egress_interface)-1] == "+":
             egress_interface = egress_interface[:len(egress_interface)-1] + "*"
 
+        rule_chain = "%s_%s_POLICIES" % (table, chain)
+        dispatch = None
+        if self._fw._nftables_dispatch_maps:
+            dispatch = self._policy_dispatch_map(table, chain, ingress_zone, egress_zone,
+                                                 ingress_interface, ingress_source,
+                                                 egress_interface, egress_source)
+        if dispatch:
+            # The binding is matched in the POLICIES chain, the rules go to
+            # the zone's dispatch chain without the binding match.
+            rule_chain = dispatch[3]
+            ingress_interface = ingress_source = ""
+            egress_interface = egress_source = ""
+
         rules = []
         expr_fragments = []
         if ingress_interface and ingress_interface != "*":
@@ -781,7 +1162,7 @@ class nftables:
 
                 rule = {"family": "inet",
                         "table": TABLE_NAME,
-                        "chain": "%s_%s_POLICIES" % (table, chain),
+                        "chain": rule_chain,
                         "expr": expr_fragments +
                                 [self._pkttype_match_fragment(self._fw.get_log_denied()),
                                  {"log": {"prefix": "filter_%s_%s: " % (_policy, _log_suffix)}}]}
@@ -793,6 +1174,8 @@ class nftables:
                                                            log_denied=True,
                                                            postrouting=postrouting,
                                                            prerouting=prerouting))
+                if dispatch:
+                    rule["%%DISPATCH%%"] = dispatch
                 rules.append({add_del: {"rule": rule}})
 
             if p_obj.target in [DEFAULT_ZONE_TARGET, "%%REJECT%%", "REJECT"]:
@@ -802,7 +1185,7 @@ class nftables:
 
         rule = {"family": "inet",
                 "table": TABLE_NAME,
-                "chain": "%s_%s_POLICIES" % (table, chain),
+                "chain": rule_chain,
                 "expr": expr_fragments}
         rule.update(self._policy_dispatch_sort_key(policy, ingress_zone, egress_zone,
                                                    ingress_interface, ingress_source,
@@ -811,11 +1194,52 @@ class nftables:
                                                    last=last,
                                                    postrouting=postrouting,
                                                    prerouting=prerouting))
+        if dispatch:
+            rule["%%DISPATCH%%"] = dispatch
 
         rules.append({add_del: {"rule": rule}})
 
         return rules
 
+    def _policy_dispatch_map(self, table, chain, ingress_zone, egress_zone,
+                             ingress_interface, ingress_source, egress_interface, egress_source):
+        # Only the dispatch of traffic to and from the host is done with maps.
+        # There every interface or source binding has its own terminal rules,
+        # so a goto to the zone's dispatch chain does not change the outcome.
+        if (table, chain) == ("filter", "INPUT"):
+            zone = ingress_zone
+            (interface, source) = (ingress_interface, ingress_source)
+            (if_key, addr_field) = ("iifname", "saddr")
+            if egress_interface or egress_source:
+                return None
+        elif (table, chain) in [("filter", "OUTPUT"), ("nat", "OUTPUT")]:
+            zone = egress_zone
+            (interface, source) = (egress_interface, egress_source)
+            (if_key, addr_field) = ("oifname", "daddr")
+            if ingress_interface or ingress_source:
+                return None
+        else:
+            return None
+
+        if interface:
+            if interface[-1] == "*":
+                return None
+            kind = if_key
+            binding = interface
+        elif source:
+            if source.startswith("ipset:") or check_mac(source):
+                return None
+            kind = ("ip" if check_address("ipv4", source) else "ip6", addr_field)
+            binding = source
+        else:
+            return None
+
+        z_obj = self._fw.zone.get_zone(zone)
+        priority = z_obj.ingress_priority if chain == "INPUT" else z_obj.egress_priority
+
+        return ("%s_%s_POLICIES" % (table, chain), kind, binding,
+                "%s_%s_ZONE_%s" % (table, chain, zone), priority, zone)
+
     def build_policy_chain_rules(self, enable, policy, table, chain):
         add_del = { True: "add", False: "delete" }[enable]
         isSNAT = True if (table == "nat" and chain == "POSTROUTING") else False
@@ -1132,7 +1556,25 @@ class nftables:
         else:
             return {"range": [range[0], range[1]]}
 
+    def _port_range(self, port):
+        range = getPortRange(port)
+        if isinstance(range, int) and range < 0:
+            raise FirewallError(INVALID_PORT)
+        return (range[0], range[-1])
+
+    def _aggregate_rule(self, enable, policy, protocol, field, element):
+        add_del = { True: "add", False: "delete" }[enable]
+        _policy = self._fw.policy.policy_base_chain_name(policy, "filter", POLICY_CHAIN_PREFIX)
+        return {add_del: {"rule": {"family": "inet",
+                                   "table": TABLE_NAME,
+                                   "chain": "filter_%s_allow" % (_policy),
+                                   "%%AGGREGATE%%": (protocol, field, element)}}}
+
     def build_policy_ports_rules(self, enable, policy, proto, port, destination=None, rich_rule=None):
+        if self._fw._nftables_aggregate_ports and not destination and not rich_rule:
+            self._port_range(port)
+            return [self._aggregate_rule(enable, policy, proto, "dport", port)]
+
         add_del = { True: "add", False: "delete" }[enable]
         table = "filter"
         _policy = self._fw.policy.policy_base_chain_name(policy, table, POLICY_CHAIN_PREFIX)
@@ -1165,6 +1607,9 @@ class nftables:
         return rules
 
     def build_policy_protocol_rules(self, enable, policy, protocol, destination=None, rich_rule=None):
+        if self._fw._nftables_aggregate_ports and not destination and not rich_rule:
+            return [self._aggregate_rule(enable, policy, "meta", "l4proto", protocol)]
+
         add_del = { True: "add", False: "delete" }[enable]
         table = "filter"
         _policy = self._fw.policy.policy_base_chain_name(policy, table, POLICY_CHAIN_PREFIX)
@@ -1226,6 +1671,10 @@ class nftables:
 
     def build_policy_source_ports_rules(self, enable, policy, proto, port,
                                       destination=None, rich_rule=None):
+        if self._fw._nftables_aggregate_ports and not destination and not rich_rule:
+            self._port_range(port)
+            return [self._aggregate_rule(enable, policy, proto, "sport", port)]
+
         add_del = { True: "add", False: "delete" }[enable]
         table = "filter"
         _policy = self._fw.policy.policy_base_chain_name(policy, table, POLICY_CHAIN_PREFIX)
@@ -1657,11 +2106,14 @@ class nftables:
                           "right": "@" + name}}
 
     def _set_entry_fragment(self, name, entry):
+        obj = self._fw.ipset.get_ipset(name)
+        return self._ipset_entry_fragment(obj, entry)
+
+    def _ipset_entry_fragment(self, obj, entry):
         # convert something like
         #    1.2.3.4,sctp:8080 (type hash:ip,port)
         # to
         #    ["1.2.3.4", "sctp", "8080"]
-        obj = self._fw.ipset.get_ipset(name)
         type_format = obj.type.split(":")[1].split(",")
         entry_tokens = entry.split(",")
         if len(type_format) != len(entry_tokens):
@@ -1708,26 +2160,62 @@ class nftables:
                 fragment.append(entry_tokens[i])
         return [{"concat": fragment}] if len(type_format) > 1 else fragment
 
+    def build_set_elements_rules(self, verb, name, entries):
+        # Elements do not have handles, so all entries are merged into a
+        # single command.
+        obj = self._fw.ipset.get_ipset(name)
+        elements = []
+        for entry in entries:
+            elements.extend(self._ipset_entry_fragment(obj, entry))
+        if not elements:
+            return []
+        return [{verb: {"element": {"family": "inet",
+                                    "table": TABLE_NAME,
+                                    "name": name,
+                                    "elem": elements}}}]
+
     def build_set_add_rules(self, name, entry):
-        rules = []
-        element = self._set_entry_fragment(name, entry)
-        rules.append({"add": {"element": {"family": "inet",
-                                          "table": TABLE_NAME,
-                                          "name": name,
-                                          "elem": element}}})
-        return rules
+        return self.build_set_elements_rules("add", name, [entry])
+
+    def build_set_delete_rules(self, name, entry):
+        return self.build_set_elements_rules("delete", name, [entry])
+
+    def set_element_rules(self, rules):
+        """Lightweight variant of set_rules() for set element and set flush
+        commands.
+
+        These are not tracked by the rule bookkeeping, and no handles are
+        needed for them. The transaction is submitted without echo output,
+        so nothing has to be returned and parsed.
+        """
+        json_blob = {"nftables": [{"metainfo": {"json_schema_version": 1}}] + rules}
+        if log.getDebugLogLevel() >= 3:
+            # guarded with if statement because json.dumps() is expensive.
+            log.debug3("%s: calling python-nftables with JSON blob: %s", self.__class__,
+                       json.dumps(json_blob))
+        self.nftables.set_echo_output(False)
+        try:
+            rc, output, error = self.nftables.json_cmd(json_blob)
+        finally:
+            self.nftables.set_echo_output(True)
+        if rc != 0:
+            raise ValueError("'%s' failed: %s\nJSON blob:\n%s" % ("python-nftables", error, json.dumps(json_blob)))
 
     def set_add(self, name, entry):
-        rules = self.build_set_add_rules(name, entry)
-        self.set_rules(rules, self._fw.get_log_denied())
+        self.set_element_rules(self.build_set_add_rules(name, entry))
 
     def set_delete(self, name, entry):
-        element = self._set_entry_fragment(name, entry)
-        rule = {"delete": {"element": {"family": "inet",
-                                       "table": TABLE_NAME,
-                                       "name": name,
-                                       "elem": element}}}
-        self.set_rule(rule, self._fw.get_log_denied())
+        self.set_element_rules(self.build_set_delete_rules(name, entry))
+
+    def set_add_entries(self, name, entries):
+        rules = self.build_set_elements_rules("add", name, entries)
+        if rules:
+            self.set_element_rules(rules)
+
+    def set_delete_entries(self, name, entries):
+        rules = self.build_set_elements_rules("delete", name, entries)
+        if rules:
+            self.set_element_rules(rules)
 
     def build_set_flush_rules(self, name):
         return [{"flush": {"set": {"family": "inet",
@@ -1735,8 +2223,28 @@ class nftables:
                                    "name": name}}}]
 
     def set_flush(self, name):
-        rules = self.build_set_flush_rules(name)
-        self.set_rules(rules, self._fw.get_log_denied())
+        self.set_element_rules(self.build_set_flush_rules(name))
+
+    def set_replace_entries(self, set_name, type_name, entries,
+                            create_options=None, old_entries=None): # pylint: disable=W0613
+        # Everything is done in a single transaction, so the set is replaced
+        # atomically. If the current entries are known only the difference
+        # is applied.
+        rules = []
+        if old_entries is None:
+            rules.extend(self.build_set_flush_rules(set_name))
+            rules.extend(self.build_set_elements_rules("add", set_name, entries))
+        else:
+            entries_set = set(entries)
+            old_entries_set = set(old_entries)
+            rules.extend(self.build_set_elements_rules("delete", set_name,
+                             [entry for entry in old_entries
+                              if entry not in entries_set]))
+            rules.extend(self.build_set_elements_rules("add", set_name,
+                             [entry for entry in entries
+                              if entry not in old_entries_set]))
+        if rules:
+            self.set_element_rules(rules)
 
     def _set_get_family(self, name):
         ipset = self._fw.ipset.get_ipset(name)
@@ -1751,20 +2259,80 @@ class nftables:
 
         return family
 
+    def _set_elements_json(self, obj, entries):
+        """Generator of the JSON text of the nftables elements for entries.
+
+        Plain addresses and networks are written directly, everything else
+        is converted with _ipset_entry_fragment(). Nothing is kept per entry,
+        so this can be used for very large sets.
+        """
+        type_format = obj.type.split(":")[1]
+        ipv6 = "family" in obj.options and obj.options["family"] == "inet6"
+        simple = type_format in ["ip", "net"]
+        dumps = json.JSONEncoder(check_circular=False,
+                                 separators=(",", ":")).encode
+        for entry in entries:
+            if simple and "-" not in entry:
+                (addr, slash, prefix_len) = entry.partition("/")
+                if ipv6:
+                    addr = normalizeIP6(addr)
+                if slash:
+                    yield '{"prefix":{"addr":"%s","len":%d}}' % (addr, int(prefix_len))
+                else:
+                    yield '"%s"' % addr
+            else:
+                for fragment in self._ipset_entry_fragment(obj, entry):
+                    yield dumps(fragment)
+
     def set_restore(self, set_name, type_name, entries,
                     create_options=None, entry_options=None):
-        rules = []
+        # The set is created, flushed and filled with the first batch of
+        # elements in one transaction. Larger sets are filled with further
+        # transactions of SET_RESTORE_BATCH_SIZE elements each, which bounds
+        # the size of the JSON text. There are no rule dictionaries per entry.
+        obj = self._fw.ipset.get_ipset(set_name)
+        rules = [{"metainfo": {"json_schema_version": 1}}]
         rules.extend(self.build_set_create_rules(set_name, type_name, create_options))
         rules.extend(self.build_set_flush_rules(set_name))
 
-        # avoid large memory usage by chunking the entries
-        chunk = 0
-        for entry in entries:
-            rules.extend(self.build_set_add_rules(set_name, entry))
-            chunk += 1
-            if chunk >= 1000:
-                self.set_rules(rules, self._fw.get_log_denied())
-                rules.clear()
-                chunk = 0
-        else:
-            self.set_rules(rules, self._fw.get_log_denied())
+        head = ",".join(json.dumps(rule) for rule in rules)
+        elem_prefix = '{"add":{"element":{"family":"inet","table":%s,' \
+                      '"name":%s,"elem":[' % (json.dumps(TABLE_NAME),
+                                              json.dumps(set_name))
+        count = 0
+        batch = [ ]
+        for element in self._set_elements_json(obj, entries):
+            batch.append(element)
+            count += 1
+            if len(batch) >= SET_RESTORE_BATCH_SIZE:
+                self._set_restore_batch(set_name, head, elem_prefix, batch)
+                head = '{"metainfo":{"json_schema_version":1}}'
+                batch = [ ]
+        if batch or count == 0:
+            self._set_restore_batch(set_name, head, elem_prefix, batch)
+
+        log.debug2("%s: restored set '%s' with %d elements", self.__class__,
+                   set_name, count)
+
+    def _set_restore_batch(self, set_name, head, elem_prefix, elements):
+        json_text = '{"nftables":[%s' % head
+        if elements:
+            json_text += ",%s%s]}}}" % (elem_prefix, ",".join(elements))
+        json_text += "]}"
+
+        if log.getDebugLogLevel() >= 3:
+            log.debug3("%s: calling python-nftables with JSON blob: %s", self.__class__,
+                       json_text)
+
+        # Nftables.json_cmd() only takes a dictionary, so pass the text
+        # directly with JSON input enabled the same way json_cmd() does.
+        self.nftables.set_echo_output(False)
+        json_output = self.nftables.set_json_output(True)
+        try:
+            rc, output, error = self.nftables.cmd(json_text)
+        finally:
+            self.nftables.set_json_output(json_output)
+            self.nftables.set_echo_output(True)
+        if rc != 0:
+            raise ValueError("'%s' failed to restore set '%s' with %d elements: %s"
+                             % ("python-nftables", set_name, len(elements), error))
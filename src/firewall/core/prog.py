@@ -19,6 +19,12 @@
 #
 
 import subprocess
+import threading
+
+from firewall.core.logger import log
+
+STREAM_CHUNK_SIZE = 65536
+""" Size of the chunks written to the stdin of a program by runProgStream """
 
 
 def runProg(prog, argv=None, stdin=None):
@@ -44,3 +50,70 @@ def runProg(prog, argv=None, stdin=None):
     (output, err_output) = process.communicate(input_string)
     output = output.decode('utf-8', 'replace')
     return (process.returncode, output)
+
+def runProgStream(prog, argv=None, lines=()):
+    """Run prog and write the strings of the iterable lines to its stdin as
+    they are generated, in chunks of STREAM_CHUNK_SIZE. The output is read
+    in a thread, so prog can not block on a full output pipe while lines
+    are written. If generating the lines fails, prog is killed before it
+    sees the end of its input and the exception is raised again.
+
+    With debug level 3 the lines are logged after prog has been run.
+    """
+    if argv is None:
+        argv = []
+
+    args = [prog] + argv
+
+    if log.getDebugLogLevel() > 2:
+        lines = list(lines)
+
+    env = {'LANG': 'C'}
+    try:
+        process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   stdout=subprocess.PIPE,
+                                   close_fds=True, env=env)
+    except OSError:
+        return (255, '')
+
+    output = [ ]
+    reader = threading.Thread(target=lambda: output.append(
+        process.stdout.read()))
+    reader.start()
+    try:
+        chunk = [ ]
+        size = 0
+        for line in lines:
+            chunk.append(line)
+            size += len(line)
+            if size >= STREAM_CHUNK_SIZE:
+                process.stdin.write("".join(chunk).encode())
+                chunk = [ ]
+                size = 0
+        if chunk:
+            process.stdin.write("".join(chunk).encode())
+        process.stdin.close()
+    except BrokenPipeError:
+        # prog exited early, the reason is in the output
+        pass
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        reader.join()
+        process.wait()
+        process.stdout.close()
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    if log.getDebugLogLevel() > 2:
+        for (i, line) in enumerate(lines, 1):
+            log.debug3("%8d: %s" % (i, line), nofmt=1, nl=0)
+            if not line.endswith("\n"):
+                log.debug3("", nofmt=1)
+
+    output = output[0].decode('utf-8', 'replace') if output else ''
+    return (process.returncode, output)
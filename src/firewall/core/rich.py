@@ -18,6 +18,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import re
+from collections import OrderedDict
+
 from firewall import functions
 from firewall.core.ipset import check_ipset_name
 from firewall.core.base import REJECT_TYPES
@@ -325,10 +328,71 @@ class Rich_Limit:
     def command(self):
         return ''
 
+# Maximum number of parsed rules kept in the Rich_Rule parse cache.
+RICH_RULE_CACHE_SIZE = 8192
+
+def _copy_rich_attrs(attrs):
+    """Copy the attributes of a parsed rule. Rule elements are copied
+    with the elements they contain, all other values are immutable."""
+    attrs = dict(attrs)
+    for (key, value) in attrs.items():
+        if hasattr(value, "__dict__"):
+            element = object.__new__(value.__class__)
+            element.__dict__ = _copy_rich_attrs(value.__dict__)
+            attrs[key] = element
+    return attrs
+
+# The lexer splits rules like shlex.split() in POSIX mode. Quotes and
+# backslash escapes are handled the same way. The only separator is the
+# space character, because stripNonPrintableCharacters() already removed
+# all other whitespace. Each alternative starts with a different character,
+# so there is no backtracking.
+_LEXER_TOKEN_RE = re.compile(r'''(?:[^ "'\\]|"(?:[^"\\]|\\.)*"|'[^']*'|\\.)+''', re.S)
+_LEXER_QUOTED_RE = re.compile(r'''"((?:[^"\\]|\\.)*)"|'([^']*)'|\\(.)''', re.S)
+_LEXER_ESCAPED_RE = re.compile(r'\\([\\"])')
+
+def _lexer_unquote(match):
+    if match.group(1) is not None:
+        return _LEXER_ESCAPED_RE.sub(r'\1', match.group(1))
+    if match.group(2) is not None:
+        return match.group(2)
+    return match.group(3)
+
+_PARSER_ATTRIBUTES = frozenset([
+    'priority', 'family', 'address', 'mac', 'ipset', 'invert', 'value',
+    'port', 'protocol', 'to-port', 'to-addr', 'name', 'group', 'prefix',
+    'level', 'queue-size', 'type', 'set'])
+_PARSER_ELEMENTS = frozenset([
+    'rule', 'source', 'destination', 'protocol', 'service', 'port',
+    'icmp-block', 'icmp-type', 'masquerade', 'forward-port', 'source-port',
+    'log', 'nflog', 'audit', 'accept', 'drop', 'reject', 'mark', 'limit',
+    'not', 'NOT', 'EOL', 'tcp-mss-clamp'])
+_PARSER_RULE_ELEMENTS = frozenset([
+    'protocol', 'service', 'port', 'icmp-block', 'icmp-type', 'masquerade',
+    'forward-port', 'source-port'])
+_PARSER_LOG_ELEMENTS = frozenset(['log', 'nflog'])
+_PARSER_ACTION_ELEMENTS = frozenset(['accept', 'drop', 'reject', 'mark'])
+_PARSER_NOT = frozenset(['not', 'NOT'])
+# attributes collected by elements that end with the first token that does
+# not belong to them
+_PARSER_ELEMENT_ATTRIBUTES = {
+    'source': frozenset(['address', 'mac', 'ipset', 'invert']),
+    'destination': frozenset(['address', 'ipset', 'invert']),
+    'port': frozenset(['port', 'protocol']),
+    'forward-port': frozenset(['port', 'protocol', 'to-port', 'to-addr']),
+    'source-port': frozenset(['port', 'protocol']),
+    'log': frozenset(['prefix', 'level']),
+    'nflog': frozenset(['group', 'prefix', 'queue-size']),
+}
+
 class Rich_Rule:
     priority_min = -32768
     priority_max =  32767
 
+    # Attributes of parsed rules by rule string, least recently used first.
+    # Rules get a copy of the cached attributes, see _copy_rich_attrs().
+    _cache = OrderedDict()
+
     def __init__(self, family=None, rule_str=None, priority=0):
         if family is not None:
             self.family = str(family)
@@ -344,22 +408,51 @@ class Rich_Rule:
         self.action = None
 
         if rule_str:
-            self._import_from_string(rule_str)
+            self._import_from_string_cached(rule_str)
+
+    def _import_from_string_cached(self, rule_str):
+        cached = Rich_Rule._cache.get(rule_str)
+        if cached is not None:
+            Rich_Rule._cache.move_to_end(rule_str)
+            self.__dict__.update(_copy_rich_attrs(cached))
+            return
+
+        self._import_from_string(rule_str)
+
+        # Only the given string is a valid key, str() does not escape quotes
+        # in values and might not parse to the same rule.
+        Rich_Rule._cache[rule_str] = _copy_rich_attrs(self.__dict__)
+        while len(Rich_Rule._cache) > RICH_RULE_CACHE_SIZE:
+            Rich_Rule._cache.popitem(last=False)
 
     def _lexer(self, rule_str):
         """ Lexical analysis """
         tokens = []
 
-        for r in functions.splitArgs(rule_str):
+        words = []
+        pos = 0
+        for match in _LEXER_TOKEN_RE.finditer(rule_str):
+            if rule_str[pos:match.start()].strip(' '):
+                break
+            word = match.group()
+            if '"' in word or "'" in word or '\\' in word:
+                word = _LEXER_QUOTED_RE.sub(_lexer_unquote, word)
+            words.append(word)
+            pos = match.end()
+        if rule_str[pos:].strip(' '):
+            # unbalanced quotes or a trailing escape, let shlex report it
+            words = functions.splitArgs(rule_str)
+
+        for r in words:
             if "=" in r:
-                attr = r.split('=')
-                if len(attr) != 2 or not attr[0] or not attr[1]:
+                (name, _, value) = r.partition('=')
+                if not name or not value or "=" in value:
                     raise FirewallError(errors.INVALID_RULE,
                                         'internal error in _lexer(): %s' % r)
-                tokens.append({'attr_name':attr[0], 'attr_value':attr[1]})
+                tokens.append((None, name, value))
             else:
-                tokens.append({'element':r})
-        tokens.append({'element':'EOL'})
+                tokens.append((r, None, None))
+        tokens.append(('EOL', None, None))
 
         return tokens
 
@@ -379,49 +472,37 @@ class Rich_Rule:
         self.action = None
 
         tokens = self._lexer(rule_str)
-        if tokens and tokens[0].get('element')  == 'EOL':
+        if tokens[0][0] == 'EOL':
             raise FirewallError(errors.INVALID_RULE, 'empty rule')
 
         attrs = {}       # attributes of elements
         in_elements = [] # stack with elements we are in
         index = 0        # index into tokens
-        while not (tokens[index].get('element')  == 'EOL' and in_elements == ['rule']):
-            element = tokens[index].get('element')
-            attr_name = tokens[index].get('attr_name')
-            attr_value = tokens[index].get('attr_value')
-            #print ("in_elements: ", in_elements)
-            #print ("index: %s, element: %s, attribute: %s=%s" % (index, element, attr_name, attr_value))
+        while True:
+            (element, attr_name, attr_value) = tokens[index]
+            if element == 'EOL' and in_elements == ['rule']:
+                break
             if attr_name:     # attribute
-                if attr_name not in ['priority', 'family', 'address', 'mac', 'ipset',
-                                     'invert', 'value',
-                                     'port', 'protocol', 'to-port', 'to-addr',
-                                     'name', 'group', 'prefix', 'level', 'queue-size', 'type',
-                                     'set']:
+                if attr_name not in _PARSER_ATTRIBUTES:
                     raise FirewallError(errors.INVALID_RULE, "bad attribute '%s'" % attr_name)
             else:             # element
-                if element in ['rule', 'source', 'destination', 'protocol',
-                               'service', 'port', 'icmp-block', 'icmp-type', 'masquerade',
-                               'forward-port', 'source-port', 'log', 'nflog', 'audit',
-                               'accept', 'drop', 'reject', 'mark', 'limit', 'not', 'NOT', 'EOL', 'tcp-mss-clamp']:
+                if element in _PARSER_ELEMENTS:
                     if element == 'source' and self.source:
                         raise FirewallError(errors.INVALID_RULE, "more than one 'source' element")
                     elif element == 'destination' and self.destination:
                         raise FirewallError(errors.INVALID_RULE, "more than one 'destination' element")
-                    elif element in ['protocol', 'service', 'port',
-                                     'icmp-block', 'icmp-type',
-                                     'masquerade', 'forward-port',
-                                     'source-port'] and self.element:
+                    elif element in _PARSER_RULE_ELEMENTS and self.element:
                         raise FirewallError(errors.INVALID_RULE, "more than one element. There cannot be both '%s' and '%s' in one rule." % (element, self.element))
-                    elif element in ['log', 'nflog'] and self.log:
+                    elif element in _PARSER_LOG_ELEMENTS and self.log:
                         raise FirewallError(errors.INVALID_RULE, "more than one logging element")
                     elif element == 'audit' and self.audit:
                         raise FirewallError(errors.INVALID_RULE, "more than one 'audit' element")
-                    elif element in ['accept', 'drop', 'reject', 'mark'] and self.action:
+                    elif element in _PARSER_ACTION_ELEMENTS and self.action:
                         raise FirewallError(errors.INVALID_RULE, "more than one 'action' element. There cannot be both '%s' and '%s' in one rule." % (element, self.action))
                 else:
                     raise FirewallError(errors.INVALID_RULE, "unknown element %s" % element)
 
-            in_element = in_elements[len(in_elements)-1] if len(in_elements) > 0 else ''
+            in_element = in_elements[-1] if in_elements else ''
 
             if in_element == '':
                 if not element and attr_name:
@@ -454,9 +535,9 @@ class Rich_Rule:
                 else:
                     in_elements.append(element) # push into stack
             elif in_element == 'source':
-                if attr_name in ['address', 'mac', 'ipset', 'invert']:
+                if attr_name in _PARSER_ELEMENT_ATTRIBUTES['source']:
                     attrs[attr_name] = attr_value
-                elif element in ['not', 'NOT']:
+                elif element in _PARSER_NOT:
                     attrs['invert'] = True
                 else:
                     self.source = Rich_Source(attrs.get('address'), attrs.get('mac'), attrs.get('ipset'), attrs.get('invert', False))
@@ -464,9 +545,9 @@ class Rich_Rule:
                     attrs.clear()
                     index = index -1 # return token to input
             elif in_element == 'destination':
-                if attr_name in ['address', 'ipset', 'invert']:
+                if attr_name in _PARSER_ELEMENT_ATTRIBUTES['destination']:
                     attrs[attr_name] = attr_value
-                elif element in ['not', 'NOT']:
+                elif element in _PARSER_NOT:
                     attrs['invert'] = True
                 else:
                     self.destination = Rich_Destination(attrs.get('address'), attrs.get('ipset'), attrs.get('invert', False))
@@ -494,7 +575,7 @@ class Rich_Rule:
                 else:
                     raise FirewallError(errors.INVALID_RULE, "invalid 'service' element")
             elif in_element == 'port':
-                if attr_name in ['port', 'protocol']:
+                if attr_name in _PARSER_ELEMENT_ATTRIBUTES['port']:
                     attrs[attr_name] = attr_value
                 else:
                     self.element = Rich_Port(attrs.get('port'), attrs.get('protocol'))
@@ -519,7 +600,7 @@ class Rich_Rule:
                 attrs.clear()
                 index = index -1 # return token to input
             elif in_element == 'forward-port':
-                if attr_name in ['port', 'protocol', 'to-port', 'to-addr']:
+                if attr_name in _PARSER_ELEMENT_ATTRIBUTES['forward-port']:
                     attrs[attr_name] = attr_value
                 else:
                     self.element = Rich_ForwardPort(attrs.get('port'), attrs.get('protocol'), attrs.get('to-port'), attrs.get('to-addr'))
@@ -527,7 +608,7 @@ class Rich_Rule:
                     attrs.clear()
                     index = index -1 # return token to input
             elif in_element == 'source-port':
-                if attr_name in ['port', 'protocol']:
+                if attr_name in _PARSER_ELEMENT_ATTRIBUTES['source-port']:
                     attrs[attr_name] = attr_value
                 else:
                     self.element = Rich_SourcePort(attrs.get('port'), attrs.get('protocol'))
@@ -535,7 +616,7 @@ class Rich_Rule:
                     attrs.clear()
                     index = index -1 # return token to input
             elif in_element == 'log':
-                if attr_name in ['prefix', 'level']:
+                if attr_name in _PARSER_ELEMENT_ATTRIBUTES['log']:
                     attrs[attr_name] = attr_value
                 elif element == 'limit':
                     in_elements.append('limit')
@@ -545,7 +626,7 @@ class Rich_Rule:
                     attrs.clear()
                     index = index -1 # return token to input
             elif in_element == 'nflog':
-                if attr_name in ['group', 'prefix', 'queue-size']:
+                if attr_name in _PARSER_ELEMENT_ATTRIBUTES['nflog']:
                     attrs[attr_name] = attr_value
                 elif element == 'limit':
                     in_elements.append('limit')
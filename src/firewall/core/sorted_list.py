@@ -0,0 +1,70 @@
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Sorted list with rank queries"""
+
+import bisect
+
+class SortedList:
+    """A list that is always kept in sorted order.
+
+    Duplicate values are allowed. Lookups and rank queries are logarithmic.
+    Insertion and removal are logarithmic searches followed by a single
+    memmove of the underlying array, which is far cheaper than re-sorting
+    the list or summing up counts per value.
+
+    This is used by the backends to find the insertion point of a rule in a
+    chain that is ordered by rich rule priority or policy dispatch sort key.
+    """
+    def __init__(self, iterable=None):
+        self._items = sorted(iterable) if iterable else []
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __contains__(self, value):
+        i = bisect.bisect_left(self._items, value)
+        return i < len(self._items) and self._items[i] == value
+
+    def __eq__(self, other):
+        if isinstance(other, SortedList):
+            return self._items == other._items
+        return NotImplemented
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self._items)
+
+    def add(self, value):
+        """Add value after any equal values. Returns the index it was
+        inserted at."""
+        i = bisect.bisect_right(self._items, value)
+        self._items.insert(i, value)
+        return i
+
+    def remove(self, value):
+        """Remove one occurrence of value. Raises ValueError if value is not
+        present."""
+        i = self.index(value)
+        del self._items[i]
+
+    def index(self, value):
+        """Returns the index of the first occurrence of value. Raises
+        ValueError if value is not present."""
+        i = bisect.bisect_left(self._items, value)
+        if i < len(self._items) and self._items[i] == value:
+            return i
+        raise ValueError("%r is not in list" % (value,))
+
+    def count_lower(self, value):
+        """Returns the number of items lower than value."""
+        return bisect.bisect_left(self._items, value)
+
+    def count_lower_or_equal(self, value):
+        """Returns the number of items lower than or equal to value."""
+        return bisect.bisect_right(self._items, value)
@@ -171,6 +171,15 @@ def dbus_signature(obj):
     else:
         raise TypeError("Unhandled %s" % repr(obj))
 
+def dbus_typed(obj, signature):
+    """ Wrap containers in the D-Bus type of the single complete type
+    signature, so that they can be put into a variant even if empty """
+    if signature.startswith("a{"):
+        return dbus.Dictionary(obj, signature=signature[2:-1])
+    elif signature.startswith("a"):
+        return dbus.Array(obj, signature=signature[1:])
+    return obj
+
 def dbus_introspection_prepare_properties(obj, interface, access=None):
     if access is None:
         access = { }
@@ -37,13 +37,13 @@ from firewall.server.config_zone import FirewallDConfigZone
 from firewall.server.config_policy import FirewallDConfigPolicy
 from firewall.server.config_ipset import FirewallDConfigIPSet
 from firewall.server.config_helper import FirewallDConfigHelper
+from firewall.server.sender_cache import sender_cache
 from firewall.core.io.icmptype import IcmpType
 from firewall.core.io.ipset import IPSet
 from firewall.core.io.helper import Helper
 from firewall.core.io.lockdown_whitelist import LockdownWhitelist
 from firewall.core.io.direct import Direct
 from firewall.dbus_utils import dbus_to_python, \
-    command_of_sender, context_of_sender, uid_of_sender, user_of_uid, \
     dbus_introspection_prepare_properties, \
     dbus_introspection_add_properties, \
     dbus_introspection_add_deprecated
@@ -110,6 +110,11 @@ class FirewallDConfig(DbusServiceObject):
                 "AllowZoneDrifting": "readwrite",
                 "NftablesFlowtable": "readwrite",
                 "NftablesCounters": "readwrite",
+                "IncrementalReload": "readwrite",
+                "NftablesAggregatePorts": "readwrite",
+                "NftablesDispatchMaps": "readwrite",
+                "IPSetEntryJournal": "readwrite",
+                "ConcurrentBackends": "readwrite",
             }
         )
 
@@ -541,16 +546,16 @@ class FirewallDConfig(DbusServiceObject):
                 log.error("Lockdown not possible, sender not set.")
                 return
             bus = dbus.SystemBus()
-            context = context_of_sender(bus, sender)
+            context = sender_cache.context(bus, sender)
             if self.config.access_check("context", context):
                 return
-            uid = uid_of_sender(bus, sender)
+            uid = sender_cache.uid(bus, sender)
             if self.config.access_check("uid", uid):
                 return
-            user = user_of_uid(uid)
+            user = sender_cache.user(bus, sender)
             if self.config.access_check("user", user):
                 return
-            command = command_of_sender(bus, sender)
+            command = sender_cache.command(bus, sender)
             if self.config.access_check("command", command):
                 return
             raise FirewallError(errors.ACCESS_DENIED, "lockdown is enabled")
@@ -565,7 +570,7 @@ class FirewallDConfig(DbusServiceObject):
                          "CleanupModulesOnExit", "Lockdown", "IPv6_rpfilter",
                          "IndividualCalls", "LogDenied", "AutomaticHelpers",
                          "FirewallBackend", "FlushAllOnReload", "RFC3964_IPv4",
-                         "AllowZoneDrifting", "NftablesFlowtable", "NftablesCounters"]:
+                         "AllowZoneDrifting", "NftablesFlowtable", "NftablesCounters", "IncrementalReload", "NftablesAggregatePorts", "NftablesDispatchMaps", "IPSetEntryJournal", "ConcurrentBackends"]:
             raise dbus.exceptions.DBusException(
                 "org.freedesktop.DBus.Error.InvalidArgs: "
                 "Property '%s' does not exist" % prop)
@@ -634,6 +639,26 @@ class FirewallDConfig(DbusServiceObject):
             if value is None:
                 value = "yes" if config.FALLBACK_NFTABLES_COUNTERS else "no"
             return dbus.String(value)
+        elif prop == "IncrementalReload":
+            if value is None:
+                value = "yes" if config.FALLBACK_INCREMENTAL_RELOAD else "no"
+            return dbus.String(value)
+        elif prop == "NftablesAggregatePorts":
+            if value is None:
+                value = "yes" if config.FALLBACK_NFTABLES_AGGREGATE_PORTS else "no"
+            return dbus.String(value)
+        elif prop == "NftablesDispatchMaps":
+            if value is None:
+                value = "yes" if config.FALLBACK_NFTABLES_DISPATCH_MAPS else "no"
+            return dbus.String(value)
+        elif prop == "IPSetEntryJournal":
+            if value is None:
+                value = "yes" if config.FALLBACK_IPSET_ENTRY_JOURNAL else "no"
+            return dbus.String(value)
+        elif prop == "ConcurrentBackends":
+            if value is None:
+                value = "yes" if config.FALLBACK_CONCURRENT_BACKENDS else "no"
+            return dbus.String(value)
 
     @dbus_handle_exceptions
     def _get_dbus_property(self, prop):
@@ -667,6 +692,16 @@ class FirewallDConfig(DbusServiceObject):
             return dbus.String(self._get_property(prop))
         elif prop == "NftablesCounters":
             return dbus.String(self._get_property(prop))
+        elif prop == "IncrementalReload":
+            return dbus.String(self._get_property(prop))
+        elif prop == "NftablesAggregatePorts":
+            return dbus.String(self._get_property(prop))
+        elif prop == "NftablesDispatchMaps":
+            return dbus.String(self._get_property(prop))
+        elif prop == "IPSetEntryJournal":
+            return dbus.String(self._get_property(prop))
+        elif prop == "ConcurrentBackends":
+            return dbus.String(self._get_property(prop))
         else:
             raise dbus.exceptions.DBusException(
                 "org.freedesktop.DBus.Error.InvalidArgs: "
@@ -706,7 +741,7 @@ class FirewallDConfig(DbusServiceObject):
                        "CleanupModulesOnExit", "Lockdown", "IPv6_rpfilter",
                        "IndividualCalls", "LogDenied", "AutomaticHelpers",
                        "FirewallBackend", "FlushAllOnReload", "RFC3964_IPv4",
-                       "AllowZoneDrifting", "NftablesFlowtable",  "NftablesCounters"]:
+                       "AllowZoneDrifting", "NftablesFlowtable",  "NftablesCounters", "IncrementalReload", "NftablesAggregatePorts", "NftablesDispatchMaps", "IPSetEntryJournal", "ConcurrentBackends"]:
                 ret[x] = self._get_property(x)
         elif interface_name in [ config.dbus.DBUS_INTERFACE_CONFIG_DIRECT,
                                  config.dbus.DBUS_INTERFACE_CONFIG_POLICIES ]:
@@ -736,11 +771,11 @@ class FirewallDConfig(DbusServiceObject):
                                   "LogDenied",
                                   "FirewallBackend", "FlushAllOnReload",
                                   "RFC3964_IPv4", "NftablesFlowtable",
-                                  "NftablesCounters"]:
+                                  "NftablesCounters", "IncrementalReload", "NftablesAggregatePorts", "NftablesDispatchMaps", "IPSetEntryJournal", "ConcurrentBackends"]:
                 if property_name in [ "CleanupOnExit", "CleanupModulesOnExit",
                                       "Lockdown", "IPv6_rpfilter",
                                       "IndividualCalls", "FlushAllOnReload",
-                                      "RFC3964_IPv4", "NftablesCounters"]:
+                                      "RFC3964_IPv4", "NftablesCounters", "IncrementalReload", "NftablesAggregatePorts", "NftablesDispatchMaps", "IPSetEntryJournal", "ConcurrentBackends"]:
                     if new_value.lower() not in [ "yes", "no",
                                                   "true", "false" ]:
                         raise FirewallError(errors.INVALID_VALUE,
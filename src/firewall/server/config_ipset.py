@@ -26,7 +26,6 @@ from firewall.dbus_utils import dbus_to_python, \
     dbus_introspection_add_properties
 from firewall.core.io.ipset import IPSet
 from firewall.core.ipset import IPSET_TYPES, normalize_ipset_entry, \
-                                check_entry_overlaps_existing, \
                                 check_for_overlapping_entries
 from firewall.core.logger import log
 from firewall.server.dbus import DbusServiceObject
@@ -421,14 +420,13 @@ class FirewallDConfigIPSet(DbusServiceObject):
         entry = normalize_ipset_entry(entry)
         log.debug1("%s.addEntry('%s')", self._log_prefix, entry)
         self.parent.accessCheck(sender)
-        settings = list(self.getSettings())
-        if "timeout" in settings[4] and settings[4]["timeout"] != "0":
+        if "timeout" in self.obj.options and self.obj.options["timeout"] != "0":
             raise FirewallError(errors.IPSET_WITH_TIMEOUT)
-        if entry in settings[5]:
+        if self.obj.has_entry(entry):
             raise FirewallError(errors.ALREADY_ENABLED, entry)
-        check_entry_overlaps_existing(entry, settings[5])
-        settings[5].append(entry)
-        self.update(settings)
+        self.obj.check_entry_overlaps(entry)
+        self.obj = self.config.add_ipset_entry(self.obj, entry)
+        self.Updated(self.obj.name)
 
     @dbus_service_method(config.dbus.DBUS_INTERFACE_CONFIG_IPSET,
                          in_signature='s')
@@ -438,13 +436,12 @@ class FirewallDConfigIPSet(DbusServiceObject):
         entry = normalize_ipset_entry(entry)
         log.debug1("%s.removeEntry('%s')", self._log_prefix, entry)
         self.parent.accessCheck(sender)
-        settings = list(self.getSettings())
-        if "timeout" in settings[4] and settings[4]["timeout"] != "0":
+        if "timeout" in self.obj.options and self.obj.options["timeout"] != "0":
             raise FirewallError(errors.IPSET_WITH_TIMEOUT)
-        if entry not in settings[5]:
+        if not self.obj.has_entry(entry):
             raise FirewallError(errors.NOT_ENABLED, entry)
-        settings[5].remove(entry)
-        self.update(settings)
+        self.obj = self.config.remove_ipset_entry(self.obj, entry)
+        self.Updated(self.obj.name)
 
     @dbus_service_method(config.dbus.DBUS_INTERFACE_CONFIG_IPSET,
                          in_signature='s', out_signature='b')
@@ -453,7 +450,6 @@ class FirewallDConfigIPSet(DbusServiceObject):
         entry = dbus_to_python(entry, str)
         entry = normalize_ipset_entry(entry)
         log.debug1("%s.queryEntry('%s')", self._log_prefix, entry)
-        settings = list(self.getSettings())
-        if "timeout" in settings[4] and settings[4]["timeout"] != "0":
+        if "timeout" in self.obj.options and self.obj.options["timeout"] != "0":
             raise FirewallError(errors.IPSET_WITH_TIMEOUT)
-        return entry in settings[5]
+        return self.obj.has_entry(entry)
@@ -30,7 +30,7 @@ from firewall.errors import FirewallError
 from firewall import errors
 from firewall.core.logger import log
 from firewall.server.dbus import FirewallDBusException, NotAuthorizedException
-from firewall.dbus_utils import uid_of_sender
+from firewall.server.sender_cache import sender_cache
 
 ############################################################################
 #
@@ -90,6 +90,23 @@ def dbus_handle_exceptions(func):
     _impl.__signature__ = inspect.signature(func)
     return _impl
 
+def dbus_runtime_change(func):
+    """Decorator for D-Bus signals that report a change of the runtime
+    state. Calls runtime_changed() of the object with the signal name and
+    arguments before the signal is emitted.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def _impl(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        args[0].runtime_changed(func.__name__, bound.args[1:])
+        return func(*args, **kwargs)
+    # see dbus_handle_exceptions
+    _impl.__signature__ = signature
+    return _impl
+
 def dbus_service_method(*args, **kwargs):
     """Add sender argument for D-Bus"""
     kwargs.setdefault("sender_keyword", "sender")
@@ -143,6 +160,7 @@ class dbus_polkit_require_auth:
         cls._bus.remove_signal_receiver(cls._bus_signal_receiver)
         cls._bus_signal_receiver = None
         cls._interface_polkit = None
+        sender_cache.clear_authorizations()
 
     def __call__(self, func):
         @functools.wraps(func)
@@ -176,14 +194,17 @@ class dbus_polkit_require_auth:
             if sender:
                 # use polkit if it's available
                 if type(self)._interface_polkit:
-                    (result, _, _) = type(self)._interface_polkit.CheckAuthorization(
-                                                                    ("system-bus-name", {"name": sender}),
-                                                                    action_id, {}, 1, "")
-                    if not result:
-                        raise NotAuthorizedException(action_id, "polkit")
+                    if not sender_cache.is_authorized(sender, action_id):
+                        (result, _, details) = type(self)._interface_polkit.CheckAuthorization(
+                                                                        ("system-bus-name", {"name": sender}),
+                                                                        action_id, {}, 1, "")
+                        if not result:
+                            raise NotAuthorizedException(action_id, "polkit")
+                        sender_cache.set_authorized(type(self)._bus, sender,
+                                                    action_id, details)
                 # fallback to checking UID
                 else:
-                    uid = uid_of_sender(type(self)._bus, sender)
+                    uid = sender_cache.uid(type(self)._bus, sender)
 
                     if uid != 0:
                         raise NotAuthorizedException(action_id, "uid")
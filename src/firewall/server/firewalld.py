@@ -19,11 +19,17 @@
 
 from gi.repository import GLib
 
+import collections
 import copy
+import itertools
+import math
+import time
+import uuid
 import dbus
 import dbus.service
 
 from firewall import config
+from firewall.core.expiry import ExpiryQueue
 from firewall.core.fw import Firewall
 from firewall.core.rich import Rich_Rule
 from firewall.core.logger import log
@@ -34,10 +40,11 @@ from firewall.server.decorators import dbus_handle_exceptions, \
                                        handle_exceptions, \
                                        dbus_service_method_deprecated, \
                                        dbus_service_signal_deprecated, \
-                                       dbus_polkit_require_auth
+                                       dbus_polkit_require_auth, \
+                                       dbus_runtime_change
 from firewall.server.config import FirewallDConfig
-from firewall.dbus_utils import dbus_to_python, \
-    command_of_sender, context_of_sender, uid_of_sender, user_of_uid, \
+from firewall.server.sender_cache import sender_cache
+from firewall.dbus_utils import dbus_to_python, dbus_typed, \
     dbus_introspection_prepare_properties, \
     dbus_introspection_add_properties, \
     dbus_introspection_add_deprecated
@@ -62,6 +69,8 @@ class FirewallD(DbusServiceObject):
 
     persistent = True
     """ Make FirewallD persistent. """
+    changes_max = 1024
+    """ Number of runtime changes kept for getChangesSince. """
     default_polkit_auth_required = config.dbus.PK_ACTION_CONFIG
     """ Use config.dbus.PK_ACTION_CONFIG as a default """
 
@@ -71,6 +80,11 @@ class FirewallD(DbusServiceObject):
         self.fw = Firewall()
         self.busname = args[0]
         self.path = args[1]
+        # the generation starts at 0 again with a new daemon, the epoch
+        # tells the daemons apart
+        self._epoch = str(uuid.uuid4())
+        self._generation = 0
+        self._changes = collections.deque(maxlen=self.changes_max)
         self.start()
         dbus_introspection_prepare_properties(self, config.dbus.DBUS_INTERFACE)
         self.config = FirewallDConfig(self.fw.config, self.busname,
@@ -84,7 +98,9 @@ class FirewallD(DbusServiceObject):
         # tests if iptables and ip6tables are usable using test functions
         # loads default firewall rules for iptables and ip6tables
         log.debug1("start()")
-        self._timeouts = { }
+        self._timeouts = ExpiryQueue()
+        self._timeout_tag = None
+        self._timeout_deadline = None
         return self.fw.start()
 
     @handle_exceptions
@@ -103,42 +119,267 @@ class FirewallD(DbusServiceObject):
                 log.error("Lockdown not possible, sender not set.")
                 return
             bus = dbus.SystemBus()
-            context = context_of_sender(bus, sender)
+            context = sender_cache.context(bus, sender)
             if self.fw.policies.access_check("context", context):
                 return
-            uid = uid_of_sender(bus, sender)
+            uid = sender_cache.uid(bus, sender)
             if self.fw.policies.access_check("uid", uid):
                 return
-            user = user_of_uid(uid)
+            user = sender_cache.user(bus, sender)
             if self.fw.policies.access_check("user", user):
                 return
-            command = command_of_sender(bus, sender)
+            command = sender_cache.command(bus, sender)
             if self.fw.policies.access_check("command", command):
                 return
             raise FirewallError(errors.ACCESS_DENIED, "lockdown is enabled")
 
+    @dbus_polkit_require_auth(config.dbus.PK_ACTION_INFO)
+    @dbus_service_method(config.dbus.DBUS_INTERFACE, in_signature='',
+                         out_signature='a{su}')
+    @dbus_handle_exceptions
+    def getSenderCacheStats(self, sender=None): # pylint: disable=W0613
+        # returns the counters of the sender credential and polkit caches
+        log.debug1("getSenderCacheStats()")
+        return sender_cache.statistics()
+
     # timeout functions
 
+    # type of timed setting: (fw.zone removal function, removal signal)
+    _timeout_types = {
+        "rich-rule": ("remove_rule", "RichRuleRemoved"),
+        "service": ("remove_service", "ServiceRemoved"),
+        "port": ("remove_port", "PortRemoved"),
+        "protocol": ("remove_protocol", "ProtocolRemoved"),
+        "source-port": ("remove_source_port", "SourcePortRemoved"),
+        "masquerade": ("remove_masquerade", "MasqueradeRemoved"),
+        "forward-port": ("remove_forward_port", "ForwardPortRemoved"),
+        "icmp-block": ("remove_icmp_block", "IcmpBlockRemoved"),
+    }
+
     @dbus_handle_exceptions
-    def addTimeout(self, zone, x, tag):
-        if zone not in self._timeouts:
-            self._timeouts[zone] = { }
-        self._timeouts[zone][x] = tag
+    def addTimeout(self, zone, x_type, x, timeout):
+        self._timeouts.add((zone, x_type, x), timeout, time.monotonic())
+        self._arm_timeout()
 
     @dbus_handle_exceptions
-    def removeTimeout(self, zone, x):
-        if zone in self._timeouts and x in self._timeouts[zone]:
-            GLib.source_remove(self._timeouts[zone][x])
-            del self._timeouts[zone][x]
+    def removeTimeout(self, zone, x_type, x):
+        # the timer is re-armed when it fires
+        self._timeouts.remove((zone, x_type, x))
 
     @dbus_handle_exceptions
     def cleanup_timeouts(self):
         # cleanup timeouts
-        for zone in self._timeouts:
-            for x in self._timeouts[zone]:
-                GLib.source_remove(self._timeouts[zone][x])
-            self._timeouts[zone].clear()
         self._timeouts.clear()
+        self._arm_timeout()
+
+    def _arm_timeout(self):
+        # a single timer is armed for the earliest deadline
+        deadline = self._timeouts.next_deadline()
+        if deadline == self._timeout_deadline:
+            return
+        if self._timeout_tag is not None:
+            GLib.source_remove(self._timeout_tag)
+            self._timeout_tag = None
+        self._timeout_deadline = deadline
+        if deadline is not None:
+            delay = max(0, math.ceil(deadline - time.monotonic()))
+            self._timeout_tag = GLib.timeout_add_seconds(delay,
+                                                         self._expire_timeouts)
+
+    @handle_exceptions
+    def _expire_timeouts(self):
+        self._timeout_tag = None
+        self._timeout_deadline = None
+        try:
+            keys = self._timeouts.pop_expired(time.monotonic())
+            if keys:
+                self.disableTimeouts(keys)
+        finally:
+            self._arm_timeout()
+        return False
+
+    def disableTimeouts(self, keys):
+        log.debug1("disableTimeouts(%d)" % len(keys))
+        # Everything that expires in the same tick is removed in a single
+        # transaction. Port ranges are split and merged at removal, so only
+        # one port and one source port per zone go into a transaction.
+        while keys:
+            batch = [ ]
+            deferred = [ ]
+            ranges = set()
+            for key in keys:
+                (zone, x_type, _x) = key
+                if x_type in ["port", "source-port"]:
+                    if (zone, x_type) in ranges:
+                        deferred.append(key)
+                        continue
+                    ranges.add((zone, x_type))
+                batch.append(key)
+            self._disable_timeouts(batch)
+            keys = deferred
+
+    def _disable_timeouts(self, keys):
+        transaction = self.fw.zone.new_transaction()
+        removed = [ ]
+        for key in keys:
+            try:
+                self._disable_timeout(key, transaction)
+            except Exception as msg:
+                log.warning("Failed to remove timed %s from zone '%s': %s",
+                            key[1], key[0], msg)
+            else:
+                removed.append(key)
+        if not removed:
+            return
+
+        try:
+            transaction.execute(True)
+        except Exception as msg:
+            log.debug1("Failed to remove timed settings at once, removing "
+                       "them one by one: %s", msg)
+            keys = removed
+            removed = [ ]
+            for key in keys:
+                try:
+                    self._disable_timeout(key)
+                except Exception as msg:
+                    log.warning("Failed to remove timed %s from zone '%s': %s",
+                                key[1], key[0], msg)
+                else:
+                    removed.append(key)
+
+        for (zone, x_type, x) in removed:
+            getattr(self, self._timeout_types[x_type][1])(zone, *x)
+
+    def _disable_timeout(self, key, use_transaction=None):
+        (zone, x_type, x) = key
+        args = x
+        if x_type == "rich-rule":
+            args = (Rich_Rule(rule_str=x[0]), )
+        func = getattr(self.fw.zone, self._timeout_types[x_type][0])
+        func(zone, *args, use_transaction=use_transaction)
+
+    @staticmethod
+    def _timeout_value(x_type, x):
+        if x_type in ["port", "source-port"]:
+            return "%s/%s" % x
+        if x_type == "forward-port":
+            return "port=%s:proto=%s:toport=%s:toaddr=%s" % x
+        if x_type == "masquerade":
+            return ""
+        return x[0]
+
+    @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG_INFO)
+    @dbus_service_method(config.dbus.DBUS_INTERFACE, in_signature='',
+                         out_signature='a(sssu)')
+    @dbus_handle_exceptions
+    def getTimeouts(self, sender=None): # pylint: disable=W0613
+        # returns the pending timeouts as (zone, type, value, seconds left)
+        log.debug1("getTimeouts()")
+        return [(zone, x_type, self._timeout_value(x_type, x),
+                 int(math.ceil(remaining)))
+                for ((zone, x_type, x), remaining)
+                in self._timeouts.pending(time.monotonic())]
+
+    # runtime state
+
+    def runtime_changed(self, signal, args):
+        # called for every signal of a runtime change, see
+        # dbus_runtime_change
+        self._generation += 1
+        if signal == "Reloaded":
+            # everything might have changed, the changes before the reload
+            # can not be applied to the new state
+            self._changes.clear()
+            return
+        func = getattr(type(self), signal)
+        args = [dbus_typed(arg, sig) for (arg, sig)
+                in zip(args, dbus.Signature(func._dbus_signature))]
+        self._changes.append((self._generation, func._dbus_interface,
+                              signal, args))
+
+    @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG_INFO)
+    @dbus_service_method(config.dbus.DBUS_INTERFACE, in_signature='st',
+                         out_signature='(stba(tssav))')
+    @dbus_handle_exceptions
+    def getChangesSince(self, epoch, generation, sender=None): # pylint: disable=W0613
+        # returns the current epoch and generation and the runtime changes
+        # after generation of epoch. If they are not available anymore,
+        # complete is False and a snapshot has to be used instead.
+        epoch = dbus_to_python(epoch, str)
+        generation = dbus_to_python(generation, int)
+        log.debug1("getChangesSince('%s', %d)", epoch, generation)
+        changes = self._changes
+        oldest = changes[0][0] - 1 if changes else self._generation
+        if epoch != self._epoch or generation < oldest or \
+           generation > self._generation:
+            return (self._epoch, dbus.UInt64(self._generation), False,
+                    dbus.Array(signature="(tssav)"))
+        start = len(changes) - (self._generation - generation)
+        return (self._epoch, dbus.UInt64(self._generation), True,
+                dbus.Array([(dbus.UInt64(change[0]), change[1], change[2],
+                             dbus.Array(change[3], signature="v"))
+                            for change in itertools.islice(changes, start,
+                                                           None)],
+                           signature="(tssav)"))
+
+    @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG_INFO)
+    @dbus_service_method(config.dbus.DBUS_INTERFACE, in_signature='a{sv}',
+                         out_signature='a{sv}')
+    @dbus_handle_exceptions
+    def getRuntimeSnapshot(self, options, sender=None): # pylint: disable=W0613
+        # returns the complete runtime state in one message, only the
+        # epoch and generation if they are the same as the ones given in
+        # options
+        options = dbus_to_python(options)
+        log.debug1("getRuntimeSnapshot(%s)", options)
+        for key in options:
+            if key not in ["epoch", "generation", "ipset_entries"]:
+                raise FirewallError(errors.INVALID_VALUE,
+                                    "Unknown snapshot option '%s'" % key)
+
+        snapshot = {"epoch": self._epoch,
+                    "generation": dbus.UInt64(self._generation)}
+        if options.get("epoch") == self._epoch and \
+           options.get("generation") == self._generation:
+            return snapshot
+        ipset_entries = options.get("ipset_entries", True)
+
+        zones = dbus.Dictionary(signature="sa{sv}")
+        for zone in self.fw.zone.get_zones():
+            zones[zone] = dbus.Dictionary(
+                self.fw.zone.get_config_with_settings_dict(zone),
+                signature="sv")
+        active_zones = dbus.Dictionary(signature="sa{sas}")
+        for zone in self.fw.zone.get_active_zones():
+            active_zones[zone] = {"interfaces": self.fw.zone.list_interfaces(zone),
+                                  "sources": self.fw.zone.list_sources(zone)}
+        policies = dbus.Dictionary(signature="sa{sv}")
+        for policy in self.fw.policy.get_policies_not_derived_from_zone():
+            policies[policy] = dbus.Dictionary(
+                self.fw.policy.get_config_with_settings_dict(policy),
+                signature="sv")
+        active_policies = dbus.Dictionary(signature="sa{sas}")
+        for policy in self.fw.policy.get_active_policies_not_derived_from_zone():
+            active_policies[policy] = {
+                "ingress_zones": self.fw.policy.list_ingress_zones(policy),
+                "egress_zones": self.fw.policy.list_egress_zones(policy)}
+        ipsets = dbus.Dictionary(signature="s" + IPSet.DBUS_SIGNATURE)
+        for ipset in self.fw.ipset.get_ipsets():
+            obj = self.fw.ipset.get_ipset(ipset)
+            ipsets[ipset] = (obj.version, obj.short, obj.description,
+                             obj.type, obj.options,
+                             list(obj.entries) if ipset_entries else [ ])
+
+        snapshot.update({"default_zone": self.fw.get_default_zone(),
+                         "log_denied": self.fw.get_log_denied(),
+                         "panic_mode": self.fw.query_panic_mode(),
+                         "zones": zones,
+                         "active_zones": active_zones,
+                         "policies": policies,
+                         "active_policies": active_policies,
+                         "ipsets": ipsets})
+        return snapshot
 
     # property handling
 
@@ -341,6 +582,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE)
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def Reloaded(self):
         log.debug1("Reloaded()")
 
@@ -614,11 +856,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownEnabled(self):
         log.debug1("LockdownEnabled()")
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownDisabled(self):
         log.debug1("LockdownDisabled()")
 
@@ -677,11 +921,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownWhitelistCommandAdded(self, command):
         log.debug1("LockdownWhitelistCommandAdded('%s')" % command)
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownWhitelistCommandRemoved(self, command):
         log.debug1("LockdownWhitelistCommandRemoved('%s')" % command)
 
@@ -738,11 +984,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='i')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownWhitelistUidAdded(self, uid):
         log.debug1("LockdownWhitelistUidAdded(%d)" % uid)
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='i')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownWhitelistUidRemoved(self, uid):
         log.debug1("LockdownWhitelistUidRemoved(%d)" % uid)
 
@@ -799,11 +1047,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownWhitelistUserAdded(self, user):
         log.debug1("LockdownWhitelistUserAdded('%s')" % user)
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownWhitelistUserRemoved(self, user):
         log.debug1("LockdownWhitelistUserRemoved('%s')" % user)
 
@@ -860,11 +1110,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownWhitelistContextAdded(self, context):
         log.debug1("LockdownWhitelistContextAdded('%s')" % context)
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICIES, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LockdownWhitelistContextRemoved(self, context):
         log.debug1("LockdownWhitelistContextRemoved('%s')" % context)
 
@@ -912,11 +1164,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE, signature='')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def PanicModeEnabled(self):
         log.debug1("PanicModeEnabled()")
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE, signature='')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def PanicModeDisabled(self):
         log.debug1("PanicModeDisabled()")
 
@@ -955,6 +1209,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='sa{sv}')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ZoneUpdated(self, zone, settings):
         log.debug1("zone.ZoneUpdated('%s', '%s')" % (zone, settings))
 
@@ -979,6 +1234,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_POLICY, signature='sa{sv}')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def PolicyUpdated(self, policy, settings):
         log.debug1("policy.PolicyUpdated('%s', '%s')" % (policy, settings))
 
@@ -1075,6 +1331,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def LogDeniedChanged(self, value):
         log.debug1("LogDeniedChanged('%s')" % (value))
 
@@ -1107,6 +1364,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def AutomaticHelpersChanged(self, value):
         log.debug1("AutomaticHelpersChanged('%s')" % (value))
 
@@ -1140,6 +1398,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def DefaultZoneChanged(self, zone):
         log.debug1("DefaultZoneChanged('%s')" % (zone))
 
@@ -1337,6 +1596,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def InterfaceAdded(self, zone, interface):
         log.debug1("zone.InterfaceAdded('%s', '%s')" % (zone, interface))
 
@@ -1350,6 +1610,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ZoneOfInterfaceChanged(self, zone, interface):
         log.debug1("zone.ZoneOfInterfaceChanged('%s', '%s')" % (zone,
                                                                 interface))
@@ -1357,6 +1618,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def InterfaceRemoved(self, zone, interface):
         log.debug1("zone.InterfaceRemoved('%s', '%s')" % (zone, interface))
 
@@ -1444,16 +1706,19 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def SourceAdded(self, zone, source):
         log.debug1("zone.SourceAdded('%s', '%s')" % (zone, source))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ZoneOfSourceChanged(self, zone, source):
         log.debug1("zone.ZoneOfSourceChanged('%s', '%s')" % (zone, source))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def SourceRemoved(self, zone, source):
         log.debug1("zone.SourceRemoved('%s', '%s')" % (zone, source))
 
@@ -1461,14 +1726,6 @@ class FirewallD(DbusServiceObject):
 
     # RICH RULES
 
-    @dbus_handle_exceptions
-    def disableTimedRichRule(self, zone, rule):
-        log.debug1("zone.disableTimedRichRule('%s', '%s')" % (zone, rule))
-        del self._timeouts[zone][rule]
-        obj = Rich_Rule(rule_str=rule)
-        self.fw.zone.remove_rule(zone, obj)
-        self.RichRuleRemoved(zone, rule)
-
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_ZONE, in_signature='ssi',
                          out_signature='s')
@@ -1482,9 +1739,7 @@ class FirewallD(DbusServiceObject):
         _zone = self.fw.zone.add_rule(zone, obj, timeout)
 
         if timeout > 0:
-            tag = GLib.timeout_add_seconds(timeout, self.disableTimedRichRule,
-                                           _zone, rule)
-            self.addTimeout(_zone, rule, tag)
+            self.addTimeout(_zone, "rich-rule", (rule, ), timeout)
 
         self.RichRuleAdded(_zone, rule, timeout)
         return _zone
@@ -1499,7 +1754,7 @@ class FirewallD(DbusServiceObject):
         log.debug1("zone.removeRichRule('%s', '%s')" % (zone, rule))
         obj = Rich_Rule(rule_str=rule)
         _zone = self.fw.zone.remove_rule(zone, obj)
-        self.removeTimeout(_zone, rule)
+        self.removeTimeout(_zone, "rich-rule", (rule, ))
         self.RichRuleRemoved(_zone, rule)
         return _zone
 
@@ -1528,11 +1783,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ssi')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def RichRuleAdded(self, zone, rule, timeout):
         log.debug1("zone.RichRuleAdded('%s', '%s', %d)" % (zone, rule, timeout))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def RichRuleRemoved(self, zone, rule):
         log.debug1("zone.RichRuleRemoved('%s', '%s')" % (zone, rule))
 
@@ -1540,13 +1797,6 @@ class FirewallD(DbusServiceObject):
 
     # SERVICES
 
-    @dbus_handle_exceptions
-    def disableTimedService(self, zone, service):
-        log.debug1("zone.disableTimedService('%s', '%s')" % (zone, service))
-        del self._timeouts[zone][service]
-        self.fw.zone.remove_service(zone, service)
-        self.ServiceRemoved(zone, service)
-
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_ZONE, in_signature='ssi',
                          out_signature='s')
@@ -1562,9 +1812,7 @@ class FirewallD(DbusServiceObject):
         _zone = self.fw.zone.add_service(zone, service, timeout, sender)
 
         if timeout > 0:
-            tag = GLib.timeout_add_seconds(timeout, self.disableTimedService,
-                                           _zone, service)
-            self.addTimeout(_zone, service, tag)
+            self.addTimeout(_zone, "service", (service, ), timeout)
 
         self.ServiceAdded(_zone, service, timeout)
         return _zone
@@ -1582,7 +1830,7 @@ class FirewallD(DbusServiceObject):
 
         _zone = self.fw.zone.remove_service(zone, service)
 
-        self.removeTimeout(_zone, service)
+        self.removeTimeout(_zone, "service", (service, ))
         self.ServiceRemoved(_zone, service)
         return _zone
 
@@ -1611,12 +1859,14 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ssi')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ServiceAdded(self, zone, service, timeout):
         log.debug1("zone.ServiceAdded('%s', '%s', %d)" % \
                        (zone, service, timeout))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ServiceRemoved(self, zone, service):
         log.debug1("zone.ServiceRemoved('%s', '%s')" % (zone, service))
 
@@ -1624,14 +1874,6 @@ class FirewallD(DbusServiceObject):
 
     # PORTS
 
-    @dbus_handle_exceptions
-    def disableTimedPort(self, zone, port, protocol):
-        log.debug1("zone.disableTimedPort('%s', '%s', '%s')" % \
-                       (zone, port, protocol))
-        del self._timeouts[zone][(port, protocol)]
-        self.fw.zone.remove_port(zone, port, protocol)
-        self.PortRemoved(zone, port, protocol)
-
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_ZONE, in_signature='sssi',
                          out_signature='s')
@@ -1648,9 +1890,7 @@ class FirewallD(DbusServiceObject):
         _zone = self.fw.zone.add_port(zone, port, protocol, timeout, sender)
 
         if timeout > 0:
-            tag = GLib.timeout_add_seconds(timeout, self.disableTimedPort,
-                                           _zone, port, protocol)
-            self.addTimeout(_zone, (port, protocol), tag)
+            self.addTimeout(_zone, "port", (port, protocol), timeout)
 
         self.PortAdded(_zone, port, protocol, timeout)
         return _zone
@@ -1669,7 +1909,7 @@ class FirewallD(DbusServiceObject):
         self.accessCheck(sender)
         _zone= self.fw.zone.remove_port(zone, port, protocol)
 
-        self.removeTimeout(_zone, (port, protocol))
+        self.removeTimeout(_zone, "port", (port, protocol))
         self.PortRemoved(_zone, port, protocol)
         return _zone
 
@@ -1699,12 +1939,14 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='sssi')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def PortAdded(self, zone, port, protocol, timeout=0):
         log.debug1("zone.PortAdded('%s', '%s', '%s', %d)" % \
                        (zone, port, protocol, timeout))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='sss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def PortRemoved(self, zone, port, protocol):
         log.debug1("zone.PortRemoved('%s', '%s', '%s')" % \
                        (zone, port, protocol))
@@ -1713,13 +1955,6 @@ class FirewallD(DbusServiceObject):
 
     # PROTOCOLS
 
-    @dbus_handle_exceptions
-    def disableTimedProtocol(self, zone, protocol):
-        log.debug1("zone.disableTimedProtocol('%s', '%s')" % (zone, protocol))
-        del self._timeouts[zone][(protocol)]
-        self.fw.zone.remove_protocol(zone, protocol)
-        self.ProtocolRemoved(zone, protocol)
-
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_ZONE, in_signature='ssi',
                          out_signature='s')
@@ -1734,9 +1969,7 @@ class FirewallD(DbusServiceObject):
         _zone = self.fw.zone.add_protocol(zone, protocol, timeout, sender)
 
         if timeout > 0:
-            tag = GLib.timeout_add_seconds(timeout, self.disableTimedProtocol,
-                                           _zone, protocol)
-            self.addTimeout(_zone, protocol, tag)
+            self.addTimeout(_zone, "protocol", (protocol, ), timeout)
 
         self.ProtocolAdded(_zone, protocol, timeout)
         return _zone
@@ -1753,7 +1986,7 @@ class FirewallD(DbusServiceObject):
         self.accessCheck(sender)
         _zone= self.fw.zone.remove_protocol(zone, protocol)
 
-        self.removeTimeout(_zone, protocol)
+        self.removeTimeout(_zone, "protocol", (protocol, ))
         self.ProtocolRemoved(_zone, protocol)
         return _zone
 
@@ -1782,12 +2015,14 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ssi')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ProtocolAdded(self, zone, protocol, timeout=0):
         log.debug1("zone.ProtocolAdded('%s', '%s', %d)" % \
                        (zone, protocol, timeout))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ProtocolRemoved(self, zone, protocol):
         log.debug1("zone.ProtocolRemoved('%s', '%s')" % (zone, protocol))
 
@@ -1795,14 +2030,6 @@ class FirewallD(DbusServiceObject):
 
     # SOURCE PORTS
 
-    @dbus_handle_exceptions
-    def disableTimedSourcePort(self, zone, port, protocol):
-        log.debug1("zone.disableTimedSourcePort('%s', '%s', '%s')" % \
-                   (zone, port, protocol))
-        del self._timeouts[zone][("sport", port, protocol)]
-        self.fw.zone.remove_source_port(zone, port, protocol)
-        self.SourcePortRemoved(zone, port, protocol)
-
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_ZONE, in_signature='sssi',
                          out_signature='s')
@@ -1820,9 +2047,8 @@ class FirewallD(DbusServiceObject):
                                              sender)
 
         if timeout > 0:
-            tag = GLib.timeout_add_seconds(timeout, self.disableTimedSourcePort,
-                                           _zone, port, protocol)
-            self.addTimeout(_zone, ("sport", port, protocol), tag)
+            self.addTimeout(_zone, "source-port", (port, protocol),
+                            timeout)
 
         self.SourcePortAdded(_zone, port, protocol, timeout)
         return _zone
@@ -1841,7 +2067,7 @@ class FirewallD(DbusServiceObject):
         self.accessCheck(sender)
         _zone= self.fw.zone.remove_source_port(zone, port, protocol)
 
-        self.removeTimeout(_zone, ("sport", port, protocol))
+        self.removeTimeout(_zone, "source-port", (port, protocol))
         self.SourcePortRemoved(_zone, port, protocol)
         return _zone
 
@@ -1872,12 +2098,14 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='sssi')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def SourcePortAdded(self, zone, port, protocol, timeout=0):
         log.debug1("zone.SourcePortAdded('%s', '%s', '%s', %d)" % \
                    (zone, port, protocol, timeout))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='sss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def SourcePortRemoved(self, zone, port, protocol):
         log.debug1("zone.SourcePortRemoved('%s', '%s', '%s')" % (zone, port,
                                                                  protocol))
@@ -1886,12 +2114,6 @@ class FirewallD(DbusServiceObject):
 
     # MASQUERADE
 
-    @dbus_handle_exceptions
-    def disableTimedMasquerade(self, zone):
-        del self._timeouts[zone]["masquerade"]
-        self.fw.zone.remove_masquerade(zone)
-        self.MasqueradeRemoved(zone)
-
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_ZONE, in_signature='si',
                          out_signature='s')
@@ -1905,9 +2127,7 @@ class FirewallD(DbusServiceObject):
         _zone = self.fw.zone.add_masquerade(zone, timeout, sender)
 
         if timeout > 0:
-            tag = GLib.timeout_add_seconds(timeout, self.disableTimedMasquerade,
-                                           _zone)
-            self.addTimeout(_zone, "masquerade", tag)
+            self.addTimeout(_zone, "masquerade", (), timeout)
 
         self.MasqueradeAdded(_zone, timeout)
         return _zone
@@ -1923,7 +2143,7 @@ class FirewallD(DbusServiceObject):
         self.accessCheck(sender)
         _zone = self.fw.zone.remove_masquerade(zone)
 
-        self.removeTimeout(_zone, "masquerade")
+        self.removeTimeout(_zone, "masquerade", ())
         self.MasqueradeRemoved(_zone)
         return _zone
 
@@ -1939,11 +2159,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='si')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def MasqueradeAdded(self, zone, timeout=0):
         log.debug1("zone.MasqueradeAdded('%s', %d)" % (zone, timeout))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def MasqueradeRemoved(self, zone):
         log.debug1("zone.MasqueradeRemoved('%s')" % (zone))
 
@@ -1951,12 +2173,6 @@ class FirewallD(DbusServiceObject):
 
     # FORWARD PORT
 
-    @dbus_handle_exceptions
-    def disable_forward_port(self, zone, port, protocol, toport, toaddr): # pylint: disable=R0913
-        del self._timeouts[zone][(port, protocol, toport, toaddr)]
-        self.fw.zone.remove_forward_port(zone, port, protocol, toport, toaddr)
-        self.ForwardPortRemoved(zone, port, protocol, toport, toaddr)
-
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_ZONE, in_signature='sssssi',
                          out_signature='s')
@@ -1977,11 +2193,8 @@ class FirewallD(DbusServiceObject):
                                               toaddr, timeout, sender)
 
         if timeout > 0:
-            tag = GLib.timeout_add_seconds(timeout,
-                                           self.disable_forward_port,
-                                           _zone, port, protocol, toport,
-                                           toaddr)
-            self.addTimeout(_zone, (port, protocol, toport, toaddr), tag)
+            self.addTimeout(_zone, "forward-port",
+                            (port, protocol, toport, toaddr), timeout)
 
         self.ForwardPortAdded(_zone, port, protocol, toport, toaddr, timeout)
         return _zone
@@ -2004,7 +2217,8 @@ class FirewallD(DbusServiceObject):
         _zone = self.fw.zone.remove_forward_port(zone, port, protocol, toport,
                                                  toaddr)
 
-        self.removeTimeout(_zone, (port, protocol, toport, toaddr))
+        self.removeTimeout(_zone, "forward-port",
+                           (port, protocol, toport, toaddr))
         self.ForwardPortRemoved(_zone, port, protocol, toport, toaddr)
         return _zone
 
@@ -2039,6 +2253,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='sssssi')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ForwardPortAdded(self, zone, port, protocol, toport, toaddr,
                          timeout=0): # pylint: disable=R0913
         log.debug1("zone.ForwardPortAdded('%s', '%s', '%s', '%s', '%s', %d)" % \
@@ -2046,6 +2261,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='sssss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ForwardPortRemoved(self, zone, port, protocol, toport, toaddr): # pylint: disable=R0913
         log.debug1("zone.ForwardPortRemoved('%s', '%s', '%s', '%s', '%s')" % \
                        (zone, port, protocol, toport, toaddr))
@@ -2054,13 +2270,6 @@ class FirewallD(DbusServiceObject):
 
     # ICMP BLOCK
 
-    @dbus_handle_exceptions
-    def disableTimedIcmpBlock(self, zone, icmp, sender): # pylint: disable=W0613
-        log.debug1("zone.disableTimedIcmpBlock('%s', '%s')" % (zone, icmp))
-        del self._timeouts[zone][icmp]
-        self.fw.zone.remove_icmp_block(zone, icmp)
-        self.IcmpBlockRemoved(zone, icmp)
-
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_ZONE, in_signature='ssi',
                          out_signature='s')
@@ -2075,9 +2284,7 @@ class FirewallD(DbusServiceObject):
         _zone = self.fw.zone.add_icmp_block(zone, icmp, timeout, sender)
 
         if timeout > 0:
-            tag = GLib.timeout_add_seconds(timeout, self.disableTimedIcmpBlock,
-                                           _zone, icmp, sender)
-            self.addTimeout(_zone, icmp, tag)
+            self.addTimeout(_zone, "icmp-block", (icmp, ), timeout)
 
         self.IcmpBlockAdded(_zone, icmp, timeout)
         return _zone
@@ -2094,7 +2301,7 @@ class FirewallD(DbusServiceObject):
         self.accessCheck(sender)
         _zone = self.fw.zone.remove_icmp_block(zone, icmp)
 
-        self.removeTimeout(_zone, icmp)
+        self.removeTimeout(_zone, "icmp-block", (icmp, ))
         self.IcmpBlockRemoved(_zone, icmp)
         return _zone
 
@@ -2123,12 +2330,14 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ssi')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def IcmpBlockAdded(self, zone, icmp, timeout=0):
         log.debug1("zone.IcmpBlockAdded('%s', '%s', %d)" % \
                        (zone, icmp, timeout))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def IcmpBlockRemoved(self, zone, icmp):
         log.debug1("zone.IcmpBlockRemoved('%s', '%s')" % (zone, icmp))
 
@@ -2176,11 +2385,13 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def IcmpBlockInversionAdded(self, zone):
         log.debug1("zone.IcmpBlockInversionAdded('%s')" % (zone))
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_ZONE, signature='s')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def IcmpBlockInversionRemoved(self, zone):
         log.debug1("zone.IcmpBlockInversionRemoved('%s')" % (zone))
 
@@ -2258,12 +2469,14 @@ class FirewallD(DbusServiceObject):
     @dbus_service_signal_deprecated(config.dbus.DBUS_INTERFACE_DIRECT)
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_DIRECT, signature='sss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ChainAdded(self, ipv, table, chain):
         log.debug1("direct.ChainAdded('%s', '%s', '%s')" % (ipv, table, chain))
 
     @dbus_service_signal_deprecated(config.dbus.DBUS_INTERFACE_DIRECT)
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_DIRECT, signature='sss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def ChainRemoved(self, ipv, table, chain):
         log.debug1("direct.ChainRemoved('%s', '%s', '%s')" % (ipv, table,
                                                               chain))
@@ -2366,6 +2579,7 @@ class FirewallD(DbusServiceObject):
     @dbus_service_signal_deprecated(config.dbus.DBUS_INTERFACE_DIRECT)
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_DIRECT, signature='sssias')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def RuleAdded(self, ipv, table, chain, priority, args): # pylint: disable=R0913
         log.debug1("direct.RuleAdded('%s', '%s', '%s', %d, '%s')" % \
                        (ipv, table, chain, priority, "','".join(args)))
@@ -2373,6 +2587,7 @@ class FirewallD(DbusServiceObject):
     @dbus_service_signal_deprecated(config.dbus.DBUS_INTERFACE_DIRECT)
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_DIRECT, signature='sssias')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def RuleRemoved(self, ipv, table, chain, priority, args): # pylint: disable=R0913
         log.debug1("direct.RuleRemoved('%s', '%s', '%s', %d, '%s')" % \
                        (ipv, table, chain, priority, "','".join(args)))
@@ -2488,6 +2703,7 @@ class FirewallD(DbusServiceObject):
     @dbus_service_signal_deprecated(config.dbus.DBUS_INTERFACE_DIRECT)
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_DIRECT, signature='sas')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def PassthroughAdded(self, ipv, args):
         log.debug1("direct.PassthroughAdded('%s', '%s')" % \
                        (ipv, "','".join(args)))
@@ -2495,6 +2711,7 @@ class FirewallD(DbusServiceObject):
     @dbus_service_signal_deprecated(config.dbus.DBUS_INTERFACE_DIRECT)
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_DIRECT, signature='sas')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def PassthroughRemoved(self, ipv, args):
         log.debug1("direct.PassthroughRemoved('%s', '%s')" % \
                        (ipv, "','".join(args)))
@@ -2573,6 +2790,37 @@ class FirewallD(DbusServiceObject):
         self.fw.ipset.remove_entry(ipset, entry)
         self.EntryRemoved(ipset, entry)
 
+    @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
+    @dbus_service_method(config.dbus.DBUS_INTERFACE_IPSET, in_signature='sas',
+                         out_signature='as')
+    @dbus_handle_exceptions
+    def addEntries(self, ipset, entries, sender=None):
+        # adds ipset entries, returns list of added entries
+        ipset = dbus_to_python(ipset)
+        entries = dbus_to_python(entries, list)
+        log.debug1("ipset.addEntries('%s', %d entries)", ipset, len(entries))
+        self.accessCheck(sender)
+        added = self.fw.ipset.add_entries(ipset, entries)
+        if added:
+            self.EntriesAdded(ipset, added)
+        return added
+
+    @dbus_polkit_require_auth(config.dbus.PK_ACTION_CONFIG)
+    @dbus_service_method(config.dbus.DBUS_INTERFACE_IPSET, in_signature='sas',
+                         out_signature='as')
+    @dbus_handle_exceptions
+    def removeEntries(self, ipset, entries, sender=None):
+        # removes ipset entries, returns list of removed entries
+        ipset = dbus_to_python(ipset)
+        entries = dbus_to_python(entries, list)
+        log.debug1("ipset.removeEntries('%s', %d entries)", ipset,
+                   len(entries))
+        self.accessCheck(sender)
+        removed = self.fw.ipset.remove_entries(ipset, entries)
+        if removed:
+            self.EntriesRemoved(ipset, removed)
+        return removed
+
     @dbus_polkit_require_auth(config.dbus.PK_ACTION_INFO)
     @dbus_service_method(config.dbus.DBUS_INTERFACE_IPSET, in_signature='ss',
                          out_signature='b')
@@ -2613,6 +2861,7 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_IPSET, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def EntryAdded(self, ipset, entry):
         ipset = dbus_to_python(ipset)
         entry = dbus_to_python(entry)
@@ -2620,11 +2869,28 @@ class FirewallD(DbusServiceObject):
 
     @dbus.service.signal(config.dbus.DBUS_INTERFACE_IPSET, signature='ss')
     @dbus_handle_exceptions
+    @dbus_runtime_change
     def EntryRemoved(self, ipset, entry):
         ipset = dbus_to_python(ipset)
         entry = dbus_to_python(entry)
         log.debug1("ipset.EntryRemoved('%s', '%s')" % (ipset, entry))
 
+    @dbus.service.signal(config.dbus.DBUS_INTERFACE_IPSET, signature='sas')
+    @dbus_handle_exceptions
+    @dbus_runtime_change
+    def EntriesAdded(self, ipset, entries):
+        ipset = dbus_to_python(ipset)
+        log.debug1("ipset.EntriesAdded('%s', %d entries)", ipset,
+                   len(entries))
+
+    @dbus.service.signal(config.dbus.DBUS_INTERFACE_IPSET, signature='sas')
+    @dbus_handle_exceptions
+    @dbus_runtime_change
+    def EntriesRemoved(self, ipset, entries):
+        ipset = dbus_to_python(ipset)
+        log.debug1("ipset.EntriesRemoved('%s', %d entries)", ipset,
+                   len(entries))
+
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
     # HELPERS
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,111 @@
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Cache of credentials and authorizations of D-Bus senders"""
+
+from firewall.core.logger import log
+from firewall.dbus_utils import command_of_sender, context_of_sender, \
+    uid_of_sender, user_of_uid
+
+class SenderCache:
+    """Credentials and polkit authorizations per unique D-Bus name.
+
+    The credentials of a connection can not change and unique names are
+    never reused, so the entries of a sender stay valid until it leaves the
+    bus. They are dropped on NameOwnerChanged then.
+
+    Only granted polkit authorizations are cached, denials are always
+    checked again so that an interactive authentication can still be
+    started. Temporary authorizations (auth_*_keep) expire in polkit and
+    are not cached at all. All authorizations are dropped if polkit reports
+    a change or leaves the bus.
+    """
+    _polkit_name = "org.freedesktop.PolicyKit1"
+    _polkit_interface = "org.freedesktop.PolicyKit1.Authority"
+
+    def __init__(self):
+        self._bus = None
+        self._senders = { }
+        self._stats = dict.fromkeys(["polkit_hits", "polkit_misses",
+                                     "credential_hits", "credential_misses"],
+                                    0)
+
+    def _watch(self, bus):
+        if self._bus is bus:
+            return
+        self._bus = bus
+        bus.add_signal_receiver(handler_function=self._name_owner_changed,
+                                signal_name="NameOwnerChanged",
+                                dbus_interface="org.freedesktop.DBus")
+        bus.add_signal_receiver(handler_function=self.clear_authorizations,
+                                signal_name="Changed",
+                                dbus_interface=self._polkit_interface)
+
+    def _name_owner_changed(self, name, old_owner, new_owner):
+        if name == self._polkit_name:
+            self.clear_authorizations()
+        elif not new_owner:
+            self._senders.pop(name, None)
+
+    def clear(self):
+        self._senders.clear()
+
+    def clear_authorizations(self, *args): # pylint: disable=W0613
+        log.debug1("Dropping cached polkit authorizations")
+        for entry in self._senders.values():
+            entry.pop("polkit", None)
+
+    def statistics(self):
+        """Returns the hit and miss counters and the number of cached
+        senders."""
+        stats = dict(self._stats)
+        stats["senders"] = len(self._senders)
+        return stats
+
+    def _get(self, bus, sender, key, lookup):
+        if not sender.startswith(":"):
+            return lookup(bus, sender)
+        self._watch(bus)
+        entry = self._senders.get(sender)
+        if entry is not None and key in entry:
+            self._stats["credential_hits"] += 1
+            return entry[key]
+        self._stats["credential_misses"] += 1
+        value = lookup(bus, sender)
+        self._senders.setdefault(sender, { })[key] = value
+        return value
+
+    def uid(self, bus, sender):
+        return self._get(bus, sender, "uid", uid_of_sender)
+
+    def user(self, bus, sender):
+        uid = self.uid(bus, sender)
+        return self._get(bus, sender, "user",
+                         lambda _bus, _sender: user_of_uid(uid))
+
+    def context(self, bus, sender):
+        return self._get(bus, sender, "context", context_of_sender)
+
+    def command(self, bus, sender):
+        return self._get(bus, sender, "command", command_of_sender)
+
+    def is_authorized(self, sender, action_id):
+        """Returns True if action_id has been granted to sender before."""
+        entry = self._senders.get(sender)
+        if entry is not None and action_id in entry.get("polkit", ()):
+            self._stats["polkit_hits"] += 1
+            return True
+        self._stats["polkit_misses"] += 1
+        return False
+
+    def set_authorized(self, bus, sender, action_id, details):
+        """Remember that polkit granted action_id to sender. details are the
+        details returned by CheckAuthorization."""
+        if not sender.startswith(":") or \
+           "polkit.temporary_authorization_id" in details:
+            return
+        self._watch(bus)
+        entry = self._senders.setdefault(sender, { })
+        entry.setdefault("polkit", set()).add(action_id)
+
+sender_cache = SenderCache()
@@ -0,0 +1,57 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import os
+
+from firewall.core.io.config_cache import ConfigCache
+from firewall.core.io.service import service_reader
+
+SERVICE = """<?xml version="1.0" encoding="utf-8"?>
+<service>
+  <short>{}</short>
+  <port protocol="tcp" port="22"/>
+</service>
+"""
+
+
+def test_config_cache(tmp_path):
+    cache_file = str(tmp_path / "cache" / "config.cache")
+    path = str(tmp_path)
+    with open(os.path.join(path, "foo.xml"), "w") as f:
+        f.write(SERVICE.format("foo"))
+
+    def load():
+        cache = ConfigCache(cache_file)
+        cache.read()
+        file_id = cache.file_id(os.path.join(path, "foo.xml"))
+        key = ("service_reader", path, "foo.xml")
+        obj = cache.get(key, file_id)
+        cached = obj is not None
+        if not cached:
+            obj = service_reader("foo.xml", path)
+            cache.set(key, file_id, obj)
+        cache.write()
+        return (cached, obj)
+
+    (cached, obj) = load()
+    assert not cached
+    assert os.stat(cache_file).st_mode & 0o077 == 0
+
+    (cached, obj2) = load()
+    assert cached
+    assert obj2 is not obj
+    assert obj2.export_config() == obj.export_config()
+
+    # a changed file is parsed again
+    with open(os.path.join(path, "foo.xml"), "w") as f:
+        f.write(SERVICE.format("foo changed"))
+    (cached, obj) = load()
+    assert not cached
+    assert obj.short == "foo changed"
+
+    # unused entries are dropped
+    cache = ConfigCache(cache_file)
+    cache.read()
+    cache.write()
+    cache.read()
+    assert cache.get(("service_reader", path, "foo.xml"),
+                     cache.file_id(os.path.join(path, "foo.xml"))) is None
@@ -0,0 +1,37 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+from firewall.core.expiry import ExpiryQueue
+
+
+def test_expiry_queue():
+    queue = ExpiryQueue()
+    assert queue.next_deadline() is None
+    assert queue.pop_expired(100) == []
+
+    # deadlines are rounded up to whole ticks
+    assert queue.add(("public", "service", ("ssh",)), 10, 100.2) == 111
+    assert queue.add(("public", "port", ("80", "tcp")), 10, 100.7) == 111
+    assert queue.add(("work", "masquerade", ()), 5, 100.5) == 106
+    assert len(queue) == 3
+    assert queue.next_deadline() == 106
+    assert queue.pending(101) == [(("work", "masquerade", ()), 5),
+                                  (("public", "service", ("ssh",)), 10),
+                                  (("public", "port", ("80", "tcp")), 10)]
+
+    # removed and replaced entries are skipped
+    assert queue.remove(("work", "masquerade", ()))
+    assert not queue.remove(("work", "masquerade", ()))
+    assert queue.next_deadline() == 111
+    queue.add(("public", "service", ("ssh",)), 20, 101)
+    assert ("public", "service", ("ssh",)) in queue
+    assert len(queue) == 2
+
+    assert queue.pop_expired(110.9) == []
+    # all items of a tick expire together
+    queue.add(("public", "protocol", ("gre",)), 9, 101.5)
+    assert queue.pop_expired(111) == [("public", "port", ("80", "tcp")),
+                                      ("public", "protocol", ("gre",))]
+    assert queue.next_deadline() == 121
+    assert queue.pop_expired(200) == [("public", "service", ("ssh",))]
+    assert len(queue) == 0
+    assert queue.next_deadline() is None
@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import threading
+
+import pytest
+
+from firewall.core.fw_transaction import FirewallTransaction
+from firewall.core.ipXtables import common_reverse_rule
+from firewall.errors import FirewallError
+
+
+class _Backend:
+    def __init__(self, name):
+        self.name = name
+
+    def reverse_rule(self, rule):
+        return common_reverse_rule(rule)
+
+
+class _Firewall:
+    _concurrent_backends = True
+
+    def __init__(self, failing):
+        self.failing = failing
+        self.applied = []
+        self.threads = set()
+        self.barrier = threading.Barrier(3, action=self._applied_all,
+                                         timeout=5)
+
+    def _applied_all(self):
+        self.barrier = None
+
+    def get_backend_by_name(self, name):
+        return _Backend(name)
+
+    def rules(self, backend_name, rules):
+        self.threads.add(threading.current_thread())
+        if self.barrier is not None:
+            # all backends are applied at the same time
+            self.barrier.wait()
+        if backend_name == self.failing:
+            raise ValueError("%s failed" % backend_name)
+        self.applied.append((backend_name, rules))
+
+    def handle_modules(self, modules, enable):
+        return None
+
+
+def test_transaction_concurrent():
+    fw = _Firewall(None)
+    transaction = FirewallTransaction(fw)
+    for name in ["ip4tables", "ip6tables", "ebtables"]:
+        transaction.add_rule(_Backend(name), ["-t", "filter", "-N", "foo"])
+    transaction.execute(True)
+    assert len(fw.applied) == 3
+
+
+def test_transaction_concurrent_rollback():
+    fw = _Firewall("ebtables")
+    failed = []
+    transaction = FirewallTransaction(fw)
+    for name in ["ip4tables", "ip6tables", "ebtables"]:
+        transaction.add_rules(_Backend(name),
+                              [["-t", "filter", "-N", "foo"],
+                               ["-t", "filter", "-I", "foo", "1", "-j", "ACCEPT"]])
+    transaction.add_fail(failed.append, "fail")
+
+    with pytest.raises(FirewallError):
+        transaction.execute(True)
+
+    reverse = [["-t", "filter", "-D", "foo", "-j", "ACCEPT"],
+               ["-t", "filter", "-X", "foo"]]
+    assert sorted(fw.applied[2:]) == [("ip4tables", reverse),
+                                      ("ip6tables", reverse)]
+    assert failed == ["fail"]
+
+
+def test_transaction_not_reversible():
+    # rules that remove something can not be rolled back, the backends are
+    # applied one by one
+    fw = _Firewall("ebtables")
+    fw.barrier = None
+    transaction = FirewallTransaction(fw)
+    for name in ["ip4tables", "ip6tables", "ebtables"]:
+        transaction.add_rules(_Backend(name),
+                              [["-t", "filter", "-N", "foo"],
+                               ["-t", "filter", "-F", "foo"]])
+
+    with pytest.raises(FirewallError):
+        transaction.execute(True)
+
+    assert fw.threads == {threading.current_thread()}
+    assert [backend_name for (backend_name, _) in fw.applied] == \
+        ["ip4tables", "ip6tables"]
@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import pytest
+
+from firewall.core.io.ipset import IPSet
+from firewall.core import ipset as ipset_module
+from firewall.core.ipset import IPSetEntries
+from firewall.errors import FirewallError
+
+
+def test_ipset_entries():
+    entries = IPSetEntries(["10.0.0.0/8", "1.2.3.4", "fe80::/64"])
+    assert list(entries) == ["10.0.0.0/8", "1.2.3.4", "fe80::/64"]
+    assert "1.2.3.4" in entries
+    assert len(entries) == 3
+
+    # contained in an existing entry
+    assert entries.get_overlapping("10.1.0.0/16") == "10.0.0.0/8"
+    assert entries.get_overlapping("10.1.2.3") == "10.0.0.0/8"
+    # containing an existing entry
+    assert entries.get_overlapping("1.2.0.0/16") == "1.2.3.4"
+    assert entries.get_overlapping("fe80::1") == "fe80::/64"
+    assert entries.get_overlapping("11.0.0.0/8") is None
+    assert entries.get_overlapping("1.2.3.5") is None
+    # non network entries are never considered overlapping
+    assert entries.get_overlapping("00:11:22:33:44:55") is None
+    assert entries.get_overlapping("1.2.3.4,tcp:80") is None
+
+    with pytest.raises(FirewallError):
+        entries.check_overlaps("10.0.0.0/24")
+
+    entries.remove("10.0.0.0/8")
+    assert entries.get_overlapping("10.1.0.0/16") is None
+    entries.add("10.1.0.0/16")
+    assert entries.get_overlapping("10.0.0.0/8") == "10.1.0.0/16"
+    assert list(entries) == ["1.2.3.4", "fe80::/64", "10.1.0.0/16"]
+
+
+def test_ipset_entries_view():
+    obj = IPSet()
+    obj.type = "hash:ip"
+    obj.entries = ["1.2.3.4", "5.6.7.8"]
+    view = obj.entries
+    assert "1.2.3.4" in view and len(view) == 2
+    with pytest.raises(AttributeError):
+        view.append("9.9.9.9")
+    obj.add_entry("9.9.9.9")
+    assert list(view) == ["1.2.3.4", "5.6.7.8", "9.9.9.9"]
+
+    # the export is a copy
+    conf = obj.export_config()
+    assert conf[5] == ["1.2.3.4", "5.6.7.8", "9.9.9.9"]
+    conf[5].append("10.0.0.1")
+    assert obj.export_config_dict()["entries"] == list(view)
+
+
+def test_ipset_replace_entries_shadow_name(monkeypatch):
+    restored = []
+
+    def run_prog_stream(prog, argv=None, lines=()):
+        restored.extend(lines)
+        return (0, "")
+
+    monkeypatch.setattr(ipset_module, "runProg",
+                        lambda prog, argv=None: (0, "foo\nfwshadow-x\n"))
+    monkeypatch.setattr(ipset_module, "runProgStream", run_prog_stream)
+
+    ipset_module.ipset().set_replace_entries("foo", "hash:ip", ["1.2.3.4"])
+    shadow = restored[1].split()[1]
+    assert shadow.startswith("fwshadow-") and len(shadow) < 32
+    assert restored == ["create foo hash:ip -exist\n",
+                        "create %s hash:ip\n" % shadow,
+                        "add %s 1.2.3.4\n" % shadow,
+                        "swap foo %s\n" % shadow,
+                        "destroy %s\n" % shadow]
+
+
+def test_ipset_replace_entries_shadow_cleanup(monkeypatch):
+    sets = ["foo"]
+    commands = []
+
+    def run_prog(prog, argv=None):
+        commands.append(argv)
+        if argv[0] == "destroy":
+            sets.remove(argv[1])
+        return (0, "\n".join(sets))
+
+    def run_prog_stream(prog, argv=None, lines=()):
+        for line in lines:
+            if line.startswith("add "):
+                return (1, "bad entry")
+            if line.startswith("create ") and line.split()[1] not in sets:
+                sets.append(line.split()[1])
+        return (0, "")
+
+    monkeypatch.setattr(ipset_module, "runProg", run_prog)
+    monkeypatch.setattr(ipset_module, "runProgStream", run_prog_stream)
+
+    with pytest.raises(ValueError):
+        ipset_module.ipset().set_replace_entries("foo", "hash:ip",
+                                                 ["1.2.3.4"])
+    assert sets == ["foo"]
+    assert commands[-1][0] == "destroy"
@@ -0,0 +1,53 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import pytest
+
+from firewall.core.io.ipset import IPSet, ipset_reader, ipset_writer
+from firewall.errors import FirewallError
+
+
+def test_ipset_entries_file(tmp_path):
+    (tmp_path / "blocklist.xml").write_text(
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<ipset type="hash:net">\n'
+        '  <entry>10.0.0.0/8</entry>\n'
+        '  <entries file="blocklist.txt"/>\n'
+        '</ipset>\n')
+    (tmp_path / "blocklist.txt").write_text(
+        "# comment\n"
+        "\n"
+        "  192.168.1.0/24\n"
+        "10.0.0.0/8\n"
+        "1.2.3.4/0\n"
+        "1.2.3.4-1.2.3.9\n"
+        "256.1.1.1\n")
+
+    obj = ipset_reader("blocklist.xml", str(tmp_path))
+    assert obj.entries_file == "blocklist.txt"
+    assert list(obj.entries) == ["10.0.0.0/8", "192.168.1.0/24", "1.2.3.4-1.2.3.9"]
+
+    # all entries are written to the entries file
+    obj.add_entry("1.2.3.4")
+    ipset_writer(obj)
+    assert "<entry>" not in (tmp_path / "blocklist.xml").read_text()
+    assert (tmp_path / "blocklist.txt").read_text() == \
+        "10.0.0.0/8\n192.168.1.0/24\n1.2.3.4-1.2.3.9\n1.2.3.4\n"
+    assert list(ipset_reader("blocklist.xml", str(tmp_path)).entries) == \
+        list(obj.entries)
+
+    (tmp_path / "other.xml").write_text(
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<ipset type="hash:ip"><entries file="../blocklist.txt"/></ipset>\n')
+    with pytest.raises(FirewallError):
+        ipset_reader("other.xml", str(tmp_path))
+
+
+def test_ipset_check_entries():
+    entries = ["1.2.3.4", "0.0.0.0", "1.2.3.4", "1.2.3.04", "1.2.3.0/24",
+               "1.2.3.4-1.2.3.5", "1.2.3.4/33", "::1"]
+    assert IPSet.check_entries(entries, {}, "hash:ip") == \
+        ["1.2.3.4", "1.2.3.0/24", "1.2.3.4-1.2.3.5"]
+    assert IPSet.check_entries(["::1", "1.2.3.4", "::/64"],
+                               {"family": "inet6"}, "hash:net") == \
+        ["::1", "::/64"]
+    assert IPSet.check_entries([], {}, "hash:net") == []
@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+from firewall.core.io.ipset import IPSet, ipset_reader, ipset_writer, \
+    ipset_journal_append
+
+
+def test_ipset_journal(tmp_path):
+    obj = IPSet()
+    obj.name = "blocklist"
+    obj.filename = "blocklist.xml"
+    obj.path = str(tmp_path)
+    obj.type = "hash:net"
+    obj.entries = ["10.0.0.0/8", "192.168.1.0/24"]
+    ipset_writer(obj)
+    journal = tmp_path / "blocklist.xml.journal"
+
+    ipset_journal_append(obj, "1.2.3.4", True)
+    ipset_journal_append(obj, "10.0.0.0/8", False)
+    ipset_journal_append(obj, "5.6.7.8", True)
+    ipset_journal_append(obj, "5.6.7.8", False)
+    assert obj.journal_records == 4
+
+    loaded = ipset_reader("blocklist.xml", str(tmp_path))
+    assert list(loaded.entries) == ["192.168.1.0/24", "1.2.3.4"]
+    assert loaded.journal_records == 4
+
+    # an incomplete record is ignored and dropped by the next append
+    with open(journal, "a") as f:
+        f.write("+10.0.0.1")
+    assert list(ipset_reader("blocklist.xml", str(tmp_path)).entries) == \
+        ["192.168.1.0/24", "1.2.3.4"]
+    ipset_journal_append(loaded, "10.0.0.2", True)
+    assert list(ipset_reader("blocklist.xml", str(tmp_path)).entries) == \
+        ["192.168.1.0/24", "1.2.3.4", "10.0.0.2"]
+
+    # writing the ipset merges the journal
+    loaded.add_entry("10.0.0.2")
+    ipset_writer(loaded)
+    assert not journal.exists()
+    assert loaded.journal_records == 0
+    loaded = ipset_reader("blocklist.xml", str(tmp_path))
+    assert list(loaded.entries) == ["192.168.1.0/24", "1.2.3.4", "10.0.0.2"]
+    assert loaded.journal_records == 0
+
+
+def test_ipset_journal_base(tmp_path):
+    obj = IPSet()
+    obj.name = "blocklist"
+    obj.filename = "blocklist.xml"
+    obj.path = str(tmp_path)
+    obj.type = "hash:net"
+    obj.entries = ["10.0.0.0/8"]
+    ipset_writer(obj)
+    journal = tmp_path / "blocklist.xml.journal"
+    ipset_journal_append(obj, "1.2.3.4", True)
+    assert journal.read_text().startswith("#base ")
+
+    # the ipset file has been edited, the journal does not apply to it
+    (tmp_path / "blocklist.xml").write_text(
+        '<?xml version="1.0" encoding="utf-8"?>\n<ipset type="hash:net">'
+        '<entry>172.16.0.0/12</entry><entry>192.168.0.0/16</entry></ipset>\n')
+    loaded = ipset_reader("blocklist.xml", str(tmp_path))
+    assert list(loaded.entries) == ["172.16.0.0/12", "192.168.0.0/16"]
+    assert loaded.journal_records == 0
+
+    # and it is replaced by the next append
+    ipset_journal_append(loaded, "5.6.7.8", True)
+    assert journal.read_text().count("\n") == 2
+    assert list(ipset_reader("blocklist.xml", str(tmp_path)).entries) == \
+        ["172.16.0.0/12", "192.168.0.0/16", "5.6.7.8"]
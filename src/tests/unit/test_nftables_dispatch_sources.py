@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import ipaddress
+import random
+
+import pytest
+
+pytest.importorskip("nftables")
+
+from firewall.core.fw_transaction import FirewallUndoLog  # noqa: E402
+from firewall.core.nftables import nftables  # noqa: E402
+from firewall.core.sorted_list import SortedList  # noqa: E402
+
+
+def _backend():
+    backend = nftables.__new__(nftables)
+    backend.dispatch_sources = {"s": SortedList()}
+    backend.dispatch_source_elements = {"s": SortedList()}
+    return backend
+
+
+def test_dispatch_sources():
+    backend = _backend()
+    rand = random.Random(0)
+    sources = []
+    nft_elements = set()
+
+    for i in range(500):
+        undo = FirewallUndoLog()
+        if sources and rand.random() < 0.4:
+            source = sources.pop(rand.randrange(len(sources)))
+            (removed, added) = backend._dispatch_source_remove("s", source, undo)
+        else:
+            prefix_len = rand.choice([16, 23, 24, 25, 31, 32])
+            address = 0x0a000000 | rand.getrandbits(20) << 4
+            source = str(ipaddress.ip_network((address, prefix_len), strict=False))
+            sources.append(source)
+            (removed, added) = backend._dispatch_source_add("s", source, undo)
+            if rand.random() < 0.1:
+                undo.rollback()
+                sources.pop()
+                (removed, added) = ([], [])
+
+        nft_elements.difference_update(key[2] for key in removed)
+        nft_elements.update(key[2] for key in added)
+        networks = [ipaddress.ip_network(source) for source in sources]
+        expected = list(ipaddress.collapse_addresses(networks))
+        assert [key[2] for key in backend.dispatch_source_elements["s"]] == expected
+        assert sorted(nft_elements) == expected
+
+    backend = _backend()
+    undo = FirewallUndoLog()
+    backend._dispatch_source_add("s", "10.0.0.0/25", undo)
+    assert backend._dispatch_source_element_rules(
+        "s", *backend._dispatch_source_add("s", "10.0.0.128/25", undo)) == \
+        [{"delete": {"element": {"family": "inet", "table": "firewalld", "name": "s",
+                                 "elem": [{"prefix": {"addr": "10.0.0.0", "len": 25}}]}}},
+         {"add": {"element": {"family": "inet", "table": "firewalld", "name": "s",
+                              "elem": [{"prefix": {"addr": "10.0.0.0", "len": 24}}]}}}]
+    assert backend._dispatch_source_element_rules(
+        "s", *backend._dispatch_source_add("s", "10.0.0.1", undo)) == []
@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import json
+
+import pytest
+
+pytest.importorskip("nftables")
+
+from firewall.core.nftables import nftables  # noqa: E402
+
+
+class _IPSet:
+    def __init__(self, name, type, entries, options=None):
+        self.name = name
+        self.type = type
+        self.entries = entries
+        self.options = options or {}
+
+
+class _FirewallIPSet:
+    def __init__(self):
+        self.ipsets = {}
+
+    def get_ipset(self, name):
+        return self.ipsets[name]
+
+
+class _Firewall:
+    def __init__(self):
+        self.ipset = _FirewallIPSet()
+
+
+class _Nftables:
+    """Records the commands instead of calling libnftables."""
+    def __init__(self):
+        self.commands = []
+
+    def set_echo_output(self, value):
+        return True
+
+    def set_json_output(self, value):
+        return False
+
+    def cmd(self, text):
+        self.commands.append(text)
+        return (0, "", "")
+
+
+def _backend(*ipsets):
+    fw = _Firewall()
+    for obj in ipsets:
+        fw.ipset.ipsets[obj.name] = obj
+    backend = nftables(fw)
+    backend.nftables = _Nftables()
+    return backend
+
+
+def test_set_restore():
+    ipsets = [_IPSet("a", "hash:net", ["10.0.0.0/8", "1.2.3.4", "1.2.3.4-1.2.3.9"]),
+              _IPSet("b", "hash:ip", ["1::1", "1::/64"], {"family": "inet6"}),
+              _IPSet("c", "hash:ip,port", ["1.2.3.4,tcp:80", "1.2.3.5,udp:1-5", "1.2.3.6,99"]),
+              _IPSet("d", "hash:mac", ["00:11:22:33:44:55"]),
+              _IPSet("e", "hash:net", [])]
+    backend = _backend(*ipsets)
+
+    for obj in ipsets:
+        backend.set_restore(obj.name, obj.type, obj.entries, obj.options)
+        assert len(backend.nftables.commands) == 1
+        restored = json.loads(backend.nftables.commands.pop())
+        expected = [{"metainfo": {"json_schema_version": 1}}]
+        expected += backend.build_set_create_rules(obj.name, obj.type, obj.options)
+        expected += backend.build_set_flush_rules(obj.name)
+        expected += backend.build_set_elements_rules("add", obj.name, obj.entries)
+        assert restored == {"nftables": expected}
+
+
+def test_set_restore_batches(monkeypatch):
+    monkeypatch.setattr("firewall.core.nftables.SET_RESTORE_BATCH_SIZE", 2)
+    obj = _IPSet("a", "hash:ip", ["1.2.3.%d" % i for i in range(5)])
+    backend = _backend(obj)
+
+    backend.set_restore(obj.name, obj.type, obj.entries, obj.options)
+    assert len(backend.nftables.commands) == 3
+    restored = [json.loads(command)["nftables"]
+                for command in backend.nftables.commands]
+    create_rules = backend.build_set_create_rules(obj.name, obj.type, obj.options)
+    create_rules += backend.build_set_flush_rules(obj.name)
+    assert restored[0][1:-1] == create_rules
+    for (i, rules) in enumerate(restored):
+        assert rules[0] == {"metainfo": {"json_schema_version": 1}}
+        assert rules[-1] == backend.build_set_elements_rules(
+            "add", obj.name, obj.entries[i * 2:i * 2 + 2])[0]
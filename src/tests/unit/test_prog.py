@@ -0,0 +1,27 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import shutil
+
+import pytest
+
+from firewall.core.prog import runProgStream, STREAM_CHUNK_SIZE
+
+cat = shutil.which("cat")
+pytestmark = pytest.mark.skipif(cat is None, reason="cat is not available")
+
+
+def test_run_prog_stream():
+    # more output than fits into a pipe buffer
+    lines = ["line %d\n" % i for i in range(4 * STREAM_CHUNK_SIZE // 8)]
+    assert runProgStream(cat, [], iter(lines)) == (0, "".join(lines))
+    assert runProgStream(cat, [], ["#foo"]) == (0, "#foo")
+    assert runProgStream("/nonexistent/prog") == (255, "")
+
+
+def test_run_prog_stream_generator_error():
+    def lines():
+        yield "a\n"
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        runProgStream(cat, [], lines())
@@ -0,0 +1,79 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import shlex
+
+import pytest
+
+from firewall.core.rich import Rich_Rule
+from firewall.errors import FirewallError
+
+# rules from tests/python/firewalld_rich.py
+RULES = [
+    'rule service name=ftp audit limit value="1/m" accept ',
+    'rule protocol value=ah accept ',
+    'rule protocol value=esp accept ',
+    'rule family=ipv4 source address="192.168.0.0/24" service name=tftp log prefix=tftp level=info limit value=1/m accept',
+    'rule family=ipv4 source not address=192.168.0.0/24 service name=dns log prefix=dns level=info limit value=2/m accept ',
+    'rule family=ipv6 source address=1:2:3:4:6:: service name=radius log prefix=dns level=info limit value=3/m reject limit value=20/m ',
+    'rule family=ipv6 source address=1:2:3:4:5:: port port=4011 protocol=tcp log prefix="port 4011/tcp" level=info limit value=4/m drop ',
+    'rule family=ipv6 source address=1:2:3:4:6:: forward-port port=4011 protocol=tcp to-port=4012 to-addr=1::2:3:4:7 ',
+    'rule family=ipv4 source address=192.168.0.0/24 icmp-block name=source-quench log level=info prefix=source-quench limit value=4/m ',
+    'rule family=ipv6 source address=1:2:3:4:6:: icmp-block name=redirect log prefix=redirect level=info limit value=4/m ',
+    'rule family=ipv4 source address=192.168.1.0/24 masquerade ',
+    'rule family=ipv6 masquerade ',
+]
+
+# strings with quoting and escaping that the lexer splits like shlex
+LEXER_STRINGS = [
+    'rule log prefix="a b"  accept',
+    "rule log prefix='a \"b' accept",
+    'rule log prefix="a \\"b\\\\" accept',
+    'rule log prefix=a\\ b"c"\'d\' accept',
+    'rule log prefix=a"" accept',
+    '  rule   accept  ',
+]
+
+
+def _parse(rule_str):
+    rule = Rich_Rule.__new__(Rich_Rule)
+    rule._import_from_string(rule_str)
+    return rule
+
+
+def test_rich_lexer():
+    rule = Rich_Rule.__new__(Rich_Rule)
+    for rule_str in RULES + LEXER_STRINGS:
+        words = [element if element is not None else "%s=%s" % (name, value)
+                 for (element, name, value) in rule._lexer(rule_str)]
+        assert words == shlex.split(rule_str) + ["EOL"]
+
+    for rule_str in ['rule log prefix="a accept', "rule log prefix='a",
+                     'rule accept \\']:
+        with pytest.raises(ValueError):
+            rule._lexer(rule_str)
+    with pytest.raises(FirewallError, match="internal error in _lexer"):
+        rule._lexer('rule priority=1=2 accept')
+
+
+def test_rich_parser():
+    for rule_str in RULES:
+        rule = _parse(rule_str)
+        assert str(_parse(str(rule))) == str(rule)
+
+    rule = _parse(RULES[6])
+    assert rule.family == "ipv6"
+    assert rule.source.addr == "1:2:3:4:5::"
+    assert rule.element.port == "4011"
+    assert rule.log.prefix == "port 4011/tcp"
+    assert rule.log.limit.value == "4/m"
+
+    for (rule_str, msg) in [
+            ('rule bogus accept', "unknown element bogus"),
+            ('rule foo=bar accept', "bad attribute 'foo'"),
+            ('family=ipv4 rule accept', "'family' outside of rule"),
+            ('rule service name=ssh port port=22 protocol=tcp accept',
+             "more than one element"),
+            ('rule', "no element, no action"),
+            ('   ', "empty rule")]:
+        with pytest.raises(FirewallError, match=msg):
+            _parse(rule_str)
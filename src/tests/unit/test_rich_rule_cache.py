@@ -0,0 +1,49 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import pytest
+
+from firewall.core.rich import Rich_Rule
+from firewall.errors import FirewallError
+
+
+def test_rich_rule_cache():
+    rule_str = 'rule   family=ipv4 source address="10.0.0.0/8" service name=ssh accept'
+    rule = Rich_Rule(rule_str=rule_str)
+    normalized = str(rule)
+    assert normalized == 'rule family="ipv4" source address="10.0.0.0/8" service name="ssh" accept'
+
+    assert rule_str in Rich_Rule._cache
+    assert str(Rich_Rule(rule_str=rule_str)) == normalized
+    assert str(Rich_Rule(rule_str=normalized)) == normalized
+
+    # attributes set on one rule do not show up in others
+    rule.priority = 5
+    assert Rich_Rule(rule_str=rule_str).priority == 0
+
+    # invalid rules are not cached
+    for i in range(2):
+        with pytest.raises(FirewallError):
+            Rich_Rule(rule_str="rule bogus")
+    assert "rule bogus" not in Rich_Rule._cache
+
+
+def test_rich_rule_cache_copies():
+    rule_str = 'rule family=ipv6 source address=1:2:3:4:5:: port port=4011 protocol=tcp log prefix="port 4011/tcp" level=info limit value=4/m drop'
+    rule = Rich_Rule(rule_str=rule_str)
+    cached = Rich_Rule(rule_str=rule_str)
+    assert str(cached) == str(rule)
+    assert cached.source is not rule.source
+    assert cached.log.limit is not rule.log.limit
+
+    rule.log.limit.value = "1/s"
+    assert Rich_Rule(rule_str=rule_str).log.limit.value == "4/m"
+
+
+def test_rich_rule_cache_quoted():
+    # str() does not escape the quote, so it parses to a different prefix
+    rule = Rich_Rule(rule_str=r'rule service name=ssh log prefix="a b \\\" c" accept')
+    assert rule.log.prefix == r'a b \" c'
+    rule_str = str(rule)
+    assert rule_str == r'rule service name="ssh" log prefix="a b \" c" accept'
+    assert rule_str not in Rich_Rule._cache
+    assert Rich_Rule(rule_str=rule_str).log.prefix == 'a b " c'
@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import pytest
+
+pytest.importorskip("dbus")
+
+from firewall.server import sender_cache as sender_cache_module  # noqa: E402
+from firewall.server.sender_cache import SenderCache  # noqa: E402
+
+
+class _Bus:
+    def __init__(self):
+        self.receivers = {}
+
+    def add_signal_receiver(self, handler_function, signal_name,
+                            dbus_interface):
+        self.receivers[signal_name] = handler_function
+
+
+def test_sender_cache(monkeypatch):
+    lookups = []
+
+    def uid_of_sender(bus, sender):
+        lookups.append(("uid", sender))
+        return 1000
+
+    monkeypatch.setattr(sender_cache_module, "uid_of_sender", uid_of_sender)
+    monkeypatch.setattr(sender_cache_module, "user_of_uid",
+                        lambda uid: "user%d" % uid)
+
+    bus = _Bus()
+    cache = SenderCache()
+    for _ in range(3):
+        assert cache.uid(bus, ":1.5") == 1000
+        assert cache.user(bus, ":1.5") == "user1000"
+    assert lookups == [("uid", ":1.5")]
+
+    # well-known names are not cached
+    cache.uid(bus, "org.example")
+    cache.uid(bus, "org.example")
+    assert len(lookups) == 3
+
+    # only granted and not temporary authorizations are cached
+    assert not cache.is_authorized(":1.5", "action")
+    cache.set_authorized(bus, ":1.5", "action", {})
+    cache.set_authorized(bus, ":1.5", "temp",
+                         {"polkit.temporary_authorization_id": "tmp1"})
+    assert cache.is_authorized(":1.5", "action")
+    assert not cache.is_authorized(":1.5", "temp")
+
+    bus.receivers["Changed"]()
+    assert not cache.is_authorized(":1.5", "action")
+    assert cache.uid(bus, ":1.5") == 1000
+
+    cache.set_authorized(bus, ":1.5", "action", {})
+    bus.receivers["NameOwnerChanged"](":1.5", ":1.5", "")
+    assert not cache.is_authorized(":1.5", "action")
+    cache.uid(bus, ":1.5")
+    assert len(lookups) == 4
+
+    stats = cache.statistics()
+    assert stats == {"polkit_hits": 1, "polkit_misses": 4,
+                     "credential_hits": 8, "credential_misses": 3,
+                     "senders": 1}
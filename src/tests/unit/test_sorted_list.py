@@ -0,0 +1,38 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import pytest
+
+from firewall.core.sorted_list import SortedList
+
+
+def test_sorted_list():
+    sl = SortedList([5, 1, 3])
+    assert list(sl) == [1, 3, 5]
+
+    assert sl.add(3) == 2
+    assert sl.add(0) == 0
+    assert list(sl) == [0, 1, 3, 3, 5]
+
+    assert sl.count_lower(3) == 2
+    assert sl.count_lower_or_equal(3) == 4
+    assert sl.count_lower(4) == 4
+    assert sl.count_lower_or_equal(4) == 4
+
+    assert 3 in sl
+    assert 4 not in sl
+    assert sl.index(3) == 2
+
+    sl.remove(3)
+    assert list(sl) == [0, 1, 3, 5]
+    with pytest.raises(ValueError):
+        sl.remove(4)
+    with pytest.raises(ValueError):
+        sl.index(4)
+
+
+def test_sorted_list_tuples():
+    sl = SortedList()
+    for t in [(1, "b"), (0, "z"), (1, "a")]:
+        sl.add(t)
+    assert list(sl) == [(0, "z"), (1, "a"), (1, "b")]
+    assert sl.index((1, "b")) == 2